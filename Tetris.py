@@ -1,36 +1,37 @@
 # Tetris game
 # (c) 2018 Tingda Wang
 
-import pygame, sys, random, time
+import pygame, sys, random, time, os, argparse, math, atexit
 from pygame.locals import *
 
+from rules import BOARD_W, BOARD_H
+from engine import (Engine, TICK_RATE, MAX_CATCH_UP, LEFT, RIGHT, DOWN, ROTATE, ROTATE_BACK, DROP,
+                    RELEASE_LEFT, RELEASE_RIGHT, RELEASE_DOWN)
+from replay import Recorder
+from render import SQ_SIZE, TEXT_CACHE, Theme, BoardView, Renderer
+from instrument import Profiler, instrument_game
+from assets import Assets
+from ai import Bot
+
 # Game Object Constants
-FPS = 30
+FRAME_RATE = 60 # frames a second while pieces are drawn falling smoothly
 WIN_W = 640 # in pixels
 WIN_H = 480 # in pixels
-SQ_SIZE = 20
-BOARD_W = 10 # in squares
-BOARD_H = 20 # in squares
-NIL = '.' # nothin'
+NAME = 'tetris' # replay file names
 
 # board margins within window
 SIDE_MARGINS = int((WIN_W - (BOARD_W * SQ_SIZE)) / 2)
 TOP_MARGIN = WIN_H - (BOARD_H * SQ_SIZE) - 5
+# where frame timings go when profiling, left of the board and below the score
+PROFILE_AREA = pygame.Rect(5, 220, SIDE_MARGINS - 10, WIN_H - 225)
 
-''' Difficulty constants'''
-# how fast piece moves (FALL_FREQ not constant, will change based on difficulty)
-SIDEWAY_FREQ = 0.15
-DOWN_FREQ = 0.1
-# inverse of rate in which blocks speed up (the lower the faster)
-ACCELERATION = 5 
-
-# Fonts
+# Fonts, relative to the game's directory
 FONT_SIZE = 25
 SMALL = 'game_font/thin_pixel.ttf'
 BIG = 'game_font/arcadeclassic.ttf'
 TITLE = 'game_font/tetro.ttf'
 
-# Music!
+# Music! also relative to the game's directory
 MUSIC = ('game_music/theme.ogg', 'game_music/sad_tetris.mp3', 'game_music/scary_tetris.mp3')
 
 # Colors!
@@ -76,153 +77,40 @@ TEXT_COLOR = WHITE
 TEXT_SHADOW = GRAY
 TITLE_COLOR = LIGHT_AQUA
 TITLE_SHADOW = LIGHT_RED
+THEME = Theme(DARK_COLORS, LIGHT_COLORS, BACKGROUND, BORDER, BORDER_SHADE, TEXT_COLOR)
 
-# Templates for each shape
-TEMPLATE_W = 5
-TEMPLATE_H = 5
-
-S_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '..OO.',
-                     '.OO..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '...O.',
-                     '.....']]
-
-Z_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '.O...',
-                     '.....']]
-
-I_SHAPE_TEMPLATE = [['..O..',
-                     '..O..',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     'OOOO.',
-                     '.....',
-                     '.....']]
-
-O_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '.OO..',
-                     '.....']]
-
-J_SHAPE_TEMPLATE = [['.....',
-                     '.O...',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..OO.',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '...O.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '.OO..',
-                     '.....']]
-
-L_SHAPE_TEMPLATE = [['.....',
-                     '...O.',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '.O...',
-                     '.....'],
-                    ['.....',
-                     '.OO..',
-                     '..O..',
-                     '..O..',
-                     '.....']]
-
-T_SHAPE_TEMPLATE = [['.....',
-                     '..O..',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '..O..',
-                     '.....']]
-
-# dictionary to get corresponding piece template
-PIECES = {
-    'S': S_SHAPE_TEMPLATE,
-    'Z': Z_SHAPE_TEMPLATE,
-    'J': J_SHAPE_TEMPLATE,
-    'L': L_SHAPE_TEMPLATE,
-    'I': I_SHAPE_TEMPLATE,
-    'O': O_SHAPE_TEMPLATE,
-    'T': T_SHAPE_TEMPLATE
-    }
-
-class Piece:
-    ''' Piece class that stores shape, rotation, color and coordinate of piece'''
-
-    def __init__(self): 
-        ''' initializes empty piece starting in the middle top of board'''
-        self.shape = None
-        self.rotation = 0
-        self.x = int(BOARD_W / 2) - int(TEMPLATE_W / 2)
-        self.y = -2
-        self.color = None
-    
-    def get_random(self): 
-        ''' randomizes shape, rotation, and color'''
-        self.shape = random.choice(list(PIECES.keys()))
-        self.rotation = random.randint(0, len(PIECES[self.shape]) - 1)
-        self.color = random.randint(0, len(LIGHT_COLORS) - 1)
-        return self
+# Controls, keys pressed and released map onto engine actions
+KEY_ACTIONS = {K_LEFT: LEFT, K_a: LEFT, K_RIGHT: RIGHT, K_d: RIGHT, K_DOWN: DOWN, K_s: DOWN,
+               K_UP: ROTATE, K_w: ROTATE, K_e: ROTATE_BACK, K_q: ROTATE_BACK, K_SPACE: DROP}
+KEY_RELEASES = {K_LEFT: RELEASE_LEFT, K_a: RELEASE_LEFT, K_RIGHT: RELEASE_RIGHT, K_d: RELEASE_RIGHT,
+                K_DOWN: RELEASE_DOWN, K_s: RELEASE_DOWN}
 
 class Tetris:
     ''' Tetris class'''
 
-    def __init__(self):
-        ''' initializes pygame settings'''
+    def __init__(self, record = None, smooth = False, profile = None, autoplay = False):
+        '''
+        initializes pygame settings
+        record is a directory to save a replay of every game in, or None
+        smooth draws pieces falling between levels, redrawing at FRAME_RATE
+        profile is a .csv or .json file to save the timings of every frame in, or None
+        autoplay lets the computer play instead of the keyboard
+        '''
         pygame.init()
+        # fonts and music are read on their own thread while the window is set up
+        self.assets = Assets((SMALL, BIG, TITLE), MUSIC)
+        self.record = record
+        self.smooth = smooth
+        self.autoplay = autoplay
         random.seed(1998)
-        
-        # FPS clock
-        self.clock = pygame.time.Clock()
 
+        # opt-in timings of every frame, shown on screen and saved on exit
+        self.profiler = None
+        if profile is not None:
+            self.profiler = Profiler()
+            instrument_game(self.profiler)
+            atexit.register(self.profiler.save, profile)
+        
         # display surface
         self.display = pygame.display.set_mode((WIN_W, WIN_H))
         pygame.display.set_caption('Tetris - wtingda')
@@ -232,41 +120,34 @@ class Tetris:
 
         # fonts
         if pygame.font:                                 
-            self.font = pygame.font.Font(SMALL, FONT_SIZE)           
-            self.large_font = pygame.font.Font(BIG, FONT_SIZE * 3)
-            self.title_font = pygame.font.Font(TITLE, FONT_SIZE * 4)
+            self.font = self.assets.get_font(SMALL, FONT_SIZE)
+            self.large_font = self.assets.get_font(BIG, FONT_SIZE * 3)
+            self.title_font = self.assets.get_font(TITLE, FONT_SIZE * 4)
         else:      
             self.font = None  
             self.large_font = None
 
+        # draws the board, score and next piece
+        view = BoardView(SIDE_MARGINS, TOP_MARGIN, (80, 140), (80, 180), (WIN_W - 160, 140), (WIN_W - 150, 170))
+        self.renderer = Renderer(self.display, THEME, self.font, [view], smooth = smooth)
+
     def run(self):
         ''' main game loop, with music!'''
         self.display.fill(BACKGROUND)
         self.display_text("Tetris", title = True)
         while True: 
             self.music()
-
-            # difficulty variables
-            self.score = 0
-            self.difficulty = self.speed = 0
-            self.set_difficulty() # sets these values
-
             self.play()
-            pygame.mixer.music.stop()
+            self.assets.stop_music()
             self.display_text('Game Over')
 
     def music(self):
-        ''' plays music randomly'''
-        if pygame.mixer.music.get_busy():
-            pygame.mixer.music.stop()
-        
-        # plays random music
-        pygame.mixer.music.load(random.choice(MUSIC))
-        pygame.mixer.music.play(-1, 0.0) # infinite loops, start at beginning
+        ''' plays music randomly, swapped in without holding up the frame'''
+        self.assets.play_music()
 
     def get_textobj(self, text, font, color):
         ''' helper for creating text objects'''
-        surf = font.render(text, True, color)
+        surf = TEXT_CACHE.render(font, text, color)
         return surf, surf.get_rect()
 
     def display_text(self, text, title = False): 
@@ -295,292 +176,143 @@ class Tetris:
         title_rect.center = (int(WIN_W / 2), int(WIN_H / 2) - 80)
         self.display.blit(title_surf, title_rect)
         
-        # wait for keyboard hit to continue
-        while self.hit_kb() is None:
-            pygame.display.update()
-            self.clock.tick()
+        # sleeps until a key is hit to continue
+        pygame.display.update()
+        while self.hit_kb(pygame.event.wait()) is None:
+            pass
         
-    def hit_kb(self):        
+    def hit_kb(self, event):        
         ''' 
-        handles hitting a key in keyboard
+        handles an event while waiting for a key to be hit, returns the key or None
         also takes care of checking for quit events such as pressing esc
         '''
         # quit game
-        for event in pygame.event.get(QUIT):
+        if event.type == QUIT:
             pygame.quit()
             sys.exit()
 
-        for event in pygame.event.get([KEYDOWN, KEYUP]):
-            if event.type is KEYUP: # must have finished pressing
-                if event.key is K_ESCAPE: # esc to quite
-                    pygame.quit()
-                    sys.exit()
-                else: # otherwise return the key pressed
-                    return event.key
+        if event.type == KEYUP: # must have finished pressing
+            if event.key == K_ESCAPE: # esc to quite
+                pygame.quit()
+                sys.exit()
+            else: # otherwise return the key pressed
+                return event.key
+        elif event.type == VIDEOEXPOSE: # window needs redrawing
+            pygame.display.update()
         return None
 
-    def set_difficulty(self):
-        ''' sets the difficulty and speed variables ''' 
-        self.difficulty = int(self.score /ACCELERATION) + 1
-        self.speed = 0.27 - (self.difficulty * 0.02)
-    
-    def get_piece(self):
-        ''' gets random piece'''
-        piece = Piece()
-        return piece.get_random()
-
-    def not_on_board(self, x, y):
-        ''' 
-        helper for free_space(), checks if coordinates are valid board coordinates 
-        '''
-        return not (x >= 0 and x < BOARD_W and y < BOARD_H)
-
-    def is_free(self, piece, x_adj = 0, y_adj = 0):
-        ''' 
-        determins if the piece occupies all free space
-        supports optional adjustments x_adj and y_adj
-        '''
-        for x in range(TEMPLATE_W):
-            for y in range(TEMPLATE_H):
-                not_fallen_yet = (y + piece.y + y_adj < 0)
-                square = PIECES[piece.shape][piece.rotation][y][x]
-                if not_fallen_yet or square == NIL: 
-                    # coordinate is empty
-                    continue
-                if self.not_on_board(x + piece.x + x_adj, y + piece.y + y_adj):
-                    # coordinate not valid
-                    return False
-                if self.board[x + piece.x + x_adj][y + piece.y + y_adj] != NIL:
-                    # piece on occupied space
-                    return False
-        return True
-
-    def get_board(self):
-        ''' returns an empty board '''
-        board = []
-        for i in range(BOARD_W):
-            board.append([NIL] * BOARD_H)
-        return board
-    
-    def add(self, piece):
-        ''' fills in a piece onto board '''
-        for x in range(TEMPLATE_W):
-            for y in range(TEMPLATE_H):
-                if PIECES[piece.shape][piece.rotation][y][x] != NIL:
-                    # each element in 2D array boards stores a color
-                    self.board[x + piece.x][y + piece.y] = piece.color
-        
-    def is_full(self, y):
-        ''' helper to check is given line is full'''
-        for x in range(BOARD_W):
-            if self.board[x][y] == NIL:
-                return False
-        return True
-
-    def delete_full_level(self):
-        ''' deletes a full level if there is one and moves everything down'''
-        lines_removed = 0
-        y = BOARD_H - 1 # start at bottom
-        while y >= 0:
-            if self.is_full(y):
-                # pull everything down one level
-                for i in range(y, 0, -1):
-                    for j in range(BOARD_W):
-                        self.board[j][i] = self.board[j][i - 1]
-                # clear top level in case
-                for x in range(BOARD_W):
-                    self.board[x][0] = NIL
-                lines_removed += 1
-                # go through loop to check if there is another level to be removed
-            else:
-                y -= 1 # we know this row isn't full, can go up now
-        return lines_removed
-
-    def get_display_coords(self, x, y):
-        ''' for given board coord, find relevant coordinates on display'''
-        return (SIDE_MARGINS + (x * SQ_SIZE)), (TOP_MARGIN + (y * SQ_SIZE))
-
-    def draw_square(self, x, y, color, disp_x = None, disp_y = None):
-        ''' 
-        draws a square on the screen at location (x, y) on board 
-        supports board coordinates (default) and display coordinates
-        '''
-        if disp_x is None and disp_y is None:
-            disp_x, disp_y = self.get_display_coords(x, y)
-
-        # draws the squares
-        pygame.draw.rect(self.display, DARK_COLORS[color], (disp_x + 1, disp_y + 1, SQ_SIZE - 1, SQ_SIZE - 1))
-        pygame.draw.rect(self.display, LIGHT_COLORS[color], (disp_x + 4, disp_y + 4, SQ_SIZE - 2 , SQ_SIZE - 2))
-
-    def draw_board(self):
-        ''' draws the entire board '''
-        # draws the board border
-        pygame.draw.rect(self.display, BORDER, (SIDE_MARGINS - 3, TOP_MARGIN - 7, (BOARD_W * SQ_SIZE) + 8, (BOARD_H * SQ_SIZE) + 8), 5)
-
-        pygame.draw.rect(self.display, BORDER_SHADE, (SIDE_MARGINS + 1, TOP_MARGIN - 3, (BOARD_W * SQ_SIZE) + 8, (BOARD_H * SQ_SIZE) + 8), 5)
-
-        # draws the background
-        pygame.draw.rect(self.display, BACKGROUND, (SIDE_MARGINS, TOP_MARGIN, SQ_SIZE * BOARD_W, SQ_SIZE * BOARD_H))
-
-        # draws the squares
-        for i in range(BOARD_W):
-            for j in range(BOARD_H):
-                if self.board[i][j] is not NIL:
-                    self.draw_square(i, j, self.board[i][j])
-
-    def draw_score(self):
-        ''' displays the score and difficulty at top of screen'''
-        # score
-        surf = self.font.render("Score: %s" %self.score, True, TEXT_COLOR)
-        self.display.blit(surf, (80, 140))
-
-        # difficulty
-        surf = self.font.render("Difficulty: %s" %self.difficulty, True, TEXT_COLOR)
-        self.display.blit(surf, (80, 180))
-
-    def draw_piece(self, piece, disp_x = None, disp_y = None):
-        ''' draws each piece on board '''
-        shape = PIECES[piece.shape][piece.rotation]
-        if disp_x is None and disp_y is None:
-            disp_x, disp_y = self.get_display_coords(piece.x, piece.y)
-        
-        # draws piece
-        for i in range(TEMPLATE_W):
-            for j in range(TEMPLATE_H):
-                if shape[j][i] is not NIL:
-                    self.draw_square(None, None, piece.color, disp_x + (i * SQ_SIZE), disp_y + (j * SQ_SIZE))
-    
-    def draw_next(self, piece):
-        ''' shows the next piece to drop (though you probably won't look at it) '''
-        surf = self.font.render("Next Piece:", True, TEXT_COLOR)
-        self.display.blit(surf, (WIN_W - 160, 140))
-        self.draw_piece(piece, disp_x = WIN_W - 150, disp_y = 170)
+    def wait_events(self, wake):
+        ''' sleeps until perf_counter() reaches wake or an event comes in, returns the waiting events'''
+        timeout = math.ceil((wake - time.perf_counter()) * 1000)
+        if timeout > 0:
+            event = pygame.event.wait(timeout)
+            if event.type != NOEVENT:
+                return [event] + pygame.event.get()
+        return pygame.event.get()
+
+    def get_recorder(self, engines):
+        ''' replay recorder for a new game, if recording'''
+        if self.record is None:
+            return None
+        os.makedirs(self.record, exist_ok = True)
+        name = time.strftime('%s-%%Y%%m%%d-%%H%%M%%S.ttr' % NAME)
+        return Recorder(os.path.join(self.record, name), engines)
 
     def play(self):
-        ''' main game loop'''
-        self.board = self.get_board()
-        down_time = time.time()
-        sideway_time = time.time()
-        fall_time = time.time()
-        
-        # direction moving in
-        down = False
-        left = False
-        right = False        
-
-        game_over = False
-
-        # get current and upcoming pieces
-        curr_piece = self.get_piece()
-        next_piece = self.get_piece()
-
-        while not game_over: # game loop
-            if curr_piece is None:
-                curr_piece = next_piece
-                next_piece = self.get_piece()
-                fall_time = time.time()
-    
-            if not self.is_free(curr_piece):
-                game_over = True
-
-            for event in pygame.event.get():
+        ''' main game loop, feeds key presses to the engine and draws its state'''
+        self.engine = Engine(seed = random.getrandbits(32))
+        engine = self.engine
+        recorder = self.get_recorder([engine])
+        self.renderer.invalidate()
+        self.renderer.render([engine])
+
+        bot = Bot() if self.autoplay else None
+        start = time.perf_counter() # when tick 0 was due
+        actions = [] # inputs waiting for a tick
+        while not engine.game_over: # game loop
+            # the computer thinks a slice at a time, so the game keeps going meanwhile
+            if bot is not None:
+                bot.think(engine)
+                if self.profiler is not None:
+                    self.profiler.lap('think')
+
+            # sleeps until the engine's next deadline, or the next tick if inputs are waiting
+            wake = engine.tick if actions else engine.deadline()
+            if bot is not None and bot.get_wake(engine) is not None: # the computer's next key press
+                wake = min(wake, bot.get_wake(engine))
+            wake = start + wake / TICK_RATE
+            if self.smooth or (bot is not None and bot.is_thinking()): # keeps drawing frames in between
+                wake = min(wake, time.perf_counter() + 1 / FRAME_RATE)
+            events = self.wait_events(wake)
+            if self.profiler is not None:
+                self.profiler.lap('wait')
+            for event in events:
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
-                if event.type == KEYUP:
-                    if(event.key == K_p): # pause
+                if event.type == VIDEOEXPOSE:
+                    self.renderer.invalidate()
+                elif event.type == KEYUP:
+                    if(event.key == K_p): # pause, the engine only moves when stepped
+                        paused = time.perf_counter()
                         self.display.fill(BACKGROUND)
-                        pygame.mixer.music.pause()
+                        self.assets.pause_music()
                         self.display_text("GAME PAUSED")
-                        pygame.mixer.music.unpause()
-                        fall_time = down_time = sideway_time = time.time()
+                        self.assets.unpause_music()
+                        self.renderer.invalidate()
+                        start += time.perf_counter() - paused
                     # press r changes music
                     elif(event.key == K_r):
                         self.music()
                     # stops going in that direction
-                    elif (event.key == K_LEFT or event.key == K_a):
-                        left = False
-                    elif (event.key == K_RIGHT or event.key == K_d):
-                        right = False
-                    elif (event.key == K_DOWN or event.key == K_s):
-                        down = False
-
-                elif event.type == KEYDOWN:
-                    # change direction (left and right)
-                    if (event.key == K_LEFT or event.key == K_a):
-                        if self.is_free(curr_piece, x_adj = -1):
-                            curr_piece.x -= 1
-                        left = True
-                        right = False
-                        sideway_time = time.time()
-                    elif (event.key == K_RIGHT or event.key == K_d):
-                        if self.is_free(curr_piece, x_adj = 1):
-                            curr_piece.x += 1
-                        right = True
-                        left = False
-                        sideway_time = time.time()
-                    elif (event.key == K_DOWN or event.key == K_s):
-                        down = True
-                        if self.is_free(curr_piece, y_adj = 1):
-                            curr_piece.y += 1
-                        down_time = time.time()
-                    # up is rotation, move to next element in group
-                    elif (event.key == K_UP or event.key == K_w):
-                        temp = curr_piece.rotation
-                        curr_piece.rotation = (curr_piece.rotation + 1) % len(PIECES[curr_piece.shape])
-                        if not self.is_free(curr_piece):
-                            curr_piece.rotation = temp
-                    # e or q rotates in other direction
-                    elif (event.key == K_e or event.key == K_q):
-                        temp = curr_piece.rotation
-                        curr_piece.rotation = (curr_piece.rotation - 1) % len(PIECES[curr_piece.shape])
-                        if not self.is_free(curr_piece):
-                            curr_piece.rotation = temp
-
-                    # Space bar sends piece to bottom
-                    elif (event.key == K_SPACE):
-                        down = left = right = False
-                        for i in range(1, BOARD_H):
-                            if not self.is_free(curr_piece, y_adj = i):
-                                break
-                        curr_piece.y += i - 1
-
-            # holding down the left right keys will still move block
-            if (left or right) and (time.time() - sideway_time > SIDEWAY_FREQ):
-                if left and self.is_free(curr_piece, x_adj = -1):
-                    curr_piece.x -= 1
-                elif right and self.is_free(curr_piece, x_adj = 1):
-                    curr_piece.x += 1
-                sideway_time = time.time()
-            
-            # hold down down key moves block down
-            if down and (time.time() - down_time > DOWN_FREQ):
-                if self.is_free(curr_piece, y_adj = 1):
-                    curr_piece.y += 1
-                down_time = time.time()
-
-            # will fall regardless of input
-            if time.time() - fall_time > self.speed:
-                if not self.is_free(curr_piece, y_adj = 1):
-                    # piece landed
-                    self.add(curr_piece) # add to board
-                    self.score += self.delete_full_level() 
-                    self.set_difficulty()
-                    curr_piece = None
-                else: # piece still falling
-                    curr_piece.y += 1
-                    fall_time = time.time()
-                    
-            self.display.fill(BACKGROUND)
-            self.draw_board()
-            self.draw_score()
-            self.draw_next(next_piece)
-            if curr_piece is not None:
-               self.draw_piece(curr_piece)
-            pygame.display.update()
-            self.clock.tick(FPS)
+                    elif event.key in KEY_RELEASES and bot is None:
+                        actions.append(KEY_RELEASES[event.key])
+                elif event.type == KEYDOWN and event.key in KEY_ACTIONS and bot is None:
+                    actions.append(KEY_ACTIONS[event.key])
+
+            if self.profiler is not None:
+                self.profiler.lap('events')
+
+            # steps every tick that is due, waiting inputs pull the next tick forward
+            # so they show up right away, the engine is never more than a tick ahead
+            last = int((time.perf_counter() - start) * TICK_RATE)
+            if last - engine.tick > MAX_CATCH_UP: # stalled, e.g. the window was dragged
+                start += (last - engine.tick - MAX_CATCH_UP) / TICK_RATE
+                last = engine.tick + MAX_CATCH_UP
+            if actions:
+                last += 1
+            changed = engine.tick <= last
+            while engine.tick <= last and not engine.game_over:
+                tick_actions = actions if engine.tick == last else []
+                if bot is not None:
+                    tick_actions = bot.get_actions(engine)
+                if recorder is not None:
+                    recorder.record([tick_actions])
+                engine.step(*tick_actions)
+            if changed:
+                actions = []
+
+            if self.profiler is not None:
+                self.profiler.lap('simulate')
+
+            if changed or self.renderer.full or self.smooth:
+                self.renderer.render([engine])
+                if self.profiler is not None:
+                    self.profiler.lap('render')
+                    self.profiler.end_frame()
+                    self.profiler.draw_overlay(self.display, TEXT_COLOR, BACKGROUND, PROFILE_AREA)
+
+        if recorder is not None:
+            recorder.close()
 
 
 if __name__ == "__main__":
-    game = Tetris()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', metavar = 'DIR', help = 'saves a replay of every game in DIR')
+    parser.add_argument('--smooth', action = 'store_true', help = 'draws pieces falling between levels')
+    parser.add_argument('--profile', metavar = 'FILE', help = 'shows frame timings, saves them to a .csv or .json FILE')
+    parser.add_argument('--autoplay', action = 'store_true', help = 'the computer plays')
+    args = parser.parse_args()
+
+    game = Tetris(record = args.record, smooth = args.smooth, profile = args.profile, autoplay = args.autoplay)
     game.run()
@@ -0,0 +1,226 @@
+# Heuristic computer player, searches a beam of placements over the preview
+# (c) 2018 Tingda Wang
+#
+# usage: python3 ctetris.py --cpu, python3 Tetris.py --autoplay
+#        python3 selfplay.py --policy ai:beam_policy
+
+import time
+
+from rules import PIECES, MASKS
+from board import get_features
+from engine import LEFT, RIGHT, DOWN, ROTATE, ROTATE_BACK, DROP, RELEASE_LEFT, RELEASE_RIGHT, RELEASE_DOWN
+from placements import get_placements, find_path
+
+# weights of the board features, each placement scores their weighted sum
+WEIGHTS = {'height': -0.510066, 'lines': 0.760666, 'holes': -0.35663, 'bumpiness': -0.184483}
+# placements kept at each level of the search
+BEAM_WIDTH = 6
+# seconds of searching before the best placement found so far is used
+MOVE_BUDGET = 0.25
+# seconds of searching think() does by default, short enough not to hold up a frame
+THINK_SLICE = 0.004
+# ticks between the key presses of the computer player, 10 a second at 240 ticks
+MOVE_TICKS = 24
+
+def evaluate(board, lines, weights = WEIGHTS):
+    ''' how good a board is after clearing lines levels to get there, higher is better'''
+    height, holes, bumpiness = get_features(board)
+    return (weights['height'] * height + weights['lines'] * lines +
+            weights['holes'] * holes + weights['bumpiness'] * bumpiness)
+
+def search(board, pieces, width = BEAM_WIDTH, weights = WEIGHTS):
+    '''
+    beam search for where to put the first of pieces, the pieces that drop next in order
+    each level places the next piece on every board kept so far and keeps the width best,
+    scored by the board they leave and every line cleared on the way
+    placements are scored by placing them on the board and undoing them again, so only the
+    boards kept are copied, and board is left as it was
+    a generator, yielding after each placement is scored so the search can be spread out,
+    with the best (score, placement) found so far, or None until the first level is done
+    returns the placement of the first piece leading to the best board, or None if it can't go anywhere
+    '''
+    beam = [(0, 0, None, board)] # (score, lines, first placement, board)
+    best = None
+    for piece in pieces:
+        masks = MASKS[piece.shape]
+        candidates = []
+        for score, lines, first, board in beam:
+            for placement in get_placements(board, piece.shape, piece.rotation, piece.x, piece.y,
+                                            piece.color, boards = False):
+                cleared, placed = board.place(masks[placement.rotation], placement.x, placement.y, piece.color)
+                total = lines + cleared
+                candidates.append((evaluate(board, total, weights), total, first or placement, board, placement))
+                board.undo(placed)
+                yield best
+        if not candidates: # every board kept tops out, go with the best so far
+            break
+        candidates.sort(key = lambda candidate: candidate[0], reverse = True)
+        beam = []
+        for score, lines, first, board, placement in candidates[:width]:
+            board = board.copy()
+            board.place(masks[placement.rotation], placement.x, placement.y, piece.color)
+            beam.append((score, lines, first, board))
+        best = beam[0][0], beam[0][2]
+    return None if best is None else best[1]
+
+def beam_policy(seed, width = BEAM_WIDTH):
+    ''' selfplay policy placing each piece where a full beam search over the preview says'''
+    def choose(engine):
+        pieces = [engine.curr_piece] + engine.preview(engine.preview_size)
+        placement = finish(search(engine.board, pieces, width))
+        if placement is None: # nowhere to go, the game is over either way
+            return engine.curr_piece.rotation, engine.curr_piece.x
+        return placement.rotation, placement.x, placement.y
+    return choose
+
+def finish(generator):
+    ''' runs a generator to the end, returns what it returns'''
+    try:
+        while True:
+            next(generator)
+    except StopIteration as stop:
+        return stop.value
+
+class Bot:
+    '''
+    computer player that plays an engine through the same actions as the keyboard,
+    so games against it can be recorded and replayed like any other
+    the search for where each piece goes runs a slice at a time in think(), keeping the
+    game loop responsive, then get_actions() walks the piece there one move every move_ticks
+    '''
+
+    def __init__(self, width = BEAM_WIDTH, budget = MOVE_BUDGET, move_ticks = MOVE_TICKS, weights = WEIGHTS):
+        '''
+        width is the beam width, budget the seconds a piece is thought about at most,
+        move_ticks the ticks between key presses and weights those of evaluate()
+        '''
+        self.width = width
+        self.budget = budget
+        self.move_ticks = move_ticks
+        self.weights = weights
+        self.piece = None # number of the piece being played, which Engine.restore() keeps
+        self.search = None # search generator while thinking
+        self.deadline = 0 # perf_counter() time the search has to stop by
+        self.best = None # (score, placement) found so far
+        self.goal = None # (rotation, x, y) the piece is going to
+        self.path = [] # states the piece still has to go through to get there, None until found
+        self.next_move = 0 # tick of the next key press
+        self.thought = 0 # perf_counter() time think() was last called
+
+    def start(self, engine):
+        ''' starts thinking about the engine's current piece'''
+        self.piece = engine.pieces
+        pieces = [engine.curr_piece] + engine.preview(engine.preview_size)
+        self.search = search(engine.board.copy(), pieces, self.width, self.weights)
+        self.deadline = time.perf_counter() + self.budget
+        self.best = None
+        self.goal = None
+        self.path = []
+
+    def is_thinking(self):
+        ''' whether think() still has work to do for the current piece'''
+        return self.search is not None or self.path is None
+
+    def think(self, engine, seconds = THINK_SLICE):
+        '''
+        searches for up to seconds, once the search is done or out of time
+        the next call finds the path to the best placement found
+        '''
+        self.thought = time.perf_counter()
+        if engine.game_over or engine.curr_piece is None:
+            return
+        if engine.pieces != self.piece:
+            self.start(engine)
+        if self.search is None:
+            if self.path is None:
+                self.route(engine)
+            return
+
+        end = min(time.perf_counter() + seconds, self.deadline)
+        try:
+            while True:
+                self.best = next(self.search)
+                if time.perf_counter() >= end:
+                    break
+            if time.perf_counter() < self.deadline or self.best is None:
+                return # keeps going next time, or until there is something to go with
+            placement = self.best[1]
+        except StopIteration as stop:
+            placement = stop.value
+        self.search = None
+        if placement is not None:
+            # found on the next call, so no call does more than one slow part
+            self.goal = (placement.rotation, placement.x, placement.y)
+            self.path = None
+
+    def route(self, engine):
+        ''' finds the path to the goal from where the piece is now, dropping the goal if it can't get there'''
+        piece = engine.curr_piece
+        path = find_path(engine.board, piece.shape, (piece.rotation, piece.x, piece.y), self.goal)
+        if path is None:
+            self.goal = None
+            path = []
+        self.path = path
+
+    def get_wake(self, engine):
+        ''' tick of the next key press, None while thinking or with nothing left to do'''
+        if self.is_thinking() or not self.path or engine.pieces != self.piece:
+            return None
+        return max(self.next_move, engine.tick)
+
+    def get_actions(self, engine):
+        '''
+        the actions for the engine's coming tick, at most one key press
+        each move along the path is made once the piece is down to the level it was planned on,
+        or further down if gravity got it there first, and once just down is left the piece is dropped
+        '''
+        piece = engine.curr_piece
+        if engine.game_over or piece is None or engine.pieces != self.piece or self.is_thinking():
+            return []
+        if not self.path or engine.tick < self.next_move:
+            return []
+
+        # the next move other than down
+        path = self.path
+        i = 0
+        while i < len(path) and path[i][:2] == (piece.rotation, piece.x):
+            i += 1
+        self.next_move = engine.tick + self.move_ticks
+        if i == len(path):
+            self.path = []
+            return [DROP]
+
+        rotation, x, y = path[i]
+        if piece.y < y and engine.is_free(piece, y_adj = 1):
+            return [DOWN, RELEASE_DOWN]
+        if not engine.board.fits(MASKS[piece.shape][rotation], x, piece.y):
+            # gravity or garbage got in the way, so look for a new way there
+            self.route(engine)
+            self.next_move = engine.tick
+            return []
+
+        del path[:i + 1]
+        if x < piece.x:
+            return [LEFT, RELEASE_LEFT]
+        if x > piece.x:
+            return [RIGHT, RELEASE_RIGHT]
+        if rotation == (piece.rotation + 1) % len(PIECES[piece.shape]):
+            return [ROTATE]
+        return [ROTATE_BACK]
+
+def think_all(players, seconds = THINK_SLICE):
+    '''
+    shares seconds of thinking between the (bot, engine) pairs that have thinking to do,
+    so the game loop takes no longer with more computer players, they just think slower
+    the bots that went longest without thinking go first, and once the time is up the rest
+    wait for the next call
+    '''
+    thinking = [(bot, engine) for bot, engine in players
+                if bot.is_thinking() or (engine.pieces != bot.piece and not engine.game_over)]
+    thinking.sort(key = lambda player: player[0].thought)
+    end = time.perf_counter() + seconds
+    for i, (bot, engine) in enumerate(thinking):
+        now = time.perf_counter()
+        if now >= end:
+            break
+        bot.think(engine, (end - now) / (len(thinking) - i))
@@ -0,0 +1,122 @@
+# Fonts and music, read ahead on a thread of their own so frames never wait on the disk
+# (c) 2018 Tingda Wang
+
+import io, os, sys, queue, random, threading
+
+import pygame
+
+# assets live next to the code, wherever the game is started from
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def get_path(name):
+    ''' path of an asset given relative to the game's directory'''
+    return os.path.join(ROOT, name)
+
+def warn(message):
+    ''' tells about an asset the game goes on without'''
+    print('warning: %s' % message, file = sys.stderr)
+
+class Assets:
+    '''
+    the fonts and music of a game, read into memory by a thread as soon as they are made
+    get_font() only waits for its own file, which is usually in by the time it is asked for,
+    and the music is loaded, swapped, paused and stopped on the same thread, so the game
+    loop just queues what it wants heard
+    assets that are missing or can't be read are left out with a warning: fonts fall back
+    to pygame's own and the music plays the other tracks, or nothing
+    '''
+
+    def __init__(self, fonts = (), music = ()):
+        ''' fonts and music tracks are paths relative to the game's directory'''
+        self.music = list(music)
+        self.data = {} # path: bytes, None if it couldn't be read
+        self.read_events = {path: threading.Event() for path in list(fonts) + self.music}
+        self.fonts = {} # (path, size): Font
+        self.requests = queue.Queue() # music calls for the thread, in order
+        self.random = random.Random() # picks another track when the one asked for can't be played
+        self.thread = threading.Thread(target = self.run, args = (list(fonts) + self.music,), daemon = True)
+        self.thread.start()
+
+    def run(self, paths):
+        ''' the assets' thread, reads every file then makes the music calls it is asked to'''
+        for path in paths:
+            self.read(path)
+        while True:
+            call, args = self.requests.get()
+            try:
+                call(*args)
+            except Exception as error: # e.g. the mixer went away on quit, the thread has to go on
+                warn('music: %s' % error)
+
+    def read(self, path):
+        ''' reads a file into memory'''
+        try:
+            with open(get_path(path), 'rb') as f:
+                self.data[path] = f.read()
+        except OSError as error:
+            warn('%s, going on without it' % error)
+            self.data[path] = None
+        self.read_events[path].set()
+
+    def get_font(self, path, size):
+        ''' the font at path in size, pygame's default font if it couldn't be read'''
+        if (path, size) not in self.fonts:
+            self.read_events[path].wait()
+            font = None
+            if self.data[path] is not None:
+                try:
+                    font = pygame.font.Font(io.BytesIO(self.data[path]), size)
+                except (pygame.error, OSError) as error:
+                    warn('%s is not a font (%s), using the default one' % (path, error))
+            if font is None:
+                font = pygame.font.Font(None, size)
+            self.fonts[path, size] = font
+        return self.fonts[path, size]
+
+    def play_music(self):
+        '''
+        swaps in a random track, looping until stopped
+        the track is picked here, so the game's random numbers are drawn the same way every time
+        '''
+        if self.music:
+            self.requests.put((self.start_track, (random.choice(self.music),)))
+
+    def stop_music(self):
+        ''' stops the track playing'''
+        self.requests.put((self.mixer_call, ('stop',)))
+
+    def pause_music(self):
+        ''' pauses the track playing'''
+        self.requests.put((self.mixer_call, ('pause',)))
+
+    def unpause_music(self):
+        ''' carries on with the track paused'''
+        self.requests.put((self.mixer_call, ('unpause',)))
+
+    def has_mixer(self):
+        ''' whether there is anything to play music on'''
+        return pygame.mixer is not None and pygame.mixer.get_init() is not None
+
+    def mixer_call(self, name):
+        ''' calls pygame.mixer.music.name() if music can be played, on the assets' thread'''
+        if self.has_mixer():
+            getattr(pygame.mixer.music, name)()
+
+    def start_track(self, path):
+        ''' loads the track and plays it, or another one if it can't be, on the assets' thread'''
+        if not self.has_mixer():
+            return
+        pygame.mixer.music.stop()
+        while True:
+            tracks = [track for track in self.music if self.data[track] is not None]
+            if not tracks:
+                return
+            if path not in tracks:
+                path = self.random.choice(tracks)
+            try:
+                pygame.mixer.music.load(io.BytesIO(self.data[path]), os.path.splitext(path)[1][1:])
+                break
+            except pygame.error as error:
+                warn("can't play %s (%s), leaving it out" % (path, error))
+                self.data[path] = None
+        pygame.mixer.music.play(-1, 0.0) # infinite loops, start at beginning
@@ -0,0 +1,155 @@
+# Many headless Tetris games stepped at once with NumPy
+# (c) 2018 Tingda Wang
+
+import numpy as np
+
+from rules import (BOARD_W, BOARD_H, ACCELERATION, NUM_COLORS, SPAWN_X, SPAWN_Y, PIECES, MASKS, SHAPES,
+                   RANDOM, BAG, MASK_64, BAG_SALT, MIX_GAMMA, MIX_1, MIX_2)
+
+# shapes numbered in SHAPES order
+SHAPE_IDS = {shape: i for i, shape in enumerate(SHAPES)}
+MAX_ROTATIONS = max(len(PIECES[shape]) for shape in SHAPES)
+
+# every piece covers 4 squares, so each rotation compiles to 4 (x, y) offsets
+CELLS = 4
+ROTATIONS = np.array([len(PIECES[shape]) for shape in SHAPES])
+CELL_X = np.zeros((len(SHAPES), MAX_ROTATIONS, CELLS), dtype = np.int64)
+CELL_Y = np.zeros((len(SHAPES), MAX_ROTATIONS, CELLS), dtype = np.int64)
+for shape in SHAPES:
+    for rotation, mask in enumerate(MASKS[shape]):
+        assert len(mask.cells) == CELLS
+        CELL_X[SHAPE_IDS[shape], rotation] = [x for x, y in mask.cells]
+        CELL_Y[SHAPE_IDS[shape], rotation] = [y for x, y in mask.cells]
+
+def mix_all(seeds, counters):
+    ''' rules.mix() of every seed with its counter, both uint64 arrays, wrapping like it masks'''
+    z = seeds + (counters + np.uint64(1)) * np.uint64(MIX_GAMMA)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(MIX_1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(MIX_2)
+    return z ^ (z >> np.uint64(31))
+
+class BatchEngine:
+    '''
+    N independent games held as a (N, BOARD_H, BOARD_W) uint8 array, 0 for an empty square
+    and color + 1 otherwise, stepped one placement at a time like Engine.place()
+    given the same seeds, every game matches an Engine playing the same placements
+    '''
+
+    def __init__(self, seeds, mode = RANDOM):
+        ''' starts one game per seed, mode is the PieceGenerator mode'''
+        if mode not in (RANDOM, BAG):
+            raise ValueError('unknown piece generator mode %r' % mode)
+        self.n = len(seeds)
+        self.mode = mode
+        # the PieceGenerator of every game, as its seed and the index of its next piece
+        self.seeds = np.array([seed & MASK_64 for seed in seeds], dtype = np.uint64)
+        self.index = np.zeros(self.n, dtype = np.uint64)
+        self.boards = np.zeros((self.n, BOARD_H, BOARD_W), dtype = np.uint8)
+
+        # difficulty variables
+        self.score = np.zeros(self.n, dtype = np.int64)
+        self.pieces = np.zeros(self.n, dtype = np.int64)
+        self.set_difficulty()
+        self.game_over = np.zeros(self.n, dtype = bool)
+
+        # current pieces, rotation is the one they spawn with until placed
+        self.shape = np.zeros(self.n, dtype = np.int64)
+        self.rotation = np.zeros(self.n, dtype = np.int64)
+        self.color = np.zeros(self.n, dtype = np.int64)
+        self.spawn(range(self.n))
+
+    def set_difficulty(self):
+        ''' sets the difficulty and speed of every game '''
+        self.difficulty = self.score // ACCELERATION + 1
+        self.speed = 0.27 - (self.difficulty * 0.02)
+
+    def spawn(self, games):
+        '''
+        brings in the next piece of the given games, drawn like PieceGenerator.get_spec()
+        for all of them at once
+        '''
+        games = np.asarray(games, dtype = np.int64)
+        seeds, index = self.seeds[games], self.index[games]
+        bits = mix_all(seeds, index)
+        if self.mode == BAG: # shuffles each game's bag the same way, then takes the piece's place in it
+            count = np.uint64(len(SHAPES))
+            bag = index // count
+            shapes = np.tile(np.arange(len(SHAPES)), (len(games), 1))
+            rows = np.arange(len(games))
+            for i in range(len(SHAPES) - 1, 0, -1):
+                j = (mix_all(seeds ^ np.uint64(BAG_SALT), bag * count + np.uint64(i)) % np.uint64(i + 1)).astype(np.int64)
+                shapes[rows, i], shapes[rows, j] = shapes[rows, j], shapes[rows, i]
+            shape = shapes[rows, (index % count).astype(np.int64)]
+        else:
+            shape = (bits % np.uint64(len(SHAPES))).astype(np.int64)
+        self.shape[games] = shape
+        self.rotation[games] = ((bits >> np.uint64(8)) % ROTATIONS[shape].astype(np.uint64)).astype(np.int64)
+        self.color[games] = ((bits >> np.uint64(16)) % np.uint64(NUM_COLORS)).astype(np.int64)
+        self.index[games] += np.uint64(1)
+
+    def is_free(self, games, xs, ys):
+        '''
+        whether each game's piece squares at (xs, ys), (len(games), CELLS) arrays, are all free
+        squares above the board are always free and the columns must already be on the board
+        '''
+        on_board = ys >= 0
+        inside = ys < BOARD_H
+        squares = self.boards[games[:, None], np.clip(ys, 0, BOARD_H - 1), xs]
+        return np.all(inside & ~(on_board & (squares != 0)), axis = 1)
+
+    def place(self, rotations, xs):
+        '''
+        drops every game's current piece with the given rotation and column and locks it
+        a placement off the sides of the board or blocked at the spawn row ends that game
+        returns the number of lines each game cleared
+        '''
+        lines = np.zeros(self.n, dtype = np.int64)
+        games = np.flatnonzero(~self.game_over)
+        if len(games) == 0:
+            return lines
+
+        shape = self.shape[games]
+        rotation = np.asarray(rotations)[games] % ROTATIONS[shape]
+        cell_x = np.asarray(xs)[games, None] + CELL_X[shape, rotation]
+        cell_y = SPAWN_Y + CELL_Y[shape, rotation]
+
+        # placements that don't fit where the piece spawns end the game
+        sideways = np.all((cell_x >= 0) & (cell_x < BOARD_W), axis = 1)
+        cell_x = np.clip(cell_x, 0, BOARD_W - 1)
+        fits = sideways & self.is_free(games, cell_x, cell_y)
+        self.game_over[games[~fits]] = True
+        games, cell_x, cell_y = games[fits], cell_x[fits], cell_y[fits]
+
+        # drop every piece one level at a time until none can fall further
+        falling = np.ones(len(games), dtype = bool)
+        while falling.any():
+            falling &= self.is_free(games, cell_x, cell_y + 1)
+            cell_y += falling[:, None]
+
+        # add to board, squares still above the board are lost
+        on_board = cell_y >= 0
+        rows = np.repeat(games, CELLS).reshape(-1, CELLS)
+        colors = np.repeat(self.color[games] + 1, CELLS).reshape(-1, CELLS)
+        self.boards[rows[on_board], cell_y[on_board], cell_x[on_board]] = colors[on_board]
+        self.pieces[games] += 1
+
+        # deletes full levels: stable sort puts them on top, then they are emptied
+        full = np.all(self.boards[games] != 0, axis = 2)
+        counts = full.sum(axis = 1)
+        clearing = counts > 0
+        if clearing.any():
+            cleared = games[clearing]
+            order = np.argsort(~full[clearing], axis = 1, kind = 'stable')
+            boards = np.take_along_axis(self.boards[cleared], order[:, :, None], axis = 1)
+            boards[np.arange(BOARD_H) < counts[clearing, None]] = 0
+            self.boards[cleared] = boards
+        lines[games] = counts
+        self.score += lines
+        self.set_difficulty()
+
+        # brings in the next pieces, no room for them is game over
+        self.spawn(games)
+        shape, rotation = self.shape[games], self.rotation[games]
+        free = self.is_free(games, SPAWN_X + CELL_X[shape, rotation], SPAWN_Y + CELL_Y[shape, rotation])
+        self.game_over[games[~free]] = True
+        return lines
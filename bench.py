@@ -0,0 +1,334 @@
+# Benchmarks of the engine, board backends and renderer
+# (c) 2018 Tingda Wang
+#
+# usage: python3 bench.py --save baseline.json
+#        python3 bench.py --compare baseline.json [--tolerance 0.1]
+#
+# Each benchmark is timed in rounds long enough to measure, and the fastest round
+# counts, since the noise on a busy machine only ever makes things slower.
+# Comparing against a saved baseline exits with 1 if anything got slower than
+# the tolerance allows, so changes can be accepted or rejected on the numbers.
+
+import os, sys, time, json, random, platform, argparse, statistics
+
+# rendering is measured offscreen
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from rules import BOARD_W, BOARD_H, NUM_COLORS, PIECES, MASKS, Piece
+from engine import Engine
+from board import BACKENDS
+from selfplay import random_policy
+from placements import get_placements
+from ai import search, finish
+
+# a round runs for at least this many seconds
+MIN_TIME = 0.05
+# seed of the boards, pieces and games benchmarked
+SEED = 1998
+# pieces placed in a full headless game
+GAME_PIECES = 500
+
+def get_engine(backend, rng, height):
+    ''' an engine whose board has its bottom height levels randomly filled, none of them full'''
+    engine = Engine(SEED, backend)
+    engine.board.load(get_board_data(rng, height))
+    return engine
+
+def get_board_data(rng, height):
+    ''' Board.dump() bytes of a board with its bottom height levels randomly filled, none of them full'''
+    data = bytearray(BOARD_W * BOARD_H)
+    for y in range(BOARD_H - height, BOARD_H):
+        hole = rng.randrange(BOARD_W)
+        for x in range(BOARD_W):
+            if x != hole and rng.random() < 0.7:
+                data[y * BOARD_W + x] = rng.randrange(NUM_COLORS) + 1
+    return data
+
+def get_pieces(rng, count):
+    ''' pieces of every shape and rotation at random spots around and inside the board'''
+    pieces = []
+    for i in range(count):
+        piece = Piece()
+        piece.shape = rng.choice(list(PIECES))
+        piece.rotation = rng.randrange(len(PIECES[piece.shape]))
+        piece.color = rng.randrange(NUM_COLORS)
+        piece.x = rng.randint(-2, BOARD_W - 2)
+        piece.y = rng.randint(-2, BOARD_H - 2)
+        pieces.append(piece)
+    return pieces
+
+''' Benchmarks
+each takes a backend and returns run(rounds), which does rounds of work and returns
+the seconds spent on the part being measured, and how many operations a round holds
+'''
+
+def bench_is_free(backend):
+    ''' collision checks of pieces all over a half filled board'''
+    rng = random.Random(SEED)
+    engine = get_engine(backend, rng, BOARD_H // 2)
+    pieces = get_pieces(rng, 1000)
+    def run(rounds):
+        is_free = engine.is_free
+        start = time.perf_counter()
+        for i in range(rounds):
+            for piece in pieces:
+                is_free(piece)
+        return time.perf_counter() - start
+    return run, len(pieces)
+
+def bench_add(backend):
+    ''' adding pieces that fit onto a half filled board'''
+    rng = random.Random(SEED)
+    engine = get_engine(backend, rng, BOARD_H // 2)
+    pieces = [piece for piece in get_pieces(rng, 5000) if engine.is_free(piece)][:1000]
+    def run(rounds):
+        boards = [engine.board.copy() for i in range(rounds)]
+        start = time.perf_counter()
+        for board in boards:
+            engine.board = board
+            for piece in pieces:
+                engine.add(piece)
+        return time.perf_counter() - start
+    return run, len(pieces)
+
+def bench_drop_distance(backend):
+    ''' hard drops of pieces from where they spawn onto a half filled board'''
+    rng = random.Random(SEED)
+    engine = get_engine(backend, rng, BOARD_H // 2)
+    pieces = []
+    for piece in get_pieces(rng, 1000):
+        piece.y = -2
+        if engine.is_free(piece):
+            pieces.append(piece)
+    def run(rounds):
+        drop_distance = engine.drop_distance
+        start = time.perf_counter()
+        for i in range(rounds):
+            for piece in pieces:
+                drop_distance(piece)
+        return time.perf_counter() - start
+    return run, len(pieces)
+
+def bench_placements(backend):
+    ''' searches for every placement of each shape from where it spawns on a half filled board'''
+    engine = get_engine(backend, random.Random(SEED), BOARD_H // 2)
+    shapes = list(PIECES)
+    def run(rounds):
+        start = time.perf_counter()
+        for i in range(rounds):
+            for shape in shapes:
+                get_placements(engine.board, shape)
+        return time.perf_counter() - start
+    return run, len(shapes)
+
+def bench_place_undo(backend):
+    ''' placing and undoing every placement of each shape on a half filled board, per placement'''
+    engine = get_engine(backend, random.Random(SEED), BOARD_H // 2)
+    board = engine.board
+    placements = [(MASKS[shape][placement.rotation], placement.x, placement.y)
+                  for shape in PIECES for placement in get_placements(board, shape, boards = False)]
+    def run(rounds):
+        start = time.perf_counter()
+        for i in range(rounds):
+            for mask, x, y in placements:
+                lines, placed = board.place(mask, x, y, 0)
+                board.undo(placed)
+        return time.perf_counter() - start
+    return run, len(placements)
+
+def bench_search(backend):
+    ''' the computer player's beam search over a piece and the next one on a half filled board'''
+    engine = get_engine(backend, random.Random(SEED), BOARD_H // 2)
+    pieces = engine.preview(2)
+    def run(rounds):
+        start = time.perf_counter()
+        for i in range(rounds):
+            finish(search(engine.board, pieces))
+        return time.perf_counter() - start
+    return run, 1
+
+def get_bench_delete_full_level(lines):
+    ''' benchmark of deleting lines full levels right after a vertical I piece lands'''
+    def bench_delete_full_level(backend):
+        rng = random.Random(SEED)
+        data = get_board_data(rng, BOARD_H // 2)
+        # the piece fills column 5 of the bottom 4 levels, the top 4 - lines of them keep a hole
+        for y in range(BOARD_H - 4, BOARD_H):
+            for x in range(BOARD_W):
+                full = x != 5 and (x != 0 or y >= BOARD_H - lines)
+                data[y * BOARD_W + x] = rng.randrange(NUM_COLORS) + 1 if full else 0
+        engine = Engine(SEED, backend)
+        engine.board.load(data)
+        piece = Piece()
+        piece.shape, piece.rotation, piece.color = 'I', 0, 0
+        piece.x, piece.y = 3, BOARD_H - 4
+        engine.add(piece)
+        template = engine.board
+
+        def run(rounds):
+            boards = [template.copy() for i in range(rounds)]
+            start = time.perf_counter()
+            for board in boards:
+                engine.board = board
+                engine.delete_full_level(piece)
+            return time.perf_counter() - start
+        return run, 1
+    bench_delete_full_level.__doc__ = 'deleting %d full levels after a piece lands' % lines
+    return bench_delete_full_level
+
+def bench_add_full_level(backend):
+    ''' garbage levels pushed under a half filled board, like clearing lines does in ctetris'''
+    rng = random.Random(SEED)
+    engine = get_engine(backend, rng, BOARD_H // 2)
+    template = engine.board
+    def run(rounds):
+        boards = [template.copy() for i in range(rounds)]
+        start = time.perf_counter()
+        for board in boards:
+            engine.board = board
+            engine.add_full_level()
+        return time.perf_counter() - start
+    return run, 1
+
+def bench_game(backend):
+    ''' a whole headless game of GAME_PIECES random placements, pieces per round'''
+    def run(rounds):
+        elapsed = 0
+        for i in range(rounds):
+            engine = Engine(SEED + i, backend)
+            choose = random_policy(SEED + i)
+            start = time.perf_counter()
+            while not engine.game_over and engine.pieces < GAME_PIECES:
+                engine.place(*choose(engine))
+                if engine.game_over: # keeps going on a new board, so every round places as many pieces
+                    pieces = engine.pieces
+                    engine.reset()
+                    engine.pieces = pieces
+            elapsed += time.perf_counter() - start
+        return elapsed
+    return run, GAME_PIECES
+
+def get_renderer():
+    ''' a renderer of the single player layout drawing onto an offscreen surface'''
+    import pygame
+    from render import BoardView, Renderer
+    import Tetris
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode((1, 1))
+    display = pygame.Surface((Tetris.WIN_W, Tetris.WIN_H))
+    font = pygame.font.Font(None, Tetris.FONT_SIZE)
+    view = BoardView(Tetris.SIDE_MARGINS, Tetris.TOP_MARGIN, (80, 140), (80, 180),
+                     (Tetris.WIN_W - 160, 140), (Tetris.WIN_W - 150, 170))
+    return Renderer(display, Tetris.THEME, font, [view])
+
+def bench_draw_board(backend):
+    ''' drawing a board filled three quarters of the way up'''
+    renderer = get_renderer()
+    engine = get_engine(backend, random.Random(SEED), BOARD_H * 3 // 4)
+    view = renderer.views[0]
+    clip = renderer.display.get_rect()
+    def run(rounds):
+        start = time.perf_counter()
+        for i in range(rounds):
+            renderer.draw_board(view, engine, clip)
+        return time.perf_counter() - start
+    return run, 1
+
+def bench_frame(backend):
+    ''' drawing the whole window of a game in progress'''
+    renderer = get_renderer()
+    engine = get_engine(backend, random.Random(SEED), BOARD_H * 3 // 4)
+    clip = renderer.display.get_rect()
+    def run(rounds):
+        start = time.perf_counter()
+        for i in range(rounds):
+            renderer.draw([engine], clip, [0])
+        return time.perf_counter() - start
+    return run, 1
+
+# benchmark name: function, run with every board backend
+BENCHMARKS = {'is_free': bench_is_free, 'add': bench_add, 'drop_distance': bench_drop_distance}
+for lines in range(5):
+    BENCHMARKS['delete_full_level/%d' % lines] = get_bench_delete_full_level(lines)
+BENCHMARKS.update({'add_full_level': bench_add_full_level, 'placements': bench_placements,
+                   'place_undo': bench_place_undo, 'search': bench_search, 'game': bench_game,
+                   'draw_board': bench_draw_board, 'frame': bench_frame})
+
+def measure(bench, backend, repeat):
+    '''
+    times a benchmark, with rounds enough for each repeat to take MIN_TIME
+    returns the fastest and median time of an operation in microseconds
+    '''
+    run, ops = bench(backend)
+    rounds = 1
+    while run(rounds) < MIN_TIME:
+        rounds *= 10
+    times = [run(rounds) / (rounds * ops) * 1e6 for i in range(repeat)]
+    return {'best': min(times), 'median': statistics.median(times), 'rounds': rounds, 'ops': ops}
+
+def run_all(names, repeat):
+    ''' measures every named benchmark on every backend, returns results by name/backend'''
+    results = {}
+    for name in names:
+        for backend in BACKENDS:
+            key = '%s/%s' % (name, backend)
+            results[key] = measure(BENCHMARKS[name], backend, repeat)
+            print('%-28s %12.3f us %12.3f us' % (key, results[key]['best'], results[key]['median']))
+            sys.stdout.flush()
+    return results
+
+def compare(results, baseline, tolerance):
+    ''' prints how the best times changed since baseline, returns the benchmarks slower than tolerance allows'''
+    slower = []
+    print('\n%-28s %12s %12s %8s' % ('benchmark', 'baseline', 'now', 'change'))
+    for key, result in results.items():
+        if key not in baseline:
+            print('%-28s %12s %12.3f %8s' % (key, '-', result['best'], 'new'))
+            continue
+        before = baseline[key]['best']
+        change = result['best'] / before - 1
+        flag = ''
+        if change > tolerance:
+            slower.append(key)
+            flag = '  slower'
+        print('%-28s %12.3f %12.3f %+7.1f%%%s' % (key, before, result['best'], change * 100, flag))
+    return slower
+
+def main(argv = None):
+    ''' command line entry point'''
+    parser = argparse.ArgumentParser(description = 'Benchmarks the Tetris engine, boards and renderer')
+    parser.add_argument('names', nargs = '*', help = 'benchmarks to run, all of them by default: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type = int, default = 5, help = 'timed repeats of each benchmark')
+    parser.add_argument('--save', metavar = 'FILE', help = 'saves the results as JSON')
+    parser.add_argument('--compare', metavar = 'FILE', help = 'compares against results saved earlier')
+    parser.add_argument('--tolerance', type = float, default = 0.1,
+                        help = 'fraction slower than the baseline that still passes')
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %s' % name)
+
+    print('%-28s %15s %15s' % ('benchmark', 'best', 'median'))
+    results = run_all(names, args.repeat)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': results}, f, indent = 1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print('\n%d slower than %.0f%% over the baseline: %s' % (len(slower), args.tolerance * 100,
+                                                                    ', '.join(slower)))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+# Board backends for the engine
+# (c) 2018 Tingda Wang
+
+from rules import BOARD_W, BOARD_H, NIL
+
+# bitmask of a row with every square filled
+FULL_ROW = (1 << BOARD_W) - 1
+
+class ListBoard:
+    '''
+    board stored as BOARD_W lists of BOARD_H squares, each square NIL or a color
+    indexed columns[x][y] like the original game
+    heights[x] is how many levels column x reaches up from the bottom and fills[y] how many
+    squares of level y are filled in, both kept up to date
+    '''
+
+    def __init__(self):
+        ''' returns an empty board '''
+        self.columns = []
+        for i in range(BOARD_W):
+            self.columns.append([NIL] * BOARD_H)
+        self.heights = [0] * BOARD_W
+        self.fills = [0] * BOARD_H
+
+    def copy(self):
+        ''' returns a copy of this board'''
+        board = ListBoard.__new__(ListBoard)
+        board.columns = [column[:] for column in self.columns]
+        board.heights = self.heights[:]
+        board.fills = self.fills[:]
+        return board
+
+    def get(self, x, y):
+        ''' color of square (x, y), or NIL if empty'''
+        return self.columns[x][y]
+
+    def set(self, x, y, color):
+        ''' fills in square (x, y) with color'''
+        if self.columns[x][y] == NIL:
+            self.fills[y] += 1
+        self.columns[x][y] = color
+        self.heights[x] = max(self.heights[x], BOARD_H - y)
+
+    def column_height(self, x):
+        ''' how many levels column x reaches up from the bottom, found by scanning it'''
+        column = self.columns[x]
+        for y in range(BOARD_H):
+            if column[y] != NIL:
+                return BOARD_H - y
+        return 0
+
+    def dump(self):
+        ''' the board as bytes, row by row, 0 for empty squares and color + 1 otherwise'''
+        return bytes(0 if self.columns[x][y] == NIL else self.columns[x][y] + 1
+                     for y in range(BOARD_H) for x in range(BOARD_W))
+
+    def load(self, data):
+        ''' fills in the board from dump() bytes'''
+        for y in range(BOARD_H):
+            for x in range(BOARD_W):
+                square = data[y * BOARD_W + x]
+                self.columns[x][y] = NIL if square == 0 else square - 1
+        self.heights = [self.column_height(x) for x in range(BOARD_W)]
+        self.fills = [sum(1 for x in range(BOARD_W) if data[y * BOARD_W + x]) for y in range(BOARD_H)]
+
+    def fits(self, mask, x, y):
+        '''
+        whether a piece mask with its template corner at (x, y) only covers free squares
+        squares that have not fallen onto the board yet are always free
+        '''
+        columns = self.columns
+        for dx, dy in mask.cells:
+            board_x, board_y = x + dx, y + dy
+            if board_y < 0:
+                continue
+            if board_x < 0 or board_x >= BOARD_W or board_y >= BOARD_H:
+                return False
+            if columns[board_x][board_y] != NIL:
+                return False
+        return True
+
+    def add(self, mask, x, y, color):
+        ''' fills in a piece mask, squares still above the board are lost'''
+        columns = self.columns
+        heights = self.heights
+        fills = self.fills
+        for dx, dy in mask.cells:
+            if y + dy >= 0:
+                columns[x + dx][y + dy] = color
+                heights[x + dx] = max(heights[x + dx], BOARD_H - y - dy)
+                fills[y + dy] += 1
+
+    def is_full(self, y):
+        ''' helper to check is given line is full'''
+        return self.fills[y] == BOARD_W
+
+    def delete_full_level(self, rows = None):
+        '''
+        deletes full levels and moves everything down in a single pass
+        rows limits which levels are checked, e.g. the ones a piece just landed on
+        returns the indices of the deleted levels, top to bottom
+        '''
+        if rows is None:
+            rows = range(BOARD_H)
+        full = [y for y in rows if self.is_full(y)]
+        if not full:
+            return full
+
+        # keep only the levels that aren't full, padding empty ones on top
+        kept = [y for y in range(BOARD_H) if y not in full]
+        padding = [NIL] * len(full)
+        for column in self.columns:
+            column[:] = padding + [column[y] for y in kept]
+        self.fills[:] = [0] * len(full) + [self.fills[y] for y in kept]
+        update_heights(self, full)
+        return full
+
+    def add_full_level(self, row):
+        ''' moves everything up one level and puts row (BOARD_W squares) at the bottom'''
+        for x in range(BOARD_W):
+            column = self.columns[x]
+            del column[0]
+            column.append(row[x])
+        del self.fills[0]
+        self.fills.append(BOARD_W - row.count(NIL))
+        raise_heights(self, row)
+
+    def place(self, mask, x, y, color):
+        '''
+        adds a piece mask and deletes the levels it fills, like the engine locking a piece,
+        returns the number of levels deleted and what undo() needs to take the board back,
+        so a search can try placements on one board instead of copying it for each
+        '''
+        heights = self.heights[:]
+        self.add(mask, x, y, color)
+        full = [row for row in range(max(y + mask.top, 0), y + mask.bottom + 1) if self.fills[row] == BOARD_W]
+        deleted = [[column[row] for column in self.columns] for row in full]
+        self.delete_full_level(full)
+        return len(full), (mask, x, y, heights, full, deleted)
+
+    def undo(self, placed):
+        ''' takes back a place(), given what it returned, the last one first when there were several'''
+        mask, x, y, heights, full, deleted = placed
+        columns = self.columns
+        if full:
+            for board_x, column in enumerate(columns):
+                column[:] = insert_levels(column, full, [row[board_x] for row in deleted])
+            self.fills[:] = insert_levels(self.fills, full, [BOARD_W] * len(full))
+        for dx, dy in mask.cells:
+            if y + dy >= 0:
+                columns[x + dx][y + dy] = NIL
+                self.fills[y + dy] -= 1
+        self.heights[:] = heights
+
+class BitBoard:
+    '''
+    board stored as BOARD_H integer rows, bit x of rows[y] set when square (x, y) is filled
+    colors are kept row by row in a separate bytearray, only meaningful where a bit is set
+    heights[x] is how many levels column x reaches up from the bottom and fills[y] how many
+    squares of level y are filled in, both kept up to date
+    '''
+
+    def __init__(self):
+        ''' returns an empty board '''
+        self.rows = [0] * BOARD_H
+        self.colors = bytearray(BOARD_W * BOARD_H)
+        self.heights = [0] * BOARD_W
+        self.fills = [0] * BOARD_H
+
+    def copy(self):
+        ''' returns a copy of this board'''
+        board = BitBoard.__new__(BitBoard)
+        board.rows = self.rows[:]
+        board.colors = self.colors[:]
+        board.heights = self.heights[:]
+        board.fills = self.fills[:]
+        return board
+
+    def get(self, x, y):
+        ''' color of square (x, y), or NIL if empty'''
+        if self.rows[y] >> x & 1:
+            return self.colors[y * BOARD_W + x]
+        return NIL
+
+    def set(self, x, y, color):
+        ''' fills in square (x, y) with color'''
+        if not self.rows[y] >> x & 1:
+            self.fills[y] += 1
+        self.rows[y] |= 1 << x
+        self.colors[y * BOARD_W + x] = color
+        self.heights[x] = max(self.heights[x], BOARD_H - y)
+
+    def column_height(self, x):
+        ''' how many levels column x reaches up from the bottom, found by scanning it'''
+        bit = 1 << x
+        for y in range(BOARD_H):
+            if self.rows[y] & bit:
+                return BOARD_H - y
+        return 0
+
+    def dump(self):
+        ''' the board as bytes, row by row, 0 for empty squares and color + 1 otherwise'''
+        return bytes(self.colors[y * BOARD_W + x] + 1 if self.rows[y] >> x & 1 else 0
+                     for y in range(BOARD_H) for x in range(BOARD_W))
+
+    def load(self, data):
+        ''' fills in the board from dump() bytes'''
+        for y in range(BOARD_H):
+            row = 0
+            for x in range(BOARD_W):
+                square = data[y * BOARD_W + x]
+                if square:
+                    row |= 1 << x
+                    self.colors[y * BOARD_W + x] = square - 1
+            self.rows[y] = row
+        self.heights = [self.column_height(x) for x in range(BOARD_W)]
+        self.fills = [bin(row).count('1') for row in self.rows]
+
+    def fits(self, mask, x, y):
+        '''
+        whether a piece mask with its template corner at (x, y) only covers free squares
+        squares that have not fallen onto the board yet are always free
+        '''
+        shifted = mask.shifted.get(x)
+        if shifted is None: # the whole piece is off either side
+            return y + mask.bottom < 0
+        rows = self.rows
+        for dy, bits, squares in shifted:
+            board_y = y + dy
+            if board_y < 0:
+                continue
+            if board_y >= BOARD_H or bits is None or rows[board_y] & bits:
+                return False
+        return True
+
+    def add(self, mask, x, y, color):
+        ''' fills in a piece mask, squares still above the board are lost'''
+        rows = self.rows
+        fills = self.fills
+        for dy, bits, squares in mask.shifted[x]:
+            if y + dy >= 0:
+                rows[y + dy] |= bits
+                fills[y + dy] += squares
+        heights = self.heights
+        colors = self.colors
+        for dx, dy in mask.cells:
+            if y + dy >= 0:
+                colors[(y + dy) * BOARD_W + x + dx] = color
+                if heights[x + dx] < BOARD_H - y - dy:
+                    heights[x + dx] = BOARD_H - y - dy
+
+    def is_full(self, y):
+        ''' helper to check is given line is full'''
+        return self.rows[y] == FULL_ROW
+
+    def delete_full_level(self, rows = None):
+        '''
+        deletes full levels and moves everything down in a single pass
+        rows limits which levels are checked, e.g. the ones a piece just landed on
+        returns the indices of the deleted levels, top to bottom
+        '''
+        if rows is None:
+            rows = range(BOARD_H)
+        full = [y for y in rows if self.rows[y] == FULL_ROW]
+        if not full:
+            return full
+
+        # keep only the levels that aren't full, padding empty ones on top
+        kept = [y for y in range(BOARD_H) if y not in full]
+        colors = self.colors
+        self.rows[:] = [0] * len(full) + [self.rows[y] for y in kept]
+        self.colors = bytearray(BOARD_W * len(full)) + b''.join(
+            [colors[y * BOARD_W:(y + 1) * BOARD_W] for y in kept])
+        self.fills[:] = [0] * len(full) + [self.fills[y] for y in kept]
+        update_heights(self, full)
+        return full
+
+    def add_full_level(self, row):
+        ''' moves everything up one level and puts row (BOARD_W squares) at the bottom'''
+        mask = 0
+        for x in range(BOARD_W):
+            if row[x] != NIL:
+                mask |= 1 << x
+        del self.rows[0]
+        self.rows.append(mask)
+        del self.colors[0:BOARD_W]
+        self.colors.extend(0 if color == NIL else color for color in row)
+        del self.fills[0]
+        self.fills.append(BOARD_W - row.count(NIL))
+        raise_heights(self, row)
+
+    def place(self, mask, x, y, color):
+        '''
+        adds a piece mask and deletes the levels it fills, like the engine locking a piece,
+        returns the number of levels deleted and what undo() needs to take the board back,
+        so a search can try placements on one board instead of copying it for each
+        '''
+        heights = self.heights[:]
+        self.add(mask, x, y, color)
+        full = [row for row in range(max(y + mask.top, 0), y + mask.bottom + 1) if self.rows[row] == FULL_ROW]
+        deleted = [self.colors[row * BOARD_W:(row + 1) * BOARD_W] for row in full]
+        self.delete_full_level(full)
+        return len(full), (mask, x, y, heights, full, deleted)
+
+    def undo(self, placed):
+        ''' takes back a place(), given what it returned, the last one first when there were several'''
+        mask, x, y, heights, full, deleted = placed
+        if full:
+            self.rows[:] = insert_levels(self.rows, full, [FULL_ROW] * len(full))
+            colors = [self.colors[row * BOARD_W:(row + 1) * BOARD_W] for row in range(BOARD_H)]
+            self.colors = bytearray(b''.join(insert_levels(colors, full, deleted)))
+            self.fills[:] = insert_levels(self.fills, full, [BOARD_W] * len(full))
+        for dy, bits, squares in mask.shifted[x]:
+            if y + dy >= 0:
+                self.rows[y + dy] &= ~bits
+                self.fills[y + dy] -= squares
+        self.heights[:] = heights
+
+def update_heights(board, full):
+    '''
+    updates the column heights of a board after its full levels were deleted
+    every column had a square on each full level, so each one loses as many levels,
+    unless its top square was on a full level and there may be a gap beneath
+    '''
+    heights = board.heights
+    for x in range(BOARD_W):
+        if BOARD_H - heights[x] == full[0]:
+            heights[x] = board.column_height(x)
+        else:
+            heights[x] -= len(full)
+
+def insert_levels(levels, full, deleted):
+    '''
+    the other way around from deleting full levels, given a list of BOARD_H things by level
+    as delete_full_level() left it, the indices it returned and what was on those levels
+    '''
+    deleted = dict(zip(full, deleted))
+    kept = iter(levels[len(full):])
+    return [deleted[y] if y in deleted else next(kept) for y in range(BOARD_H)]
+
+def get_features(board):
+    '''
+    aggregate height, holes and bumpiness of a board, worked out from the column heights
+    and level fills it keeps up to date instead of looking at every square
+    a hole is an empty square with a filled one somewhere above it in its column, and
+    every filled square is under the top of its column, so the holes are the squares
+    under the tops less the filled ones, bumpiness adds up the height differences of
+    neighbouring columns
+    '''
+    heights = board.heights
+    height = sum(heights)
+    bumpiness = 0
+    for x in range(BOARD_W - 1):
+        bumpiness += abs(heights[x] - heights[x + 1])
+    return height, height - sum(board.fills), bumpiness
+
+def raise_heights(board, row):
+    ''' updates the column heights of a board after row was put beneath everything'''
+    heights = board.heights
+    for x in range(BOARD_W):
+        if heights[x] == BOARD_H: # the top level was pushed off
+            heights[x] = board.column_height(x)
+        elif heights[x]:
+            heights[x] += 1
+        elif row[x] != NIL:
+            heights[x] = 1
+
+# board backends the engine can be built with
+BACKENDS = {'list': ListBoard, 'bits': BitBoard}
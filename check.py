@@ -0,0 +1,226 @@
+# Checks that the fast paths play exactly like the rules they stand in for
+# (c) 2018 Tingda Wang
+#
+# usage: python3 check.py [names] [--seeds 100] [--steps 1000]
+#
+# Each check plays the same seeds both ways and counts every difference, printing
+# the first few, and exits with 1 if there was any, so a change to a fast path
+# can be tried against the straightforward version it has to agree with.
+
+import sys, random, argparse
+
+from rules import BOARD_W, BOARD_H, TEMPLATE_W, TEMPLATE_H, PIECES, MASKS, RANDOM, BAG, Piece
+from engine import Engine
+from board import BACKENDS
+from placements import get_placements
+from batch import BatchEngine
+
+# game i is played with seed SEED + i
+SEED = 1998
+# differences printed by each check, the rest are only counted
+MAX_REPORTED = 10
+# chances of a placement sticking out the side of the board, which ends the game,
+# and of a random one instead of the lowest, so games both clear lines and top out
+OFF_SIDE = 0.01
+ANYWHERE = 0.05
+
+def report(mismatches, message):
+    ''' counts a difference, printing it while there are few'''
+    if mismatches < MAX_REPORTED:
+        print('  ' + message)
+    return mismatches + 1
+
+def get_depth(engine, shape, rotation, x):
+    '''
+    how low a piece dropped from where the current one is would land, as the levels
+    of its top and bottom squares added up, None if it doesn't fit up there
+    '''
+    piece = Piece()
+    piece.shape, piece.rotation, piece.x, piece.y = shape, rotation, x, engine.curr_piece.y
+    if not engine.is_free(piece):
+        return None
+    while engine.is_free(piece, y_adj = 1):
+        piece.y += 1
+    mask = MASKS[shape][rotation]
+    return 2 * piece.y + mask.top + mask.bottom
+
+def choose(rng, engine):
+    '''
+    a (rotation, x) for the engine's current piece, mostly the one landing deepest,
+    otherwise a random one and now and then one off the side
+    '''
+    piece = engine.curr_piece
+    if piece is None or engine.game_over:
+        return 0, 0
+    rotation = rng.randrange(len(PIECES[piece.shape]))
+    mask = MASKS[piece.shape][rotation]
+    if rng.random() < OFF_SIDE:
+        return rotation, rng.choice((-mask.left - 1, BOARD_W - mask.right))
+    if rng.random() < ANYWHERE:
+        return rotation, rng.randint(-mask.left, BOARD_W - 1 - mask.right)
+    depths = [(get_depth(engine, piece.shape, rotation, x), rng.random(), rotation, x)
+              for rotation, mask in enumerate(MASKS[piece.shape])
+              for x in range(-mask.left, BOARD_W - mask.right)]
+    depth, tie, rotation, x = max(depth for depth in depths if depth[0] is not None)
+    return rotation, x
+
+# what check_batch() compares after every placement
+BATCH_FIELDS = ('board', 'score', 'difficulty', 'pieces', 'game over', 'lines')
+
+def check_batch(seeds, steps):
+    '''
+    BatchEngine.place() against an Engine per seed playing the same placements, in every
+    piece generator mode, comparing BATCH_FIELDS
+    returns the number of differences
+    '''
+    mismatches = 0
+    for mode in (RANDOM, BAG):
+        numbers = range(SEED, SEED + seeds)
+        engines = [Engine(seed, mode = mode) for seed in numbers]
+        batch = BatchEngine(list(numbers), mode)
+        rng = random.Random(SEED)
+        for step in range(steps):
+            if all(engine.game_over for engine in engines):
+                break
+            rotations, xs = zip(*(choose(rng, engine) for engine in engines))
+            lines = batch.place(rotations, xs)
+            for i, engine in enumerate(engines):
+                cleared = engine.place(rotations[i], xs[i])
+                expected = (engine.board.dump(), engine.score, engine.difficulty, engine.pieces,
+                            engine.game_over, cleared)
+                got = (batch.boards[i].tobytes(), int(batch.score[i]), int(batch.difficulty[i]),
+                       int(batch.pieces[i]), bool(batch.game_over[i]), int(lines[i]))
+                if got != expected:
+                    differ = [field for field, a, b in zip(BATCH_FIELDS, got, expected) if a != b]
+                    mismatches = report(mismatches, '%s seed %d step %d: %s differ'
+                                        % (mode, numbers[i], step, ', '.join(differ)))
+    return mismatches
+
+# random pieces dropped on the board of every step of check_drop_distance()
+DROPS = 20
+
+def get_random_piece(rng):
+    ''' a piece of any shape and rotation anywhere around the board, even far above it'''
+    piece = Piece()
+    piece.shape = rng.choice(list(PIECES))
+    piece.rotation = rng.randrange(len(PIECES[piece.shape]))
+    piece.x = rng.randint(-TEMPLATE_W, BOARD_W)
+    piece.y = rng.randint(-2 * TEMPLATE_H, BOARD_H - 1)
+    return piece
+
+def scan_drop(engine, piece):
+    ''' how far a piece can fall, moving it down a level at a time'''
+    distance = 0
+    while engine.is_free(piece, y_adj = distance + 1):
+        distance += 1
+    return distance
+
+def check_drop_distance(seeds, steps):
+    '''
+    Engine.drop_distance() against a level by level scan, for random pieces that fit
+    on the boards of games played on every backend
+    returns the number of differences
+    '''
+    mismatches = 0
+    for backend in BACKENDS:
+        for seed in range(SEED, SEED + seeds):
+            engine = Engine(seed, backend)
+            rng = random.Random(seed)
+            for step in range(steps):
+                if engine.game_over:
+                    break
+                for i in range(DROPS):
+                    piece = get_random_piece(rng)
+                    if not engine.is_free(piece):
+                        continue
+                    got, expected = engine.drop_distance(piece), scan_drop(engine, piece)
+                    if got != expected:
+                        mismatches = report(mismatches, '%s seed %d step %d: %s rotation %d at (%d, %d) drops %d, not %d'
+                                            % (backend, seed, step, piece.shape, piece.rotation, piece.x, piece.y,
+                                               got, expected))
+                engine.place(*choose(rng, engine))
+    return mismatches
+
+def search_depth_first(board, shape, rotation, x, y):
+    '''
+    the squares of every placement a piece starting at (rotation, x, y) can reach, following
+    each move as deep as it goes from every state reached, with the moves get_placements() allows
+    '''
+    masks = MASKS[shape]
+    rotations = len(PIECES[shape])
+    if not board.fits(masks[rotation], x, y):
+        return set()
+    reached = set()
+    stack = [(rotation, x, y)]
+    seen = set(stack)
+    while stack:
+        rotation, x, y = stack.pop()
+        mask = masks[rotation]
+        if x + mask.left >= 0 and x + mask.right < BOARD_W and not board.fits(mask, x, y + 1):
+            reached.add(frozenset((x + dx, y + dy) for dx, dy in mask.cells))
+        for state in ((rotation, x - 1, y), (rotation, x + 1, y), (rotation, x, y + 1),
+                      ((rotation + 1) % rotations, x, y), ((rotation - 1) % rotations, x, y)):
+            if state not in seen and -TEMPLATE_W < state[1] < BOARD_W and board.fits(masks[state[0]], *state[1:]):
+                seen.add(state)
+                stack.append(state)
+    return reached
+
+def check_placements(seeds, steps):
+    '''
+    get_placements() against a depth first search, for the current piece where it spawned and
+    a random piece anywhere, on the boards of games played on every backend, comparing
+    the squares of the placements found and that none of them is found twice
+    returns the number of differences
+    '''
+    mismatches = 0
+    for backend in BACKENDS:
+        for seed in range(SEED, SEED + seeds):
+            engine = Engine(seed, backend)
+            rng = random.Random(seed)
+            for step in range(steps):
+                if engine.game_over:
+                    break
+                for piece in (engine.curr_piece, get_random_piece(rng)):
+                    shape, rotation, x, y = piece.shape, piece.rotation, piece.x, piece.y
+                    placements = get_placements(engine.board, shape, rotation, x, y, boards = False)
+                    found = [frozenset((placement.x + dx, placement.y + dy)
+                                       for dx, dy in MASKS[shape][placement.rotation].cells)
+                             for placement in placements]
+                    expected = search_depth_first(engine.board, shape, rotation, x, y)
+                    if len(set(found)) != len(found) or set(found) != expected:
+                        mismatches = report(mismatches, '%s seed %d step %d: %s from (%d, %d, %d) finds %d placements, not %d'
+                                            % (backend, seed, step, shape, rotation, x, y, len(found), len(expected)))
+                engine.place(*choose(rng, engine))
+    return mismatches
+
+# check name: function taking the number of seeds and steps, returning the differences found
+CHECKS = {'batch': check_batch, 'drop_distance': check_drop_distance, 'placements': check_placements}
+
+def main(argv = None):
+    ''' command line entry point'''
+    parser = argparse.ArgumentParser(description = 'Checks the fast paths of the Tetris engine against the plain rules')
+    parser.add_argument('names', nargs = '*', help = 'checks to run, all of them by default: ' + ', '.join(CHECKS))
+    parser.add_argument('--seeds', type = int, default = 100, help = 'seeds played by each check')
+    parser.add_argument('--steps', type = int, default = 1000, help = 'placements per seed')
+    args = parser.parse_args(argv)
+
+    names = args.names or list(CHECKS)
+    for name in names:
+        if name not in CHECKS:
+            parser.error('unknown check %s' % name)
+
+    failed = []
+    for name in names:
+        print(name)
+        sys.stdout.flush()
+        mismatches = CHECKS[name](args.seeds, args.steps)
+        print('  %d differences' % mismatches)
+        if mismatches:
+            failed.append(name)
+    if failed:
+        print('\nfailed: ' + ', '.join(failed))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,42 @@
 # Competitive 2-Player Tetris game
 # (c) 2018 Tingda Wang
 
-import pygame, sys, random, time
+import pygame, sys, random, time, os, argparse, math, atexit
 from pygame.locals import *
 
+from rules import BOARD_W, BOARD_H
+from engine import (Engine, Match, ATTACKS, TICK_RATE, MAX_CATCH_UP, LEFT, RIGHT, DOWN, ROTATE, ROTATE_BACK,
+                    DROP, RELEASE_LEFT, RELEASE_RIGHT, RELEASE_DOWN)
+from replay import Recorder
+from render import SQ_SIZE, TEXT_CACHE, Theme, BoardView, Renderer, get_layout
+from instrument import Profiler, instrument_game
+from assets import Assets
+from ai import Bot, think_all
+from netplay import PORT, Client, Lockstep
+from spectate import Feed
+
 # Game Object Constants
-FPS = 30
+FRAME_RATE = 60 # frames a second while pieces are drawn falling smoothly
 WIN_W = 1280 # in pixels
 WIN_H = 480 # in pixels
-SQ_SIZE = 20
-BOARD_W = 10 # in squares
-BOARD_H = 20 # in squares
-NIL = '.' # nothin'
+NAME = 'ctetris' # replay file names
+MAX_PLAYERS = 8
+# boards side by side in a row of the window when more than 2 play, each row WIN_H high
+ROW_PLAYERS = 4
 
 # board margins within window
 SIDE_MARGINS = int(((WIN_W / 2) - (BOARD_W * SQ_SIZE)) / 2)
 TOP_MARGIN = WIN_H - (BOARD_H * SQ_SIZE) - 5
+# where frame timings go when profiling, left of the board and below the score
+PROFILE_AREA = pygame.Rect(5, 220, SIDE_MARGINS - 10, WIN_H - 225)
 
-''' Difficulty constants'''
-# how fast piece moves (FALL_FREQ not constant, will change based on difficulty)
-SIDEWAY_FREQ = 0.15
-DOWN_FREQ = 0.1
-# inverse of rate in which blocks speed up (the lower the faster)
-ACCELERATION = 5 
-
-# Fonts
+# Fonts, relative to the game's directory
 FONT_SIZE = 25
 SMALL = 'game_font/thin_pixel.ttf'
 BIG = 'game_font/arcadeclassic.ttf'
 TITLE = 'game_font/tetro.ttf'
 
-# Music!
+# Music! also relative to the game's directory
 MUSIC = ('game_music/theme.ogg', 'game_music/sad_tetris.mp3', 'game_music/scary_tetris.mp3')
 
 # Colors!
@@ -76,155 +82,61 @@ TEXT_COLOR = WHITE
 TEXT_SHADOW = GRAY
 TITLE_COLOR = LIGHT_AQUA
 TITLE_SHADOW = LIGHT_RED
+THEME = Theme(DARK_COLORS, LIGHT_COLORS, BACKGROUND, BORDER, BORDER_SHADE, TEXT_COLOR)
 
-# Templates for each shape
-TEMPLATE_W = 5
-TEMPLATE_H = 5
-
-S_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '..OO.',
-                     '.OO..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '...O.',
-                     '.....']]
-
-Z_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '.O...',
-                     '.....']]
-
-I_SHAPE_TEMPLATE = [['..O..',
-                     '..O..',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     'OOOO.',
-                     '.....',
-                     '.....']]
-
-O_SHAPE_TEMPLATE = [['.....',
-                     '.....',
-                     '.OO..',
-                     '.OO..',
-                     '.....']]
-
-J_SHAPE_TEMPLATE = [['.....',
-                     '.O...',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..OO.',
-                     '..O..',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '...O.',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '.OO..',
-                     '.....']]
-
-L_SHAPE_TEMPLATE = [['.....',
-                     '...O.',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..O..',
-                     '..OO.',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '.O...',
-                     '.....'],
-                    ['.....',
-                     '.OO..',
-                     '..O..',
-                     '..O..',
-                     '.....']]
-
-T_SHAPE_TEMPLATE = [['.....',
-                     '..O..',
-                     '.OOO.',
-                     '.....',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '..OO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '.....',
-                     '.OOO.',
-                     '..O..',
-                     '.....'],
-                    ['.....',
-                     '..O..',
-                     '.OO..',
-                     '..O..',
-                     '.....']]
-
-# dictionary to get corresponding piece template
-PIECES = {
-    'S': S_SHAPE_TEMPLATE,
-    'Z': Z_SHAPE_TEMPLATE,
-    'J': J_SHAPE_TEMPLATE,
-    'L': L_SHAPE_TEMPLATE,
-    'I': I_SHAPE_TEMPLATE,
-    'O': O_SHAPE_TEMPLATE,
-    'T': T_SHAPE_TEMPLATE
-    }
-
-class Piece:
-    ''' Piece class that stores shape, rotation, color and coordinate of piece'''
-
-    def __init__(self): 
-        ''' initializes empty piece starting in the middle top of board'''
-        self.shape = None
-        self.rotation = 0
-        self.x = int(BOARD_W / 2) - int(TEMPLATE_W / 2)
-        self.y = -2
-        self.color = None
-    
-    def get_random(self): 
-        ''' randomizes shape, rotation, and color'''
-        self.shape = random.choice(list(PIECES.keys()))
-        self.rotation = random.randint(0, len(PIECES[self.shape]) - 1)
-        self.color = random.randint(0, len(LIGHT_COLORS) - 1)
-        return self
+# Controls, keys pressed and released map onto each player's engine actions
+P1_KEY_ACTIONS = {K_a: LEFT, K_d: RIGHT, K_s: DOWN, K_w: ROTATE, K_q: ROTATE_BACK, K_SPACE: DROP}
+P1_KEY_RELEASES = {K_a: RELEASE_LEFT, K_d: RELEASE_RIGHT, K_s: RELEASE_DOWN}
+P2_KEY_ACTIONS = {K_LEFT: LEFT, K_RIGHT: RIGHT, K_DOWN: DOWN, K_UP: ROTATE, K_SLASH: ROTATE_BACK,
+                  K_RSHIFT: DROP}
+P2_KEY_RELEASES = {K_LEFT: RELEASE_LEFT, K_RIGHT: RELEASE_RIGHT, K_DOWN: RELEASE_DOWN}
+# (actions, releases) of the players at the keyboard, the computer plays the rest
+KEY_MAPS = [(P1_KEY_ACTIONS, P1_KEY_RELEASES), (P2_KEY_ACTIONS, P2_KEY_RELEASES)]
 
 class Tetris:
     ''' Tetris class'''
 
-    def __init__(self):
-        ''' initializes pygame settings'''
+    def __init__(self, record = None, smooth = False, profile = None, cpu = False, players = 2,
+                 attack = 'all', columns = None, connect = None, latency = 0, jitter = 0, broadcast = None):
+        '''
+        initializes pygame settings
+        record is a directory to save a replay of every game in, or None
+        smooth draws pieces falling between levels, redrawing at FRAME_RATE
+        profile is a .csv or .json file to save the timings of every frame in, or None
+        cpu makes the computer player 2, players past the keyboard ones are always the computer
+        attack is how cleared lines are sent on, see engine.ATTACKS
+        columns fixes how many boards go side by side with more than 2 players
+        connect is the (host, port) of a netplay server to play a match on, where this machine
+        plays one player, the computer with cpu, and the server picks the seeds and attack
+        latency and jitter hold back everything sent to it by that many seconds, see netplay.Link
+        broadcast is a port to stream every match to spectators on, see spectate.py, or None
+        '''
         pygame.init()
+        # fonts and music are read on their own thread while the window is set up
+        self.assets = Assets((SMALL, BIG, TITLE), MUSIC)
+        self.record = record
+        self.smooth = smooth
+        self.players = players
+        self.attack = attack
+        self.cpu = cpu
+        self.connect = connect
+        self.latency = latency
+        self.jitter = jitter
+        self.feed = None if broadcast is None else Feed('', broadcast)
+        # the computer plays everyone but player 1, and player 2 as well unless cpu is off
+        self.cpu_players = [player for player in range(1, players) if cpu or player >= len(KEY_MAPS)]
         random.seed(1998)
-        
-        # FPS clock
-        self.clock = pygame.time.Clock()
 
-        # display surface
-        self.display = pygame.display.set_mode((WIN_W, WIN_H))
+        # opt-in timings of every frame, shown on screen and saved on exit
+        self.profiler = None
+        if profile is not None:
+            self.profiler = Profiler()
+            instrument_game(self.profiler)
+            atexit.register(self.profiler.save, profile)
+        
+        # display surface, a row of boards for every ROW_PLAYERS players past 2
+        rows = 1 if players <= 2 else -(-players // ROW_PLAYERS)
+        self.display = pygame.display.set_mode((WIN_W, WIN_H * rows))
         pygame.display.set_caption('Competitive Tetris - wtingda')
 
         # mouse not in the way
@@ -232,41 +144,50 @@ class Tetris:
 
         # fonts
         if pygame.font:                                 
-            self.font = pygame.font.Font(SMALL, FONT_SIZE)           
-            self.large_font = pygame.font.Font(BIG, FONT_SIZE * 3)
-            self.title_font = pygame.font.Font(TITLE, FONT_SIZE * 4)
+            self.font = self.assets.get_font(SMALL, FONT_SIZE)
+            self.large_font = self.assets.get_font(BIG, FONT_SIZE * 3)
+            self.title_font = self.assets.get_font(TITLE, FONT_SIZE * 4)
         else:      
             self.font = None  
             self.large_font = None
 
+        # draws each player's board, score and next piece on their half of the window,
+        # or in a grid with more players, leaving room for the frame timings when profiling
+        if players <= 2:
+            half = int(WIN_W / 2)
+            views = [BoardView(SIDE_MARGINS, TOP_MARGIN, (80, 140), (80, 180), (half - 160, 140), (half - 150, 170)),
+                     BoardView(half + SIDE_MARGINS, TOP_MARGIN, (half + 80, 140), (half + 80, 180),
+                               (WIN_W - 160, 140), (WIN_W - 150, 170))]
+        else:
+            area = self.display.get_rect()
+            if self.profiler is not None:
+                area.width -= PROFILE_AREA.right
+                area.left = PROFILE_AREA.right
+            views = get_layout(players, area, self.font, columns)
+        self.renderer = Renderer(self.display, THEME, self.font, views, smooth = smooth)
+
     def run(self):
         ''' main game loop, with music!'''
         self.display.fill(BACKGROUND)
         self.display_text("Tetris", title = True)
         while True: 
             self.music()
-
-            # difficulty variables
-            self.score = [0, 0]
-            self.difficulty = self.speed = [0, 0]
-            self.set_difficulty() # sets these values
-
-            loser = self.play()
-            pygame.mixer.music.stop()
-            self.display_text('Player %d loses!' %loser)
+            winner = self.play()
+            self.assets.stop_music()
+            if self.players == 2: # both out on the same tick counts against player 1
+                self.display_text('Player %d loses!' % (2 if winner == 0 else 1))
+            elif winner is None:
+                self.display_text('Nobody wins!')
+            else:
+                self.display_text('Player %d wins!' % (winner + 1))
 
     def music(self):
-        ''' plays music randomly'''
-        if pygame.mixer.music.get_busy():
-            pygame.mixer.music.stop()
-        
-        # plays random music
-        pygame.mixer.music.load(random.choice(MUSIC))
-        pygame.mixer.music.play(-1, 0.0) # infinite loops, start at beginning
+        ''' plays music randomly, swapped in without holding up the frame'''
+        self.assets.play_music()
 
     def get_textobj(self, text, font, color):
         ''' helper for creating text objects'''
-        surf = font.render(text, True, color)
+        surf = TEXT_CACHE.render(font, text, color)
         return surf, surf.get_rect()
 
     def display_text(self, text, title = False): 
@@ -281,457 +202,235 @@ class Tetris:
             color = (TEXT_COLOR, TEXT_SHADOW)
 
         # draw text shadow
+        center_x, center_y = self.display.get_rect().center
         title_surf, title_rect = self.get_textobj(text, font, color[1])
-        title_rect.center = (int(WIN_W / 2), int(WIN_H / 2))
+        title_rect.center = (center_x, center_y)
         self.display.blit(title_surf, title_rect)
 
         # draw text
         title_surf, title_rect = self.get_textobj(text, font, color[0])
-        title_rect.center = (int(WIN_W / 2) - 3, int(WIN_H / 2) - 3)
+        title_rect.center = (center_x - 3, center_y - 3)
         self.display.blit(title_surf, title_rect)
 
         # displays (Press any key to continue)
         title_surf, title_rect = self.get_textobj("(Press any key to continue)", self.font, TEXT_COLOR)
-        title_rect.center = (int(WIN_W / 2), int(WIN_H / 2) - 80)
+        title_rect.center = (center_x, center_y - 80)
         self.display.blit(title_surf, title_rect)
         
-        # wait for keyboard hit to continue
-        while self.hit_kb() is None:
-            pygame.display.update()
-            self.clock.tick()
+        # sleeps until a key is hit to continue
+        pygame.display.update()
+        while self.hit_kb(pygame.event.wait()) is None:
+            pass
         
-    def hit_kb(self):        
+    def hit_kb(self, event):        
         ''' 
-        handles hitting a key in keyboard
+        handles an event while waiting for a key to be hit, returns the key or None
         also takes care of checking for quit events such as pressing esc
         '''
         # quit game
-        for event in pygame.event.get(QUIT):
+        if event.type == QUIT:
             pygame.quit()
             sys.exit()
 
-        for event in pygame.event.get([KEYDOWN, KEYUP]):
-            if event.type is KEYUP: # must have finished pressing
-                if event.key is K_ESCAPE: # esc to quite
-                    pygame.quit()
-                    sys.exit()
-                else: # otherwise return the key pressed
-                    return event.key
+        if event.type == KEYUP: # must have finished pressing
+            if event.key == K_ESCAPE: # esc to quite
+                pygame.quit()
+                sys.exit()
+            else: # otherwise return the key pressed
+                return event.key
+        elif event.type == VIDEOEXPOSE: # window needs redrawing
+            pygame.display.update()
         return None
 
-    def set_difficulty(self):
-        ''' sets the difficulty and speed variables '''
-        for i in range (2):
-            self.difficulty[i] = int(self.score[i] /ACCELERATION) + 1
-            self.speed[i] = 0.27 - (self.difficulty[i]* 0.02)
-    
-    def get_piece(self):
-        ''' gets random piece'''
-        piece = Piece()
-        return piece.get_random()
-
-    def not_on_board(self, x, y):
-        ''' 
-        helper for free_space(), checks if coordinates are valid board coordinates 
-        '''
-        return not (x >= 0 and x < BOARD_W and y < BOARD_H)
+    def wait_events(self, wake):
+        ''' sleeps until perf_counter() reaches wake or an event comes in, returns the waiting events'''
+        timeout = math.ceil((wake - time.perf_counter()) * 1000)
+        if timeout > 0:
+            event = pygame.event.wait(timeout)
+            if event.type != NOEVENT:
+                return [event] + pygame.event.get()
+        return pygame.event.get()
+
+    def get_recorder(self, engines):
+        ''' replay recorder for a new game, if recording'''
+        if self.record is None:
+            return None
+        os.makedirs(self.record, exist_ok = True)
+        name = time.strftime('%s-%%Y%%m%%d-%%H%%M%%S.ttr' % NAME)
+        return Recorder(os.path.join(self.record, name), engines, attack = self.attack)
+
+    def join(self):
+        ''' connects to the server and waits for a match to start, returns the Client'''
+        self.display.fill(BACKGROUND)
+        title_surf, title_rect = self.get_textobj("Waiting for players...", self.large_font, TEXT_COLOR)
+        title_rect.center = self.display.get_rect().center
+        self.display.blit(title_surf, title_rect)
+        pygame.display.update()
+
+        host, port = self.connect
+        client = Client(host, port, self.latency, self.jitter)
+        try:
+            while not client.wait_start(0.05):
+                for event in pygame.event.get():
+                    self.hit_kb(event) # quits on esc
+        except OSError as error:
+            pygame.quit()
+            sys.exit('could not join a match at %s:%d: %s' % (host, port, error))
+        if client.players != self.players:
+            client.close()
+            pygame.quit()
+            sys.exit('the server plays %d player matches, add --players %d' % (client.players, client.players))
+        self.attack = client.attack # for the replay
+        self.renderer.invalidate()
+        return client
 
-    def is_free(self, piece, board, x_adj = 0, y_adj = 0):
-        ''' 
-        determines if the piece occupies all free space
-        supports optional adjustments x_adj and y_adj
+    def play(self):
         '''
-        for x in range(TEMPLATE_W):
-            for y in range(TEMPLATE_H):
-                not_fallen_yet = (y + piece.y + y_adj < 0)
-                square = PIECES[piece.shape][piece.rotation][y][x]
-                if not_fallen_yet or square == NIL: 
-                    # coordinate is empty
-                    continue
-                if self.not_on_board(x + piece.x + x_adj, y + piece.y + y_adj):
-                    # coordinate not valid
-                    return False
-                if board[x + piece.x + x_adj][y + piece.y + y_adj] != NIL:
-                    # piece on occupied space
-                    return False
-        return True
-
-    def get_board(self):
-        ''' returns an empty board '''
-        board = []
-        for i in range(BOARD_W):
-            board.append([NIL] * BOARD_H)
-        return board
-    
-    def add(self, piece, board):
-        ''' fills in a piece onto board '''
-        for x in range(TEMPLATE_W):
-            for y in range(TEMPLATE_H):
-                if PIECES[piece.shape][piece.rotation][y][x] != NIL:
-                    # each element in 2D array boards stores a color
-                    board[x + piece.x][y + piece.y] = piece.color
-        
-    def is_full(self, y, board):
-        ''' helper to check is given line is full'''
-        for x in range(BOARD_W):
-            if board[x][y] == NIL:
-                return False
-        return True
-
-    def delete_full_level(self, board):
-        ''' deletes a full level if there is one and moves everything down'''
-        lines_removed = 0
-        y = BOARD_H - 1 # start at bottom
-        while y >= 0:
-            if self.is_full(y, board):
-                # pull everything down one level
-                for i in range(y, 0, -1):
-                    for j in range(BOARD_W):
-                        board[j][i] = board[j][i - 1]
-                # clear top level in case
-                for x in range(BOARD_W):
-                    board[x][0] = NIL
-                lines_removed += 1
-                # go through loop to check if there is another level to be removed
-            else:
-                y -= 1 # we know this row isn't full, can go up now
-        return lines_removed
-
-    def add_full_level(self, board):
-        ''' adds another level beneath level and moves everything up'''
-        # push everything up one level
-        for i in range(0, BOARD_H - 1):
-            for j in range(BOARD_W):
-                board[j][i] = board[j][i + 1]
-                # clear top level in case
-        full_bottom_row = True
-        while full_bottom_row:
-            for x in range(BOARD_W):
-                color = random.randint(0, len(LIGHT_COLORS) - 1)
-                board[x][BOARD_H - 1] = random.choice((NIL, color))
-            full_bottom_row = self.is_full(BOARD_H - 1, board)
-            
-    def get_display_coords(self, x, y, P2 = False):
-        ''' for given board coord, find relevant coordinates on display'''
-        if not P2:
-            return (SIDE_MARGINS + (x * SQ_SIZE)), (TOP_MARGIN + (y * SQ_SIZE))
-
-        else:
-            return (WIN_W/2 + SIDE_MARGINS + (x * SQ_SIZE)), (TOP_MARGIN + (y * SQ_SIZE))
-
-    def draw_square(self, x, y, color, disp_x = None, disp_y = None, P2 = False):
-        ''' 
-        draws a square on the screen at location (x, y) on board 
-        supports board coordinates (default) and display coordinates
+        main game loop, feeds key presses and the computer's moves to every engine and draws their state
+        returns the player who won, None if the last ones went out together
         '''
-        if disp_x is None and disp_y is None:
-            disp_x, disp_y = self.get_display_coords(x, y, P2)
-
-        # draws the squares
-        pygame.draw.rect(self.display, DARK_COLORS[color], (disp_x + 1, disp_y + 1, SQ_SIZE - 1, SQ_SIZE - 1))
-        pygame.draw.rect(self.display, LIGHT_COLORS[color], (disp_x + 4, disp_y + 4, SQ_SIZE - 2 , SQ_SIZE - 2))
-
-    def draw_board(self):
-        ''' draws the entire board '''
-        # draws the board border
-        pygame.draw.rect(self.display, BORDER, (SIDE_MARGINS - 3, TOP_MARGIN - 7, (BOARD_W * SQ_SIZE) + 8, (BOARD_H * SQ_SIZE) + 8), 5)
-
-        pygame.draw.rect(self.display, BORDER_SHADE, (SIDE_MARGINS + 1, TOP_MARGIN - 3, (BOARD_W * SQ_SIZE) + 8, (BOARD_H * SQ_SIZE) + 8), 5)
-
-        pygame.draw.rect(self.display, BORDER, ( (WIN_W / 2) + SIDE_MARGINS - 3, TOP_MARGIN - 7, (BOARD_W * SQ_SIZE) + 8, (BOARD_H * SQ_SIZE) + 8), 5)
-
-        pygame.draw.rect(self.display, BORDER_SHADE, ( (WIN_W / 2) + SIDE_MARGINS + 1, TOP_MARGIN - 3, (BOARD_W * SQ_SIZE) + 8, (BOARD_H * SQ_SIZE) + 8), 5)
-
-        # draws the background
-        pygame.draw.rect(self.display, BACKGROUND, (SIDE_MARGINS, TOP_MARGIN, SQ_SIZE * BOARD_W, SQ_SIZE * BOARD_H))
-        pygame.draw.rect(self.display, BACKGROUND, ((WIN_W / 2) + SIDE_MARGINS, TOP_MARGIN, SQ_SIZE * BOARD_W, SQ_SIZE * BOARD_H))
-
-        # draws the squares
-        for i in range(BOARD_W):
-            for j in range(BOARD_H):
-                if self.board1[i][j] is not NIL:
-                    self.draw_square(i, j, self.board1[i][j])
-                if self.board2[i][j] is not NIL:
-                    self.draw_square(i, j, self.board2[i][j], P2 = True)
-
-    def draw_score(self):
-        ''' displays the score and difficulty at top of screen'''
-        # score
-        surf = self.font.render("Score: %s" %self.score[0], True, TEXT_COLOR)
-        self.display.blit(surf, (80, 140))
-
-        surf2 = self.font.render("Score: %s" %self.score[1], True, TEXT_COLOR)
-        self.display.blit(surf2, (WIN_W / 2 + 80, 140))
-
-        # difficulty
-        surf = self.font.render("Difficulty: %s" %self.difficulty[0], True, TEXT_COLOR)
-        self.display.blit(surf, (80, 180))
-
-        surf2 = self.font.render("Difficulty: %s" %self.difficulty[0], True, TEXT_COLOR)
-        self.display.blit(surf2, (WIN_W / 2 + 80, 180))
-
-    def draw_piece(self, piece, disp_x = None, disp_y = None, P2 = False):
-        ''' draws each piece on board '''
-        shape = PIECES[piece.shape][piece.rotation]
-        if disp_x is None and disp_y is None:
-            disp_x, disp_y = self.get_display_coords(piece.x, piece.y, P2)
-        
-        # draws piece
-        for i in range(TEMPLATE_W):
-            for j in range(TEMPLATE_H):
-                if shape[j][i] is not NIL:
-                    self.draw_square(None, None, piece.color, disp_x + (i * SQ_SIZE), disp_y + (j * SQ_SIZE))
-    
-    def draw_next(self, piece, P2 = False):
-        ''' shows the next piece to drop (though you probably won't look at it) '''
-        if not P2:
-            win = WIN_W / 2
-        else:
-            win = WIN_W
-        surf = self.font.render("Next Piece:", True, TEXT_COLOR)
-        self.display.blit(surf, (win - 160, 140))
-        self.draw_piece(piece, disp_x = win - 150, disp_y = 170)
-
-    def play(self):
-        ''' main game loop'''
-        self.board1, self.board2 = self.get_board(), self.get_board()
-        down_time1 = time.time()
-        sideway_time1 = time.time()
-        fall_time1 = time.time()
-
-        down_time2 = time.time()
-        sideway_time2 = time.time()
-        fall_time2 = time.time()
-
-        # direction moving in
-        down1 = False
-        left1 = False
-        right1 = False        
-
-
-        down2 = False
-        left2 = False
-        right2 = False        
-
-        game_over1 = False
-        game_over2 = False
-        
-        # get current and upcoming pieces
-        curr_piece1 = self.get_piece()
-        next_piece1 = self.get_piece()
-
-        curr_piece2 = self.get_piece()
-        next_piece2 = self.get_piece()
-
-        while not game_over1 and not game_over2: # game loop
-            if curr_piece1 is None:
-                curr_piece1 = next_piece1
-                next_piece1 = self.get_piece()
-                fall_time1 = time.time()
-
-            if curr_piece2 is None:
-                curr_piece2 = next_piece2
-                next_piece2 = self.get_piece()
-                fall_time2 = time.time()
-
-            if not self.is_free(curr_piece1, self.board1):
-                game_over1 = True
-
-            if not self.is_free(curr_piece2, self.board2):
-                game_over2 = True
-
-            for event in pygame.event.get():
+        if self.connect is None:
+            client = None
+            self.engines = [Engine(seed = random.getrandbits(32)) for player in range(self.players)]
+            match = Match(self.engines, self.attack)
+            recorder = self.get_recorder(self.engines)
+            bots = {player: Bot() for player in self.cpu_players}
+            keys = list(enumerate(KEY_MAPS)) # (player, key map)
+        else: # one player here, on either set of keys, the rest come over the network
+            client = self.join()
+            match = Lockstep(client, get_recorder = self.get_recorder)
+            self.engines = match.engines
+            recorder = None # the lockstep records the actions every player agreed on
+            bots = {client.player: Bot()} if self.cpu else {}
+            keys = [(client.player, key_map) for key_map in KEY_MAPS]
+        engines = self.engines
+        self.renderer.invalidate()
+        self.renderer.render(engines)
+        # spectators are shown what every player agreed on, which never rolls back
+        watched = match if client is None else match.confirmed
+        if self.feed is not None:
+            self.feed.watch(watched.engines)
+
+        start = time.perf_counter() # when tick 0 was due
+        actions = [[] for engine in engines] # inputs waiting for a tick
+        while not match.is_over(): # game loop
+            # the other players' actions, which can take back what was predicted
+            rolled_back = client is not None and match.poll()
+
+            # the computer players think a slice at a time, so the game keeps going meanwhile
+            playing = [(bot, engines[player]) for player, bot in bots.items() if player in match.playing]
+            if playing:
+                think_all(playing)
+                if self.profiler is not None:
+                    self.profiler.lap('think')
+
+            # sleeps until the match's next deadline, or the next tick if inputs are waiting
+            waiting = any(actions)
+            wake = match.tick if waiting else match.deadline()
+            for bot, engine in playing: # the computer's next key presses
+                if bot.get_wake(engine) is not None:
+                    wake = min(wake, bot.get_wake(engine))
+            wake = start + wake / TICK_RATE
+            if self.smooth or client is not None or any(bot.is_thinking() for bot, engine in playing):
+                # keeps drawing frames in between, or checking for the other players' actions
+                wake = min(wake, time.perf_counter() + 1 / FRAME_RATE)
+            events = self.wait_events(wake)
+            if self.profiler is not None:
+                self.profiler.lap('wait')
+            for event in events:
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
-                if event.type == KEYUP:
-                    if(event.key == K_p): # pause
+                if event.type == VIDEOEXPOSE:
+                    self.renderer.invalidate()
+                elif event.type == KEYUP:
+                    if(event.key == K_p and client is None): # pause, the engines only move when stepped
+                        paused = time.perf_counter()
                         self.display.fill(BACKGROUND)
-                        pygame.mixer.music.pause()
+                        self.assets.pause_music()
                         self.display_text("GAME PAUSED")
-                        pygame.mixer.music.unpause()
-                        fall_time1 = down_time1 = sideway_time1 = fall_time2 = down_time2 = sideway_time2 = time.time()
+                        self.assets.unpause_music()
+                        self.renderer.invalidate()
+                        start += time.perf_counter() - paused
                     # press r changes music
                     elif(event.key == K_r):
                         self.music()
                     # stops going in that direction
-                    elif (event.key == K_a):
-                        left1 = False
-                    elif (event.key == K_d):
-                        right1 = False
-                    elif (event.key == K_s):
-                        down1 = False
-                    elif (event.key == K_LEFT):
-                        left2 = False
-                    elif (event.key == K_RIGHT):
-                        right2 = False
-                    elif (event.key == K_DOWN):
-                        down2 = False
-                   
+                    else:
+                        for player, (key_actions, key_releases) in keys:
+                            if event.key in key_releases and player not in bots:
+                                actions[player].append(key_releases[event.key])
                 elif event.type == KEYDOWN:
-                    # change direction (left and right)
-                    if (event.key == K_a):
-                        if self.is_free(curr_piece1, self.board1, x_adj = -1):
-                            curr_piece1.x -= 1
-                        left1 = True
-                        right1 = False
-                        sideway_time1 = time.time()
-                    elif (event.key == K_d):
-                        if self.is_free(curr_piece1,self.board1, x_adj = 1):
-                            curr_piece1.x += 1
-                        right1 = True
-                        left1 = False
-                        sideway_time1 = time.time()
-                    elif (event.key == K_s):
-                        down1 = True
-                        if self.is_free(curr_piece1, self.board1, y_adj = 1):
-                            curr_piece1.y += 1
-                        down_time1 = time.time()
-                    # up is rotation, move to next element in group
-                    elif (event.key == K_w):
-                        temp = curr_piece1.rotation
-                        curr_piece1.rotation = (curr_piece1.rotation + 1) % len(PIECES[curr_piece1.shape])
-                        if not self.is_free(curr_piece1, self.board1):
-                            curr_piece1.rotation = temp
-                    # q rotates in other direction
-                    elif (event.key == K_q):
-                        temp = curr_piece1.rotation
-                        curr_piece1.rotation = (curr_piece1.rotation - 1) % len(PIECES[curr_piece1.shape])
-                        if not self.is_free(curr_piece1, self.board1):
-                            curr_piece1.rotation = temp
-
-                    # space bar sends piece to bottom
-                    elif (event.key == K_SPACE):
-                        down1= left1 = right1 = False
-                        for i in range(1, BOARD_H):
-                            if not self.is_free(curr_piece1, self.board1, y_adj = i):
-                                break
-                        curr_piece1.y += i - 1
-
-                    # P2
-                    # change direction (left and right)
-                    elif (event.key == K_LEFT):
-                        if self.is_free(curr_piece2, self.board2, x_adj = -1):
-                            curr_piece2.x -= 1
-                        left2 = True
-                        right2 = False
-                        sideway_time2 = time.time()
-                    elif (event.key == K_RIGHT):
-                        if self.is_free(curr_piece2, self.board2, x_adj = 1):
-                            curr_piece2.x += 1
-                        right2 = True
-                        left2 = False
-                        sideway_time2 = time.time()
-                    elif (event.key == K_DOWN):
-                        down2 = True
-                        if self.is_free(curr_piece2, self.board2, y_adj = 1):
-                            curr_piece2.y += 1
-                        down_time2 = time.time()
-                    # up is rotation, move to next element in group
-                    elif (event.key == K_UP):
-                        temp = curr_piece2.rotation
-                        curr_piece2.rotation = (curr_piece2.rotation + 1) % len(PIECES[curr_piece2.shape])
-                        if not self.is_free(curr_piece2, self.board2):
-                            curr_piece2.rotation = temp
-                    # / key rotates in other direction
-                    elif (event.key == K_SLASH):
-                        temp = curr_piece2.rotation
-                        curr_piece2.rotation = (curr_piece2.rotation - 1) % len(PIECES[curr_piece2.shape])
-                        if not self.is_free(curr_piece2, self.board2):
-                            curr_piece2.rotation = temp
-
-                    # right shift key sends piece to bottom
-                    elif (event.key == K_RSHIFT):
-                        down2 = left2 = right2 = False
-                        for i in range(1, BOARD_H):
-                            if not self.is_free(curr_piece2, self.board2, y_adj=i):
-                                break
-                        curr_piece2.y += i - 1
-
-            # holding down the left right keys will still move block
-            if (left1 or right1) and (time.time() - sideway_time1 > SIDEWAY_FREQ):
-                if left1 and self.is_free(curr_piece1, self.board1, x_adj = -1):
-                    curr_piece1.x -= 1
-                elif right1 and self.is_free(curr_piece1, self.board1, x_adj = 1):
-                    curr_piece1.x += 1
-                sideway_time1 = time.time()
-
-            if (left2 or right2) and (time.time() - sideway_time2 > SIDEWAY_FREQ):
-                if left2 and self.is_free(curr_piece2, self.board2, x_adj = -1):
-                    curr_piece2.x -= 1
-                elif right2 and self.is_free(curr_piece2,self.board2, x_adj = 1):
-                    curr_piece2.x += 1
-                sideway_time2 = time.time()
-
-            # hold down down key moves block down
-            if down1 and (time.time() - down_time1 > DOWN_FREQ):
-                if self.is_free(curr_piece1, self.board1, y_adj = 1):
-                    curr_piece1.y += 1
-                down_time1 = time.time()
-
-            if down2 and (time.time() - down_time2 > DOWN_FREQ):
-                if self.is_free(curr_piece2,  self.board2, y_adj = 1):
-                    curr_piece2.y += 1
-                down_time2 = time.time()
-
-            # will fall regardless of input
-            if time.time() - fall_time1 > self.speed[0]:
-                if not self.is_free(curr_piece1, self.board1, y_adj = 1):
-                    # piece landed
-                    self.add(curr_piece1, self.board1) # add to board
-                    added_score = self.delete_full_level(self.board1) 
-                    self.score[0] += added_score
-
-                    # punishes other player
-                    for i in range(0, added_score):
-                        self.add_full_level(self.board2)
-
-                    self.set_difficulty()
-                    curr_piece1 = None
-                else: # piece still falling
-                    curr_piece1.y += 1
-                    fall_time1 = time.time()
-
-            if time.time() - fall_time2 > self.speed[1]:
-                if not self.is_free(curr_piece2, self.board2, y_adj = 1):
-                    # piece landed
-                    self.add(curr_piece2, self.board2) # add to board
-                    added_score = self.delete_full_level(self.board2)
-                    self.score[1] += added_score
-
-                    # punishes other player
-                    for i in range(0, added_score):
-                        self.add_full_level(self.board1)
-                        
-                    self.set_difficulty()
-                    curr_piece2 = None
-                else: # piece still falling
-                    curr_piece2.y += 1
-                    fall_time2 = time.time()
+                    for player, (key_actions, key_releases) in keys:
+                        if event.key in key_actions and player not in bots:
+                            actions[player].append(key_actions[event.key])
+
+            if self.profiler is not None:
+                self.profiler.lap('events')
+
+            # steps every tick that is due, waiting inputs pull the next tick forward
+            # so they show up right away, the engines are never more than a tick ahead
+            last = int((time.perf_counter() - start) * TICK_RATE)
+            if last - match.tick > MAX_CATCH_UP: # stalled, e.g. the window was dragged
+                start += (last - match.tick - MAX_CATCH_UP) / TICK_RATE
+                last = match.tick + MAX_CATCH_UP
+            if waiting:
+                last += 1
+            if client is not None: # waits for the other players once too far ahead of them
+                last = min(last, match.get_horizon())
+            changed = match.tick <= last
+            while match.tick <= last and not match.is_over():
+                tick_actions = [player_actions if match.tick == last else [] for player_actions in actions]
+                for player, bot in bots.items():
+                    tick_actions[player] = bot.get_actions(engines[player])
+                if recorder is not None:
+                    recorder.record(tick_actions)
+                # clearing lines punishes other players
+                match.step(tick_actions)
+            if changed:
+                actions = [[] for engine in engines]
+            if self.feed is not None:
+                self.feed.update(watched.tick)
 
             # draws board state
-            self.display.fill(BACKGROUND)
-            self.draw_board()
-
-            # draws other info
-            self.draw_score()
-            self.draw_next(next_piece1)
-            self.draw_next(next_piece2, P2= True)
-
-            # draws current pience
-            if curr_piece1 is not None:
-               self.draw_piece(curr_piece1)
-            if curr_piece2 is not None:
-               self.draw_piece(curr_piece2, P2 = True)
-
-            pygame.display.update()
-            self.clock.tick(FPS)
-
-        if game_over1:
-            return 1
-        else:
-            return 2
+            if self.profiler is not None:
+                self.profiler.lap('simulate')
+
+            if changed or rolled_back or self.renderer.full or self.smooth:
+                self.renderer.render(engines)
+                if self.profiler is not None:
+                    self.profiler.lap('render')
+                    self.profiler.end_frame()
+                    self.profiler.draw_overlay(self.display, TEXT_COLOR, BACKGROUND, PROFILE_AREA)
+
+        if recorder is not None:
+            recorder.close()
+        if client is not None:
+            match.close()
+        return match.get_winner()
         
 if __name__ == "__main__":
-    game = Tetris()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', metavar = 'DIR', help = 'saves a replay of every game in DIR')
+    parser.add_argument('--smooth', action = 'store_true', help = 'draws pieces falling between levels')
+    parser.add_argument('--profile', metavar = 'FILE', help = 'shows frame timings, saves them to a .csv or .json FILE')
+    parser.add_argument('--cpu', action = 'store_true', help = 'the computer plays player 2')
+    parser.add_argument('--players', type = int, default = 2, choices = range(2, MAX_PLAYERS + 1),
+                        metavar = 'N', help = 'players in the match, the computer plays all past 2 (up to %d)' % MAX_PLAYERS)
+    parser.add_argument('--attack', choices = list(ATTACKS), default = 'all',
+                        help = 'who the lines a player clears go to: all the others or the next one')
+    parser.add_argument('--columns', type = int, help = 'boards side by side with more than 2 players')
+    parser.add_argument('--connect', metavar = 'HOST[:PORT]', help = 'plays a match on a netplay.py server')
+    parser.add_argument('--latency', type = float, default = 0, help = 'delays what is sent to the server by ms')
+    parser.add_argument('--jitter', type = float, default = 0, help = 'the delay varies by up to this many ms')
+    parser.add_argument('--broadcast', type = int, metavar = 'PORT', help = 'streams every match to spectate.py on PORT')
+    args = parser.parse_args()
+    connect = None
+    if args.connect is not None:
+        host, colon, port = args.connect.partition(':')
+        connect = host, int(port or PORT)
+
+    game = Tetris(record = args.record, smooth = args.smooth, profile = args.profile, cpu = args.cpu,
+                  players = args.players, attack = args.attack, columns = args.columns, connect = connect,
+                  latency = args.latency / 1000, jitter = args.jitter / 1000, broadcast = args.broadcast)
     game.run()
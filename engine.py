@@ -0,0 +1,510 @@
+# Headless Tetris engine, holds all the game rules and needs no pygame
+# (c) 2018 Tingda Wang
+
+import random, struct
+from rules import (BOARD_W, BOARD_H, NIL, SIDEWAY_FREQ, DOWN_FREQ, ACCELERATION, NUM_COLORS,
+                   PIECES, MASKS, SHAPES, RANDOM, MASK_64, PieceGenerator, Piece, mix)
+from board import BACKENDS
+from placements import get_placements
+
+# logical ticks per second, the game only ever moves forward in ticks
+# fixed whatever the frame rate, so timing doesn't depend on how fast frames are drawn
+TICK_RATE = 240
+# most ticks a game catches up on in one go, after a stall the clock skips the rest like a pause
+MAX_CATCH_UP = TICK_RATE // 4
+
+# actions understood by Engine.step()
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+DOWN = 3
+ROTATE = 4 # clockwise
+ROTATE_BACK = 5 # counter-clockwise
+DROP = 6 # sends piece to bottom
+RELEASE_LEFT = 7
+RELEASE_RIGHT = 8
+RELEASE_DOWN = 9
+
+# kinds of Engine.journal records, each a tuple starting with its kind:
+ADDED = 0 # (ADDED, shape, rotation, x, y, color) of a piece added to the board
+DELETED = 1 # (DELETED, rows) deleted, top to bottom
+PUSHED = 2 # (PUSHED, row) pushed in at the bottom
+REPLACED = 3 # (REPLACED,) the whole board, by reset() or restore()
+
+# garbage rows are random numbers from their own counter
+GARBAGE_SALT = 0x2545F4914F6CDD1D
+
+# saved engine state: tick, score, pieces, down, sideway and fall times, flags,
+# garbage counter, piece generator index, then the current piece shape, rotation, color, x and y
+STATE = struct.Struct('<6iBQQBBBbb')
+# flags
+MOVING_DOWN, MOVING_LEFT, MOVING_RIGHT, GAME_OVER, HAS_PIECE = 1, 2, 4, 8, 16
+
+def to_ticks(seconds, tick_rate = TICK_RATE):
+    ''' converts a duration in seconds to a whole number of ticks'''
+    return int(seconds * tick_rate)
+
+class Engine:
+    '''
+    a single game of Tetris without any window
+    the game is advanced one tick at a time with step(), renderers read its state
+    '''
+
+    def __init__(self, seed = None, backend = 'list', mode = RANDOM, preview = 1, tick_rate = TICK_RATE):
+        '''
+        starts a new game, the seed decides the pieces and garbage rows
+        backend picks how the board is stored, see board.BACKENDS
+        mode and preview set up the PieceGenerator, preview being how many upcoming pieces are kept
+        tick_rate is the number of ticks in a second of the game
+        '''
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed & MASK_64
+        self.mode = mode
+        self.preview_size = preview
+        self.backend = BACKENDS[backend]
+        self.tick_rate = tick_rate
+        self.sideway_freq = to_ticks(SIDEWAY_FREQ, tick_rate)
+        self.down_freq = to_ticks(DOWN_FREQ, tick_rate)
+        self.journal = None # a list the board changes are appended to while set, see spectate.py
+        self.reset()
+
+    def reset(self):
+        ''' resets the board, score, timers and pieces for a new game'''
+        self.garbage = 0 # random numbers drawn for garbage rows
+        self.generator = PieceGenerator(self.seed, self.mode, self.preview_size)
+        self.board = self.backend()
+        self.tick = 0
+
+        # difficulty variables
+        self.score = 0
+        self.difficulty = self.speed = 0
+        self.set_difficulty() # sets these values
+        self.pieces = 0 # pieces locked onto the board
+
+        # ticks of the last move in each direction
+        self.down_time = 0
+        self.sideway_time = 0
+        self.fall_time = 0
+
+        # direction moving in
+        self.down = False
+        self.left = False
+        self.right = False
+
+        self.game_over = False
+        self.cleared_rows = [] # levels deleted during the last tick
+        self.board_changes = 0 # counts every change to the board, see ghost()
+        self.ghost_key = self.ghost_y = None
+        if self.journal is not None:
+            self.journal.append((REPLACED,))
+
+        # get current and upcoming pieces
+        self.curr_piece = self.generator.next()
+        self.next_piece = self.generator.peek()
+
+    def snapshot(self):
+        ''' saves the state of the game as bytes, see restore()'''
+        flags = (self.down * MOVING_DOWN | self.left * MOVING_LEFT | self.right * MOVING_RIGHT
+                 | self.game_over * GAME_OVER)
+        piece = self.curr_piece
+        if piece is None:
+            shape = rotation = color = x = y = 0
+        else:
+            flags |= HAS_PIECE
+            shape, rotation, color, x, y = SHAPES.index(piece.shape), piece.rotation, piece.color, piece.x, piece.y
+        return STATE.pack(self.tick, self.score, self.pieces, self.down_time, self.sideway_time,
+                          self.fall_time, flags, self.garbage, self.generator.index,
+                          shape, rotation, color, x, y) + self.board.dump()
+
+    def restore(self, state):
+        ''' puts the game back to a snapshot() of a game with the same seed and mode'''
+        (self.tick, self.score, self.pieces, self.down_time, self.sideway_time, self.fall_time, flags,
+         self.garbage, index, shape, rotation, color, x, y) = STATE.unpack_from(state)
+        self.down = bool(flags & MOVING_DOWN)
+        self.left = bool(flags & MOVING_LEFT)
+        self.right = bool(flags & MOVING_RIGHT)
+        self.game_over = bool(flags & GAME_OVER)
+        self.set_difficulty()
+        self.cleared_rows = []
+
+        self.curr_piece = None
+        if flags & HAS_PIECE:
+            self.curr_piece = Piece()
+            self.curr_piece.shape, self.curr_piece.rotation, self.curr_piece.color = SHAPES[shape], rotation, color
+            self.curr_piece.x, self.curr_piece.y = x, y
+        self.generator.seek(index)
+        self.next_piece = self.generator.peek()
+
+        self.board = self.backend()
+        self.board.load(state[STATE.size:])
+        self.board_changes += 1
+        if self.journal is not None:
+            self.journal.append((REPLACED,))
+
+    def set_difficulty(self):
+        ''' sets the difficulty and speed variables '''
+        self.difficulty = int(self.score /ACCELERATION) + 1
+        self.speed = 0.27 - (self.difficulty * 0.02)
+        self.fall_freq = to_ticks(self.speed, self.tick_rate)
+
+    def preview(self, n):
+        ''' the next n pieces to drop, next_piece first'''
+        return [self.generator.peek(i) for i in range(n)]
+
+    def is_free(self, piece, x_adj = 0, y_adj = 0):
+        '''
+        determines if the piece occupies all free space
+        supports optional adjustments x_adj and y_adj
+        '''
+        return self.board.fits(MASKS[piece.shape][piece.rotation], piece.x + x_adj, piece.y + y_adj)
+
+    def add(self, piece):
+        ''' fills in a piece onto board, squares still above the board are lost'''
+        self.board.add(MASKS[piece.shape][piece.rotation], piece.x, piece.y, piece.color)
+        self.board_changes += 1
+        if self.journal is not None:
+            self.journal.append((ADDED, piece.shape, piece.rotation, piece.x, piece.y, piece.color))
+
+    def delete_full_level(self, piece = None):
+        '''
+        deletes full levels and moves everything down
+        given the piece that just landed, only the levels it covers are checked
+        returns the indices of the deleted levels, top to bottom
+        '''
+        rows = None
+        if piece is not None:
+            mask = MASKS[piece.shape][piece.rotation]
+            rows = range(max(piece.y + mask.top, 0), piece.y + mask.bottom + 1)
+        full = self.board.delete_full_level(rows)
+        if full:
+            self.board_changes += 1
+            if self.journal is not None:
+                self.journal.append((DELETED, full))
+        return full
+
+    def add_full_level(self):
+        ''' adds a random, not entirely filled level beneath and moves everything up'''
+        full_bottom_row = True
+        while full_bottom_row:
+            row = []
+            for x in range(BOARD_W):
+                bits = mix(self.seed ^ GARBAGE_SALT, self.garbage)
+                self.garbage += 1
+                # half the squares are empty
+                row.append(NIL if bits & 1 else (bits >> 1) % NUM_COLORS)
+            full_bottom_row = NIL not in row
+        self.board.add_full_level(row)
+        self.board_changes += 1
+        if self.journal is not None:
+            self.journal.append((PUSHED, row))
+
+    def drop_distance(self, piece):
+        '''
+        how many squares the piece can fall before landing
+        while the piece is above every column it covers, the column heights and its bottom
+        profile give the answer straight away, otherwise it is moved down a level at a time
+        '''
+        heights = self.board.heights
+        mask = MASKS[piece.shape][piece.rotation]
+        distance = BOARD_H - (piece.y + mask.bottom) - 1 # down to the floor
+        for dx, dy in mask.bottoms:
+            x = piece.x + dx
+            if x < 0 or x >= BOARD_W:
+                break # off the side above the board
+            below = BOARD_H - heights[x] - (piece.y + dy) - 1 # free levels beneath the square
+            if below < 0:
+                break # tucked under an overhang
+            distance = min(distance, below)
+        else:
+            return distance
+
+        i = 0
+        while self.is_free(piece, y_adj = i + 1):
+            i += 1
+        return i
+
+    def ghost(self):
+        '''
+        the row the current piece would land on if dropped, None without a piece
+        only worked out again once the piece moves or rotates or the board changes
+        '''
+        piece = self.curr_piece
+        if piece is None:
+            return None
+        key = (piece.shape, piece.rotation, piece.x, piece.y, self.board_changes)
+        if key != self.ghost_key:
+            self.ghost_key = key
+            self.ghost_y = piece.y + self.drop_distance(piece)
+        return self.ghost_y
+
+    def move(self, x_adj):
+        ''' moves the current piece sideways if there is space'''
+        if self.is_free(self.curr_piece, x_adj = x_adj):
+            self.curr_piece.x += x_adj
+
+    def rotate(self, direction):
+        ''' rotates the current piece, move to next element in group'''
+        piece = self.curr_piece
+        temp = piece.rotation
+        piece.rotation = (piece.rotation + direction) % len(PIECES[piece.shape])
+        if not self.is_free(piece):
+            piece.rotation = temp
+
+    def act(self, action):
+        ''' applies a single player action to the current piece'''
+        # stops going in that direction
+        if action == RELEASE_LEFT:
+            self.left = False
+        elif action == RELEASE_RIGHT:
+            self.right = False
+        elif action == RELEASE_DOWN:
+            self.down = False
+        elif self.curr_piece is None:
+            return
+        # change direction (left and right)
+        elif action == LEFT:
+            self.move(-1)
+            self.left = True
+            self.right = False
+            self.sideway_time = self.tick
+        elif action == RIGHT:
+            self.move(1)
+            self.right = True
+            self.left = False
+            self.sideway_time = self.tick
+        elif action == DOWN:
+            self.down = True
+            if self.is_free(self.curr_piece, y_adj = 1):
+                self.curr_piece.y += 1
+            self.down_time = self.tick
+        elif action == ROTATE:
+            self.rotate(1)
+        elif action == ROTATE_BACK:
+            self.rotate(-1)
+        # sends piece to bottom
+        elif action == DROP:
+            self.down = self.left = self.right = False
+            self.curr_piece.y += self.drop_distance(self.curr_piece)
+
+    def spawn(self):
+        ''' brings in the next piece, the game is over if there is no room for it'''
+        self.curr_piece = self.generator.next()
+        self.next_piece = self.generator.peek()
+        self.fall_time = self.tick
+        if not self.is_free(self.curr_piece):
+            self.game_over = True
+
+    def lock(self, piece):
+        ''' piece landed, adds it to the board and scores any full levels'''
+        self.add(piece) # add to board
+        self.pieces += 1
+        self.cleared_rows = self.delete_full_level(piece)
+        self.score += len(self.cleared_rows)
+        self.set_difficulty()
+        self.curr_piece = None
+
+    def placements(self):
+        ''' every distinct placement the current piece can reach, see placements.get_placements()'''
+        piece = self.curr_piece
+        if piece is None or self.game_over:
+            return []
+        return get_placements(self.board, piece.shape, piece.rotation, piece.x, piece.y, piece.color)
+
+    def place(self, rotation, x, y = None):
+        '''
+        drops the current piece straight down with the given rotation and column and locks it,
+        for bots that choose a final placement instead of stepping through ticks
+        given y, the piece is locked on that level instead, e.g. a placement from placements()
+        tucked under an overhang, and it has to be resting on something
+        a placement off the sides of the board or blocked where the piece is ends the game
+        returns the number of lines cleared
+        '''
+        self.cleared_rows = []
+        if self.game_over:
+            return 0
+        if self.curr_piece is None:
+            self.spawn()
+            if self.game_over:
+                return 0
+
+        piece = self.curr_piece
+        piece.rotation = rotation % len(PIECES[piece.shape])
+        piece.x = x
+        if y is not None:
+            piece.y = y
+        mask = MASKS[piece.shape][piece.rotation]
+        if x + mask.left < 0 or x + mask.right >= BOARD_W or not self.is_free(piece):
+            self.game_over = True
+            return 0
+
+        if y is None:
+            piece.y += self.drop_distance(piece)
+        elif self.is_free(piece, y_adj = 1):
+            self.game_over = True
+            return 0
+        self.lock(piece)
+        self.spawn()
+        return len(self.cleared_rows)
+
+    def deadline(self):
+        '''
+        the earliest tick on which stepping without any actions can change the game,
+        ticks before it only count up, so callers can sleep until then
+        '''
+        if self.game_over or self.curr_piece is None or not self.is_free(self.curr_piece):
+            return self.tick
+        deadline = self.fall_time + self.fall_freq + 1
+        if self.left or self.right:
+            deadline = min(deadline, self.sideway_time + self.sideway_freq + 1)
+        if self.down:
+            deadline = min(deadline, self.down_time + self.down_freq + 1)
+        return max(deadline, self.tick)
+
+    def fall_progress(self):
+        '''
+        how far the current piece is towards falling a level, from 0 right after it fell
+        to just under 1 on the tick before it falls again, for drawing it between levels
+        0 when it is resting on something
+        '''
+        piece = self.curr_piece
+        if piece is None or self.game_over or self.fall_freq < 1 or not self.is_free(piece, y_adj = 1):
+            return 0
+        return min(max((self.tick - self.fall_time - 1) / (self.fall_freq + 1), 0), 1)
+
+    def step(self, *actions):
+        '''
+        applies the given actions and advances the game by one tick
+        returns the number of lines cleared during the tick
+        '''
+        self.cleared_rows = []
+        if self.game_over:
+            return 0
+
+        if self.curr_piece is None:
+            self.spawn()
+        elif not self.is_free(self.curr_piece):
+            # pushed into by garbage
+            self.game_over = True
+        if self.game_over:
+            return 0
+
+        for action in actions:
+            self.act(action)
+
+        piece = self.curr_piece
+
+        # holding down the left right keys will still move block
+        if (self.left or self.right) and (self.tick - self.sideway_time > self.sideway_freq):
+            if self.left:
+                self.move(-1)
+            elif self.right:
+                self.move(1)
+            self.sideway_time = self.tick
+
+        # hold down down key moves block down
+        if self.down and (self.tick - self.down_time > self.down_freq):
+            if self.is_free(piece, y_adj = 1):
+                piece.y += 1
+            self.down_time = self.tick
+
+        # will fall regardless of input
+        if self.tick - self.fall_time > self.fall_freq:
+            if not self.is_free(piece, y_adj = 1):
+                self.lock(piece)
+            else: # piece still falling
+                piece.y += 1
+                self.fall_time = self.tick
+
+        self.tick += 1
+        return len(self.cleared_rows)
+
+def attack_all(match, player):
+    ''' every other player still in, like the 2 player game'''
+    return [other for other in match.playing if other != player]
+
+def attack_next(match, player):
+    ''' the next player still in after the attacker, going round in player order'''
+    for i in range(1, len(match.engines)):
+        other = (player + i) % len(match.engines)
+        if other in match.playing:
+            return [other]
+    return []
+
+# how the lines a player clears are sent on as garbage, by name
+# a function takes the match and the player clearing lines and returns the players hit
+ATTACKS = {'all': attack_all, 'next': attack_next}
+
+class Match:
+    '''
+    any number of engines played against each other, stepped together one tick at a time
+    every level a player clears pushes a garbage level under the boards of the players
+    its attack routing picks, a player is out once its game is over and the match is
+    over once at most one is left, or with a single player once that one is out
+    '''
+
+    def __init__(self, engines, attack = 'all'):
+        '''
+        engines are the players in order, all on the same tick
+        attack is the name of the routing in ATTACKS
+        '''
+        self.engines = engines
+        self.attack = attack
+        self.route = ATTACKS[attack]
+        self.tick = max(engine.tick for engine in engines)
+        self.playing = [player for player, engine in enumerate(engines) if not engine.game_over] # in order
+
+    def is_over(self):
+        ''' whether the match has been decided'''
+        return len(self.playing) < min(len(self.engines), 2)
+
+    def get_winner(self):
+        ''' the player left once the match is over, None if there is none (yet)'''
+        if self.is_over() and self.playing:
+            return self.playing[0]
+        return None
+
+    def deadline(self):
+        ''' the earliest tick on which stepping without any actions can change the match'''
+        return min((self.engines[player].deadline() for player in self.playing), default = self.tick)
+
+    def step(self, actions):
+        '''
+        steps every player still in by one tick, actions lists each player's actions
+        players going out during the tick are only taken out of the routing after it,
+        so garbage sent on the same tick still lands on their boards
+        returns the number of levels each player cleared
+        '''
+        cleared = [0] * len(self.engines)
+        engines = self.engines
+        for player in self.playing:
+            lines = cleared[player] = engines[player].step(*actions[player])
+            if lines:
+                self.attack_with(player, lines)
+        self.playing = [player for player in self.playing if not engines[player].game_over]
+        self.tick += 1
+        return cleared
+
+    def place(self, placements):
+        '''
+        places the current piece of every player still in, placements lists each player's
+        (rotation, x) or (rotation, x, y) as Engine.place() takes them, for bots that play
+        a piece at a time instead of a tick at a time
+        garbage is only sent once every piece is placed, so it lands under the next ones
+        returns the number of levels each player cleared
+        '''
+        cleared = [0] * len(self.engines)
+        engines = self.engines
+        for player in self.playing:
+            cleared[player] = engines[player].place(*placements[player])
+        for player in self.playing:
+            if cleared[player]:
+                self.attack_with(player, cleared[player])
+        self.playing = [player for player in self.playing if not engines[player].game_over]
+        return cleared
+
+    def attack_with(self, player, lines):
+        ''' pushes a garbage level for each of the lines player cleared under the boards its attack hits'''
+        for other in self.route(self, player):
+            for i in range(lines):
+                self.engines[other].add_full_level()
@@ -0,0 +1,157 @@
+# Opt-in timings and counters for every frame of the game loops
+# (c) 2018 Tingda Wang
+#
+# usage: python3 Tetris.py --profile frames.csv (or frames.json)
+
+import time, json, csv, functools
+from collections import defaultdict
+
+import pygame
+
+from board import ListBoard, BitBoard
+from engine import Engine
+from render import TEXT_CACHE, Renderer
+
+# frames the overlay averages over
+OVERLAY_FRAMES = 30
+# pygame's default font, small enough to fit beside the board
+OVERLAY_FONT_SIZE = 16
+
+class Profiler:
+    '''
+    collects how long each phase of a frame took and how often instrumented methods ran
+    the game loop calls lap() after each phase and end_frame() once a frame is drawn,
+    methods wrapped with instrument() add their time and calls to the frame they ran in
+    '''
+
+    def __init__(self, text_cache = TEXT_CACHE):
+        ''' starts with no frames and nothing instrumented, overlay text is rendered through text_cache'''
+        self.frames = [] # timings in ms and counts of each frame, by name
+        self.current = defaultdict(float)
+        self.last = time.perf_counter()
+        self.patched = [] # (owner, name, original) of everything instrumented
+        self.font = None
+        self.text_cache = text_cache
+        self.text_counts = (text_cache.hits, text_cache.misses) # when the frame started
+
+    def lap(self, phase):
+        ''' adds the time since the last lap to phase'''
+        now = time.perf_counter()
+        self.current[phase + ' ms'] += (now - self.last) * 1000
+        self.last = now
+
+    def end_frame(self):
+        ''' the frame is drawn, later laps and calls count towards the next one'''
+        hits, misses = self.text_cache.hits, self.text_cache.misses
+        self.current['text cache hits'] += hits - self.text_counts[0]
+        self.current['text cache misses'] += misses - self.text_counts[1]
+        self.text_counts = (hits, misses)
+        self.frames.append(self.current)
+        self.current = defaultdict(float)
+
+    def instrument(self, owner, name, label = None, timed = True):
+        '''
+        wraps the method or function owner.name so each call is counted under label,
+        and timed as well unless timed is False, until restore() is called
+        '''
+        original = getattr(owner, name)
+        label = name if label is None else label
+        calls, ms = label + ' calls', label + ' ms'
+
+        if timed:
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.current[ms] += (time.perf_counter() - start) * 1000
+                    self.current[calls] += 1
+        else:
+            def wrapper(*args, **kwargs):
+                self.current[label] += 1
+                return original(*args, **kwargs)
+
+        setattr(owner, name, functools.wraps(original)(wrapper))
+        self.patched.append((owner, name, original))
+
+    def restore(self):
+        ''' puts back everything instrument() wrapped'''
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            setattr(owner, name, original)
+
+    def get_columns(self):
+        ''' names of everything recorded, in the order they first came up'''
+        columns = {}
+        for frame in self.frames:
+            columns.update(dict.fromkeys(frame))
+        return list(columns)
+
+    def get_summary(self):
+        ''' mean, median, 95th percentile and max of every column over all frames'''
+        summary = {}
+        for column in self.get_columns():
+            values = sorted(frame.get(column, 0) for frame in self.frames)
+            summary[column] = {'mean': sum(values) / len(values), 'p50': values[len(values) // 2],
+                               'p95': values[int(len(values) * 0.95)], 'max': values[-1]}
+        return summary
+
+    def save(self, path):
+        ''' writes every frame to path, as JSON with a summary if it ends in .json, as CSV otherwise'''
+        columns = self.get_columns()
+        with open(path, 'w', newline = '') as f:
+            if path.endswith('.json'):
+                json.dump({'summary': self.get_summary() if self.frames else {},
+                           'frames': [dict(frame) for frame in self.frames]}, f, indent = 1)
+            else:
+                writer = csv.DictWriter(f, ['frame'] + columns, restval = 0)
+                writer.writeheader()
+                for i, frame in enumerate(self.frames):
+                    writer.writerow(dict(frame, frame = i))
+
+    def get_overlay_lines(self):
+        ''' averages of the last frames, one line per phase, instrumented method or counter'''
+        recent = self.frames[-OVERLAY_FRAMES:]
+        averages = {}
+        for frame in recent:
+            averages.update(dict.fromkeys(frame))
+        for column in averages:
+            averages[column] = sum(frame.get(column, 0) for frame in recent) / len(recent)
+
+        lines = []
+        for column, value in averages.items():
+            if column.endswith(' ms'):
+                name = column[:-len(' ms')]
+                if name + ' calls' in averages:
+                    lines.append('%s %.2f ms x %.0f' % (name, value, averages[name + ' calls']))
+                else:
+                    lines.append('%s %.2f ms' % (name, value))
+            elif not column.endswith(' calls'):
+                lines.append('%s %.0f' % (column, value))
+        return lines
+
+    def draw_overlay(self, display, color, background, area):
+        ''' draws the overlay clipped to the area rect of the display and pushes it to the screen'''
+        if self.font is None:
+            self.font = pygame.font.Font(None, OVERLAY_FONT_SIZE)
+        display.set_clip(area)
+        display.fill(background, area)
+        y = area.top
+        for line in self.get_overlay_lines():
+            surf = self.text_cache.render(self.font, line, color)
+            display.blit(surf, (area.left, y))
+            y += surf.get_height()
+        display.set_clip(None)
+        pygame.display.update(area)
+        self.lap('overlay')
+
+def instrument_game(profiler):
+    ''' instruments the engine and renderer methods a frame of the games spends its time in'''
+    # every collision check goes through a board's fits(), whoever makes it
+    for backend in (ListBoard, BitBoard):
+        profiler.instrument(backend, 'fits')
+    profiler.instrument(Engine, 'delete_full_level')
+    for name in ('draw_board', 'draw_piece', 'draw_text'):
+        profiler.instrument(Renderer, name)
+    profiler.instrument(Renderer, 'get_square', 'squares drawn', timed = False)
+    profiler.instrument(pygame.display, 'update', 'display.update')
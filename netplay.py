@@ -0,0 +1,476 @@
+# Playing matches across machines, a relay server and lockstep clients with rollback
+# (c) 2018 Tingda Wang
+#
+# usage: python3 netplay.py server --port 7777
+#        python3 ctetris.py --connect localhost:7777
+#        python3 netplay.py loopback --latency 80 --jitter 20 > netplay.jsonl
+#
+# Every player runs the whole match, so the only thing sent is each player's actions
+# and the tick they are made on. The server deals out the seeds, which decide every
+# piece and garbage row, and relays the actions to the other players. Garbage follows
+# from the lines cleared, so it never has to be sent. Each message is a 2 byte length,
+# then a kind:
+#   start   player, players, piece generator mode, attack routing, ticks per second,
+#           then every player's seed
+#   input   player, tick, then the actions made on that tick, none for a heartbeat;
+#           every earlier tick without a message had no actions
+#   leave   player, who makes no more moves
+
+import sys, time, json, queue, random, struct, asyncio, argparse, threading
+
+from rules import RANDOM
+from engine import TICK_RATE, Engine, Match
+from replay import MODES, ATTACK_MODES
+from ai import Bot, think_all
+
+PORT = 7777
+
+# message framing
+LENGTH = struct.Struct('<H')
+START, INPUT, LEAVE = range(3)
+START_HEADER = struct.Struct('<BBBBBH')
+SEED = struct.Struct('<Q')
+INPUT_HEADER = struct.Struct('<BBI')
+LEAVE_HEADER = struct.Struct('<BB')
+
+# ticks a client plays without sending anything before it says it made no moves
+HEARTBEAT_TICKS = 8
+# ticks the game can get ahead of the moves heard from the other players before it waits
+MAX_PREDICTION = TICK_RATE // 2
+# known tick of players that left, all of their moves are known
+FOREVER = 1 << 32
+
+class Link:
+    '''
+    one end of a connection, sending and receiving whole messages and counting their bytes
+    latency and jitter hold back everything sent by latency seconds, give or take up to
+    jitter, in order, to try out a slow network on one machine
+    '''
+
+    def __init__(self, reader, writer, latency = 0, jitter = 0):
+        ''' wraps an asyncio stream pair, must be made on the loop it is used on'''
+        self.reader = reader
+        self.writer = writer
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random()
+        self.sent = self.received = 0 # bytes
+        self.outbox = None
+        if latency or jitter:
+            self.outbox = asyncio.Queue()
+            self.sender = asyncio.ensure_future(self.send_later())
+
+    def send(self, payload):
+        ''' sends a message'''
+        frame = LENGTH.pack(len(payload)) + payload
+        self.sent += len(frame)
+        if self.outbox is None:
+            self.writer.write(frame)
+        else:
+            delay = max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+            self.outbox.put_nowait((time.perf_counter() + delay, frame))
+
+    async def send_later(self):
+        ''' writes out held back messages once they are due, never overtaking each other'''
+        while True:
+            due, frame = await self.outbox.get()
+            await asyncio.sleep(due - time.perf_counter())
+            self.writer.write(frame)
+            self.outbox.task_done()
+
+    async def recv(self):
+        ''' the next message, or None once the connection is closed'''
+        try:
+            header = await self.reader.readexactly(LENGTH.size)
+            payload = await self.reader.readexactly(LENGTH.unpack(header)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        self.received += len(header) + len(payload)
+        return payload
+
+    async def close(self):
+        ''' closes the connection once everything held back has been sent'''
+        if self.outbox is not None:
+            await self.outbox.join()
+            self.sender.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+class Room:
+    ''' the players of a match on the server'''
+
+    def __init__(self, number, links):
+        ''' links are the players' connections in player order'''
+        self.number = number
+        self.links = links
+        self.connected = list(links) # None once the player has left
+        self.ticks = 0 # the furthest tick anyone played
+        self.start = time.perf_counter()
+
+    def relay(self, player, payload):
+        ''' sends a message from player to everyone else still connected'''
+        for other, link in enumerate(self.connected):
+            if other != player and link is not None:
+                link.send(payload)
+
+    def get_result(self):
+        ''' how long the match went and how much was sent, once everyone has left'''
+        seconds = time.perf_counter() - self.start
+        total = sum(link.sent + link.received for link in self.links)
+        return {'match': self.number, 'players': len(self.links), 'ticks': self.ticks,
+                'seconds': round(seconds, 3), 'bytes': total, 'bytes_per_second': round(total / seconds, 1)}
+
+class Server:
+    '''
+    starts a match whenever enough players have connected, deals out the seeds and
+    relays every player's actions to the others, without running the games itself
+    writes a JSON line for every match once all of its players have left
+    '''
+
+    def __init__(self, players = 2, attack = 'all', mode = RANDOM, out = sys.stdout):
+        ''' players in a match, the attack routing and piece generator mode of their games'''
+        self.players = players
+        self.attack = attack
+        self.mode = mode
+        self.out = out
+        self.lobby = [] # (link, future set to (room, player) once the match starts)
+        self.rooms = 0
+
+    async def serve(self, host = '', port = PORT):
+        ''' starts listening, returns the asyncio server'''
+        return await asyncio.start_server(self.handle, host, port)
+
+    def start_room(self):
+        ''' starts a match between everyone in the lobby'''
+        lobby, self.lobby = self.lobby, []
+        self.rooms += 1
+        room = Room(self.rooms, [link for link, started in lobby])
+        seeds = b''.join(SEED.pack(random.getrandbits(64)) for link in room.links)
+        for player, (link, started) in enumerate(lobby):
+            link.send(START_HEADER.pack(START, player, self.players, MODES.index(self.mode),
+                                        ATTACK_MODES.index(self.attack), TICK_RATE) + seeds)
+            started.set_result((room, player))
+
+    async def handle(self, reader, writer):
+        ''' serves one player from connecting until they leave'''
+        link = Link(reader, writer)
+        started = asyncio.get_running_loop().create_future()
+        self.lobby.append((link, started))
+        # reads on while waiting, so a player leaving the lobby isn't dealt into a match
+        received = asyncio.ensure_future(link.recv())
+        if len(self.lobby) == self.players:
+            self.start_room()
+        await asyncio.wait([received, started], return_when = asyncio.FIRST_COMPLETED)
+        if not started.done(): # gone, players send nothing before the match starts
+            self.lobby.remove((link, started))
+            await link.close()
+            return
+        room, player = started.result()
+
+        while True:
+            payload = await received
+            if payload is None:
+                break
+            if payload[0] == INPUT and payload[1] == player:
+                room.ticks = max(room.ticks, INPUT_HEADER.unpack_from(payload)[2] + 1)
+                room.relay(player, payload)
+            received = link.recv()
+
+        # every action was sent as it was made, so the rest of the player's ticks had none
+        room.connected[player] = None
+        room.relay(player, LEAVE_HEADER.pack(LEAVE, player))
+        await link.close()
+        if not any(room.connected):
+            self.out.write(json.dumps(room.get_result()) + '\n')
+            self.out.flush()
+
+class Client:
+    '''
+    a connection to a Server for a game loop that doesn't run asyncio, the connection
+    runs its own loop on a thread, and the messages after start come in through inbox
+    '''
+
+    def __init__(self, host, port = PORT, latency = 0, jitter = 0):
+        ''' connects to the server, latency and jitter hold back what is sent, see Link'''
+        self.inbox = queue.Queue()
+        self.started = threading.Event()
+        self.error = None
+        self.link = None
+        # filled in by the start message
+        self.player = self.players = self.mode = self.attack = self.tick_rate = None
+        self.seeds = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target = self.loop.run_until_complete,
+                                       args = (self.run(host, port, latency, jitter),), daemon = True)
+        self.thread.start()
+
+    async def run(self, host, port, latency, jitter):
+        ''' the connection's thread, reads messages until the connection is closed'''
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as error:
+            self.error = error
+            self.started.set()
+            return
+        self.link = Link(reader, writer, latency, jitter)
+        while True:
+            payload = await self.link.recv()
+            if payload is None:
+                break
+            if payload[0] == START:
+                (kind, self.player, self.players, mode, attack,
+                 self.tick_rate) = START_HEADER.unpack_from(payload)
+                self.mode, self.attack = MODES[mode], ATTACK_MODES[attack]
+                self.seeds = [SEED.unpack_from(payload, START_HEADER.size + i * SEED.size)[0]
+                              for i in range(self.players)]
+                self.started.set()
+            else:
+                self.inbox.put(payload)
+        if not self.started.is_set():
+            self.error = ConnectionError('the server closed the connection before the match started')
+            self.started.set()
+
+    def wait_start(self, timeout = None):
+        ''' waits up to timeout seconds for the match to start, returns whether it has'''
+        if not self.started.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def send(self, payload):
+        ''' sends a message from any thread'''
+        self.loop.call_soon_threadsafe(self.link.send, payload)
+
+    def close(self):
+        ''' leaves the match once everything sent has gone out'''
+        if self.link is not None and self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self.link.close(), self.loop).result()
+        self.thread.join()
+
+class Lockstep:
+    '''
+    a Match against players on other machines, which stays the same everywhere by feeding
+    every engine the same actions on the same ticks
+    the local player's actions are played straight away, and the other players are taken
+    to make no moves until theirs come in; when one comes in for a tick already played,
+    the engines roll back to the confirmed match, played up to the tick every player's
+    actions are known to, and play the ticks since again
+    has the tick, engines, playing, step(), deadline(), is_over() and get_winner() of a Match,
+    the engines being the predicted ones to draw
+    '''
+
+    def __init__(self, client, backend = 'list', get_recorder = None):
+        '''
+        client is connected to a started match, backend is the engines' board backend
+        get_recorder makes a Recorder of the confirmed engines, or returns None
+        '''
+        self.client = client
+        self.player = client.player
+        self.engines = self.get_engines(backend)
+        self.match = Match(self.engines, client.attack)
+        self.confirmed = Match(self.get_engines(backend), client.attack)
+        self.recorder = None if get_recorder is None else get_recorder(self.confirmed.engines)
+        self.tick = self.match.tick
+        self.playing = self.match.playing
+        self.nothing = [[] for engine in self.engines]
+        self.inputs = {} # tick: every player's actions on it, as far as they are known
+        self.known = [0] * len(self.engines) # ticks before this have all of the player's actions in
+        self.sent = 0 # tick of the last message sent
+        self.rollbacks = self.replayed = 0 # times rolled back and ticks played again
+
+    def get_engines(self, backend):
+        ''' new engines for the match'''
+        client = self.client
+        return [Engine(seed, backend, client.mode, tick_rate = client.tick_rate) for seed in client.seeds]
+
+    def get_inputs(self, tick):
+        ''' every player's actions on tick, to fill in'''
+        if tick not in self.inputs:
+            self.inputs[tick] = [[] for engine in self.engines]
+        return self.inputs[tick]
+
+    def poll(self):
+        '''
+        takes in the messages from the other players, rolling back if any had actions
+        for a tick already played, returns whether the engines changed
+        '''
+        rollback = False
+        while True:
+            try:
+                payload = self.client.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if payload[0] == INPUT:
+                kind, player, tick = INPUT_HEADER.unpack_from(payload)
+                actions = payload[INPUT_HEADER.size:]
+                if actions:
+                    self.get_inputs(tick)[player] = list(actions)
+                    rollback = rollback or tick < self.match.tick
+                self.known[player] = tick + 1
+            elif payload[0] == LEAVE:
+                kind, player = LEAVE_HEADER.unpack_from(payload)
+                self.known[player] = FOREVER
+
+        # plays the confirmed match as far as every player's actions are in
+        confirmed = self.confirmed
+        known = min(self.known)
+        while confirmed.tick < known and not confirmed.is_over():
+            actions = self.inputs.pop(confirmed.tick, self.nothing)
+            if self.recorder is not None:
+                self.recorder.record(actions)
+            confirmed.step(actions)
+        if not rollback:
+            return False
+
+        # plays the predicted match again from there
+        tick = self.match.tick
+        for engine, confirmed_engine in zip(self.engines, confirmed.engines):
+            engine.restore(confirmed_engine.snapshot())
+        self.match.tick = confirmed.tick
+        self.match.playing = list(confirmed.playing)
+        self.rollbacks += 1
+        self.replayed += tick - confirmed.tick
+        while self.match.tick < tick:
+            self.match.step(self.inputs.get(self.match.tick, self.nothing))
+        self.playing = self.match.playing
+        return True
+
+    def step(self, actions):
+        '''
+        plays the local player's actions, from the list of every player's, on the next tick
+        and sends them, predicting the other players' where they aren't in yet
+        returns the number of levels each player cleared
+        '''
+        tick = self.match.tick
+        own = actions[self.player]
+        if own:
+            self.get_inputs(tick)[self.player] = list(own)
+        if own or tick - self.sent >= HEARTBEAT_TICKS:
+            self.client.send(INPUT_HEADER.pack(INPUT, self.player, tick) + bytes(own))
+            self.sent = tick
+        self.known[self.player] = tick + 1
+        cleared = self.match.step(self.inputs.get(tick, self.nothing))
+        self.tick = self.match.tick
+        self.playing = self.match.playing
+        return cleared
+
+    def flush(self):
+        ''' sends a heartbeat for the last tick played if it hasn't gone out yet'''
+        if self.match.tick and self.sent != self.match.tick - 1:
+            self.sent = self.match.tick - 1
+            self.client.send(INPUT_HEADER.pack(INPUT, self.player, self.sent))
+
+    def get_horizon(self):
+        ''' the last tick that can be played before the other players' actions catch up'''
+        return min(self.known) + MAX_PREDICTION
+
+    def deadline(self):
+        ''' the earliest tick stepping without any actions can change the predicted match'''
+        return self.match.deadline()
+
+    def is_over(self):
+        ''' whether the confirmed match has been decided'''
+        return self.confirmed.is_over()
+
+    def get_winner(self):
+        ''' the player left once the confirmed match is over, None if there is none (yet)'''
+        return self.confirmed.get_winner()
+
+    def close(self):
+        ''' leaves the match, writing out the replay if recording'''
+        if self.recorder is not None:
+            self.recorder.close()
+        self.client.close()
+
+def play_bot(client, ticks, frame_rate = 60):
+    '''
+    plays a client's player with a Bot in real time until the match is over or ticks have
+    been played, then waits for the other players to catch up
+    returns the Lockstep, which is closed
+    '''
+    client.wait_start()
+    lockstep = Lockstep(client)
+    engine = lockstep.engines[lockstep.player]
+    bot = Bot()
+    start = time.perf_counter()
+    while not lockstep.is_over() and lockstep.confirmed.tick < ticks:
+        lockstep.poll()
+        think_all([(bot, engine)])
+        last = int((time.perf_counter() - start) * client.tick_rate)
+        last = min(last, lockstep.get_horizon(), ticks - 1)
+        while lockstep.tick <= last:
+            actions = list(lockstep.nothing)
+            actions[lockstep.player] = bot.get_actions(engine)
+            lockstep.step(actions)
+        if lockstep.tick >= ticks:
+            lockstep.flush()
+        time.sleep(1 / frame_rate)
+    lockstep.close()
+    return lockstep
+
+def loopback(players, seconds, latency, jitter, attack = 'all', out = sys.stdout):
+    '''
+    plays a match between Bots on this machine through a Server on a free local port,
+    latency and jitter in seconds being added to everything the players send
+    writes the server's JSON line, one for each player and whether they all ended up
+    with the same match, returns that
+    '''
+    server = Server(players, attack, out = out)
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(server.serve('127.0.0.1', 0))
+    port = listener.sockets[0].getsockname()[1]
+    threading.Thread(target = loop.run_forever, daemon = True).start()
+
+    clients = [Client('127.0.0.1', port, latency, jitter) for player in range(players)]
+    results = [None] * players
+    def play(i):
+        results[i] = play_bot(clients[i], int(seconds * TICK_RATE))
+    threads = [threading.Thread(target = play, args = (i,)) for i in range(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    time.sleep(max(latency + jitter, 0) + 0.1) # lets the server see everyone leave
+    loop.call_soon_threadsafe(loop.stop)
+
+    for lockstep in results:
+        link = lockstep.client.link
+        played = lockstep.confirmed.tick / TICK_RATE
+        out.write(json.dumps({'player': lockstep.player, 'ticks': lockstep.confirmed.tick,
+                              'rollbacks': lockstep.rollbacks, 'replayed': lockstep.replayed,
+                              'sent': link.sent, 'received': link.received,
+                              'bytes_per_second': round((link.sent + link.received) / played, 1)}) + '\n')
+    states = {b''.join(engine.snapshot() for engine in lockstep.confirmed.engines) for lockstep in results}
+    same = len(states) == 1
+    out.write(json.dumps({'same': same}) + '\n')
+    return same
+
+def main(argv = None):
+    ''' command line entry point, runs a server or a loopback test'''
+    parser = argparse.ArgumentParser(description = 'Tetris matches across machines')
+    parser.add_argument('command', choices = ['server', 'loopback'],
+                        help = 'relay matches, or play one between bots on this machine')
+    parser.add_argument('--host', default = '', help = 'address the server listens on')
+    parser.add_argument('--port', type = int, default = PORT, help = 'port the server listens on')
+    parser.add_argument('--players', type = int, default = 2, help = 'players in a match')
+    parser.add_argument('--attack', choices = ATTACK_MODES, default = 'all', help = 'who cleared lines go to')
+    parser.add_argument('--seconds', type = float, default = 30, help = 'loopback match length')
+    parser.add_argument('--latency', type = float, default = 0, help = 'loopback delay of each message in ms')
+    parser.add_argument('--jitter', type = float, default = 0, help = 'loopback delay varies by up to this in ms')
+    args = parser.parse_args(argv)
+
+    if args.command == 'loopback':
+        same = loopback(args.players, args.seconds, args.latency / 1000, args.jitter / 1000, args.attack)
+        sys.exit(0 if same else 1)
+    server = Server(args.players, args.attack)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.serve(args.host, args.port))
+    print('listening on port %d' % args.port, file = sys.stderr)
+    loop.run_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# Every final spot a piece can reach on a board, for bots
+# (c) 2018 Tingda Wang
+
+import heapq
+from collections import deque
+
+from rules import BOARD_W, BOARD_H, TEMPLATE_W, SPAWN_X, SPAWN_Y, PIECES, MASKS
+
+class Placement:
+    ''' a spot a piece can be locked in, with the board it leaves behind'''
+
+    def __init__(self, rotation, x, y, board, lines):
+        '''
+        rotation, x and y place the piece like Piece does, board is a copy with the piece
+        added and its full levels deleted, lines the number of levels deleted
+        '''
+        self.rotation = rotation
+        self.x = x
+        self.y = y
+        self.board = board
+        self.lines = lines
+
+    def __repr__(self):
+        ''' where the piece goes and the lines it clears'''
+        return 'Placement(rotation=%d, x=%d, y=%d, lines=%s)' % (self.rotation, self.x, self.y, self.lines)
+
+def lock(board, shape, rotation, x, y, color):
+    ''' the placement of locking a piece at (rotation, x, y), on a copy of board'''
+    mask = MASKS[shape][rotation]
+    board = board.copy()
+    board.add(mask, x, y, color)
+    lines = len(board.delete_full_level(range(max(y + mask.top, 0), y + mask.bottom + 1)))
+    return Placement(rotation, x, y, board, lines)
+
+def get_moves(rotation, x, y, rotations):
+    ''' the states one move away from (rotation, x, y): left, right, down and rotating either way'''
+    return ((rotation, x - 1, y), (rotation, x + 1, y), (rotation, x, y + 1),
+            ((rotation + 1) % rotations, x, y), ((rotation - 1) % rotations, x, y))
+
+def get_surface(board, masks, rotation, x, y):
+    '''
+    every state of a piece with the given masks on the few levels just above the highest
+    column, which a piece starting higher up at (rotation, x, y) can all reach, and which
+    every state further down is reached through
+    returns [] if the piece doesn't start above them, or they stick out above the board
+    '''
+    stack_top = BOARD_H - max(board.heights) # highest level with a square in it, or BOARD_H
+    lowest = [stack_top - 1 - mask.bottom for mask in masks] # last level each rotation is above it
+    top = min(lowest)
+    mask = masks[rotation]
+    if y > top or x + mask.left < 0 or x + mask.right >= BOARD_W:
+        return []
+    if any(top + mask.top < 0 for mask in masks):
+        return [] # squares above the board may stick out the sides
+    return [(rotation, x, y) for rotation, mask in enumerate(masks)
+            for x in range(-mask.left, BOARD_W - mask.right)
+            for y in range(top, lowest[rotation] + 1)]
+
+def get_placements(board, shape, rotation = 0, x = SPAWN_X, y = SPAWN_Y, color = 0, boards = True):
+    '''
+    every distinct placement a piece of shape starting at (rotation, x, y) can reach with the
+    moves the engine allows: one square left, right or down, or rotating either way,
+    and that Engine.place() accepts
+    searched breadth first, visiting each (rotation, x, y) state once, and only the first
+    placement covering a given set of squares is kept, so the symmetric rotations of O, S, Z
+    and I count once
+    above the highest column the piece can go anywhere, so when it starts up there the
+    search starts from every state just above the stack instead, see get_surface()
+    given boards=False, the board isn't copied for each placement and their board and lines
+    are None, for searches that try them with Board.place() and undo() instead
+    returns [] if the piece doesn't fit where it starts
+    '''
+    masks = MASKS[shape]
+    rotations = len(PIECES[shape])
+    if not board.fits(masks[rotation], x, y):
+        return []
+
+    starts = get_surface(board, masks, rotation, x, y) or [(rotation, x, y)]
+    seen = set(starts) # transposition set of every state reached
+    queue = deque(starts)
+    covered = set() # squares of every placement found
+    placements = []
+    while queue:
+        rotation, x, y = queue.popleft()
+        mask = masks[rotation]
+
+        # resting on something with every square between the sides, the piece can be locked here
+        if x + mask.left >= 0 and x + mask.right < BOARD_W and not board.fits(mask, x, y + 1):
+            squares = frozenset((x + dx, y + dy) for dx, dy in mask.cells)
+            if squares not in covered:
+                covered.add(squares)
+                if boards:
+                    placements.append(lock(board, shape, rotation, x, y, color))
+                else:
+                    placements.append(Placement(rotation, x, y, None, None))
+
+        for state in get_moves(rotation, x, y, rotations):
+            # a piece entirely above the board could otherwise slide sideways forever
+            if state not in seen and -TEMPLATE_W < state[1] < BOARD_W:
+                seen.add(state)
+                if board.fits(masks[state[0]], state[1], state[2]):
+                    queue.append(state)
+    return placements
+
+def find_path(board, shape, start, goal):
+    '''
+    a way for a piece of shape to go from the (rotation, x, y) state start to goal, as the
+    states it goes through after start, or None if it can't get there
+    the path has the fewest moves other than going down, which gravity does anyway,
+    made as high up as they can be so they still work once the piece has fallen further
+    searched best first, counting the sideways moves and turns still needed to reach the goal,
+    so states heading away from it are mostly left alone
+    '''
+    masks = MASKS[shape]
+    rotations = len(PIECES[shape])
+    goal_rotation, goal_x = goal[:2]
+
+    def get_estimate(state):
+        ''' moves other than down left to reach the goal, never more than it takes'''
+        turns = (state[0] - goal_rotation) % rotations
+        return abs(state[1] - goal_x) + min(turns, rotations - turns)
+
+    costs = {start: (0, 0)} # (moves other than down, sum of the levels they were made on)
+    parents = {start: None} # state: the state it was reached from
+    blocked = set()
+    heap = [((get_estimate(start), 0), start)]
+    while heap:
+        priority, state = heapq.heappop(heap)
+        cost = costs[state]
+        if priority != (cost[0] + get_estimate(state), cost[1]):
+            continue # reached more cheaply since
+        if state == goal:
+            path = []
+            while state != start:
+                path.append(state)
+                state = parents[state]
+            return path[::-1]
+
+        for move in get_moves(*state, rotations):
+            if move[2] != state[2]:
+                move_cost = cost
+            else:
+                move_cost = (cost[0] + 1, cost[1] + state[2])
+            if move in blocked or move_cost >= costs.get(move, (move_cost[0] + 1, 0)):
+                continue
+            if not -TEMPLATE_W < move[1] < BOARD_W or not board.fits(masks[move[0]], move[1], move[2]):
+                blocked.add(move)
+                continue
+            costs[move] = move_cost
+            parents[move] = state
+            heapq.heappush(heap, ((move_cost[0] + get_estimate(move), move_cost[1]), move))
+    return None
@@ -0,0 +1,377 @@
+# Draws engine state with pygame, redrawing only the parts of the window that changed
+# (c) 2018 Tingda Wang
+
+import pygame
+from collections import OrderedDict
+
+from rules import BOARD_W, BOARD_H, NIL, TEMPLATE_W, TEMPLATE_H, SPAWN_Y, MASKS
+
+SQ_SIZE = 20
+# each square spills 2 pixels into its right and bottom neighbours
+SPILL = 2
+# pixels between a board, its border and the HUD beside it in get_layout()
+LAYOUT_MARGIN = 12
+# transparent pixels of the square sprites, never a piece color
+COLORKEY = (255, 0, 255)
+# rendered text surfaces kept, plenty for the HUD labels, recent scores and messages
+TEXT_CACHE_SIZE = 256
+
+class Theme:
+    ''' colors a renderer draws with'''
+
+    def __init__(self, dark_colors, light_colors, background, border, border_shade, text_color):
+        ''' piece colors are indexed by Piece.color'''
+        self.dark_colors = dark_colors
+        self.light_colors = light_colors
+        self.background = background
+        self.border = border
+        self.border_shade = border_shade
+        self.text_color = text_color
+
+class TextCache:
+    '''
+    text surfaces rendered by (font, text, color), so the same text is only rasterized once
+    the least recently used surfaces are dropped once there are more than size of them
+    '''
+
+    def __init__(self, size = TEXT_CACHE_SIZE):
+        ''' returns an empty cache'''
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        ''' antialiased surface of text in font and color, like font.render()'''
+        key = (font, text, color)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surf
+
+        self.misses += 1
+        surf = font.render(text, True, color)
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last = False)
+        return surf
+
+# shared by every renderer and game screen
+TEXT_CACHE = TextCache()
+
+class BoardView:
+    '''
+    where one player's board, score, difficulty and next piece go on the display
+    also remembers what was last drawn there so changes can be found
+    '''
+
+    def __init__(self, left, top, score_pos, difficulty_pos, next_label_pos, next_pos, sq_size = SQ_SIZE,
+                 bounds = None):
+        '''
+        left and top are the display coordinates of the board's top left square,
+        sq_size how many pixels a square of the board and the next piece takes
+        bounds is a rect of the display everything of the view stays in, so redrawing
+        somewhere else can leave it out, or None to always draw it
+        '''
+        self.left = left
+        self.top = top
+        self.score_pos = score_pos
+        self.difficulty_pos = difficulty_pos
+        self.next_label_pos = next_label_pos
+        self.next_pos = next_pos
+        self.sq_size = sq_size
+        self.sq_reach = sq_size + SPILL
+        self.bounds = bounds
+        self.forget()
+
+    def forget(self):
+        ''' forgets what was drawn, everything counts as changed on the next frame'''
+        self.squares = None
+        self.board_key = None # (engine, engine.board_changes) the squares were read at
+        self.piece_rects = []
+        self.ghost_rects = []
+        self.texts = {}
+        self.next_spec = None
+
+    def get_display_coords(self, x, y):
+        ''' for given board coord, find relevant coordinates on display'''
+        return self.left + (x * self.sq_size), self.top + (y * self.sq_size)
+
+    def get_squares(self, engine):
+        ''' the color of every square of the board, row by row'''
+        board = engine.board
+        return [board.get(x, y) for y in range(BOARD_H) for x in range(BOARD_W)]
+
+    def get_piece_rects(self, piece, y, offset = 0):
+        ''' display rects a piece covers at level y, drawn offset pixels below it'''
+        if piece is None:
+            return []
+        rects = []
+        for i, j in MASKS[piece.shape][piece.rotation].cells:
+            disp_x, disp_y = self.get_display_coords(piece.x + i, y + j)
+            rects.append(pygame.Rect(disp_x + 1, disp_y + offset + 1, self.sq_reach - 1, self.sq_reach - 1))
+        return rects
+
+    def get_texts(self, engine):
+        ''' the HUD text by position'''
+        return {self.score_pos: "Score: %s" %engine.score,
+                self.difficulty_pos: "Difficulty: %s" %engine.difficulty,
+                self.next_label_pos: "Next Piece:"}
+
+    def get_changes(self, engine, font, offset = 0, ghost = False):
+        '''
+        display rects that need redrawing since the last call
+        offset is how many pixels below its level the falling piece is drawn,
+        ghost whether its landing spot is drawn too
+        '''
+        rects = []
+
+        # squares of the board, only read again once the engine changed it
+        board_key = (engine, engine.board_changes)
+        if board_key != self.board_key:
+            squares = self.get_squares(engine)
+            if self.squares is not None:
+                for i, (old, new) in enumerate(zip(self.squares, squares)):
+                    if old != new:
+                        disp_x, disp_y = self.get_display_coords(i % BOARD_W, i // BOARD_W)
+                        rects.append(pygame.Rect(disp_x + 1, disp_y + 1, self.sq_reach - 1, self.sq_reach - 1))
+            self.squares = squares
+            self.board_key = board_key
+
+        # where the falling piece and its ghost were and now are
+        piece = engine.curr_piece
+        piece_rects = self.get_piece_rects(piece, piece and piece.y, offset)
+        if piece_rects != self.piece_rects:
+            rects += self.piece_rects + piece_rects
+        self.piece_rects = piece_rects
+        if ghost:
+            ghost_rects = self.get_piece_rects(piece, engine.ghost())
+            if ghost_rects != self.ghost_rects:
+                rects += self.ghost_rects + ghost_rects
+            self.ghost_rects = ghost_rects
+
+        # score, difficulty and labels
+        texts = self.get_texts(engine)
+        for pos, text in texts.items():
+            old = self.texts.get(pos)
+            if old != text:
+                rect = pygame.Rect(pos, font.size(text))
+                if old is not None:
+                    rect.union_ip(pygame.Rect(pos, font.size(old)))
+                rects.append(rect)
+        self.texts = texts
+
+        # next piece
+        piece = engine.next_piece
+        spec = (piece.shape, piece.rotation, piece.color)
+        if spec != self.next_spec:
+            rects.append(pygame.Rect(self.next_pos, (TEMPLATE_W * self.sq_size + SPILL,
+                                                     TEMPLATE_H * self.sq_size + SPILL)))
+            self.next_spec = spec
+        return rects
+
+def get_layout(players, area, font, columns = None):
+    '''
+    BoardViews for a grid of players boards filling the area rect of the display, each
+    with the next piece, score and difficulty beside it, in player order left to right
+    and top to bottom
+    columns fixes how many boards go side by side, otherwise the grid with the biggest
+    squares is used, and the squares shrink so the HUD text still fits
+    '''
+    text_width = max(font.size(text)[0] for text in ('Next Piece:', 'Score: 9999', 'Difficulty: 99'))
+    line = font.get_linesize()
+    best = None # (square size, columns)
+    for cols in ([columns] if columns else range(1, players + 1)):
+        rows = -(-players // cols)
+        cell_w, cell_h = area.width // cols, area.height // rows
+        for size in range(SQ_SIZE * 2, 0, -1):
+            width = BOARD_W * size + 3 * LAYOUT_MARGIN + max(TEMPLATE_W * size, text_width)
+            if width <= cell_w and BOARD_H * size + 2 * LAYOUT_MARGIN <= cell_h:
+                break
+        if best is None or size > best[0]:
+            best = size, cols
+
+    size, cols = best
+    rows = -(-players // cols)
+    cell_w, cell_h = area.width // cols, area.height // rows
+    width = BOARD_W * size + LAYOUT_MARGIN + max(TEMPLATE_W * size, text_width)
+    views = []
+    for player in range(players):
+        left = area.left + (player % cols) * cell_w + (cell_w - width) // 2
+        top = area.top + (player // cols) * cell_h + (cell_h - BOARD_H * size) // 2
+        side = left + BOARD_W * size + LAYOUT_MARGIN
+        next_top = top + line
+        score_top = next_top + TEMPLATE_H * size + line
+        bounds = pygame.Rect(area.left + (player % cols) * cell_w, area.top + (player // cols) * cell_h,
+                             cell_w, cell_h)
+        # pieces that haven't fallen onto the board yet can stick out of the cell, up and to the sides
+        bounds.union_ip((left - TEMPLATE_W * size, top + SPAWN_Y * size,
+                         (BOARD_W + 2 * TEMPLATE_W) * size, BOARD_H * size))
+        views.append(BoardView(left, top, (side, score_top), (side, score_top + line), (side, top),
+                               (side, next_top), size, bounds))
+    return views
+
+class Renderer:
+    '''
+    draws the engines of one or more BoardViews onto the display
+    the first frame and any frame after invalidate() draw the whole window,
+    other frames only redraw and update the rects whose content changed
+    '''
+
+    def __init__(self, display, theme, font, views, text_cache = TEXT_CACHE, smooth = False, ghost = True):
+        '''
+        views are the BoardView of each engine drawn, in the same order
+        smooth draws falling pieces between levels as they fall instead of jumping a level at a time
+        ghost outlines where each falling piece would land if dropped
+        '''
+        self.display = display
+        self.theme = theme
+        self.font = font
+        self.views = views
+        self.text_cache = text_cache
+        self.smooth = smooth
+        self.ghost = ghost
+        self.full = True
+        self.atlases = {} # square size: (atlas, sprites, ghost sprites)
+        for view in views:
+            self.get_atlas(view.sq_size)
+
+    def get_atlas(self, size = SQ_SIZE):
+        '''
+        pre-renders the square of every color side by side on one surface, converted
+        to the display's pixel format, so squares are drawn with a single blits() call
+        the outlined squares of ghost pieces go in a second row
+        made once for every square size, returns the atlas and the sprite rects within it
+        '''
+        if size in self.atlases:
+            return self.atlases[size]
+        colors = len(self.theme.dark_colors)
+        reach = size + SPILL
+        atlas = pygame.Surface((colors * reach, 2 * reach))
+        atlas.fill(COLORKEY)
+        for color in range(colors):
+            pygame.draw.rect(atlas, self.theme.dark_colors[color], (color * reach + 1, 1, size - 1, size - 1))
+            pygame.draw.rect(atlas, self.theme.light_colors[color], (color * reach + 4, 4, size - 2 , size - 2))
+            pygame.draw.rect(atlas, self.theme.dark_colors[color],
+                             (color * reach + 1, reach + 1, size - 1, size - 1), 2)
+        sprites = [pygame.Rect(color * reach, 0, reach, reach) for color in range(colors)]
+        ghost_sprites = [pygame.Rect(color * reach, reach, reach, reach) for color in range(colors)]
+        atlas = atlas.convert()
+        atlas.set_colorkey(COLORKEY, pygame.RLEACCEL)
+        self.atlases[size] = atlas, sprites, ghost_sprites
+        return self.atlases[size]
+
+    def invalidate(self):
+        ''' something else drew on the display, the next frame redraws everything'''
+        self.full = True
+
+    def get_square(self, disp_x, disp_y, color, ghost = False, size = SQ_SIZE):
+        ''' blits() entry drawing a square, or a ghost's outline, with its top left corner at display coordinates'''
+        atlas, sprites, ghost_sprites = self.atlases[size]
+        return atlas, (disp_x, disp_y), (ghost_sprites if ghost else sprites)[color]
+
+    def draw_text(self, text, pos, clip):
+        ''' draws text at pos if it reaches into clip'''
+        surf = self.text_cache.render(self.font, text, self.theme.text_color)
+        if clip.colliderect(surf.get_rect(topleft = pos)):
+            self.display.blit(surf, pos)
+
+    def draw_piece(self, piece, disp_x, disp_y, clip, ghost = False, size = SQ_SIZE):
+        '''
+        draws each square of piece reaching into clip, template corner at display coordinates
+        a ghost piece is only outlined
+        '''
+        squares = []
+        reach = size + SPILL
+        for i, j in MASKS[piece.shape][piece.rotation].cells:
+            x, y = disp_x + (i * size), disp_y + (j * size)
+            if clip.colliderect((x, y, reach, reach)):
+                squares.append(self.get_square(x, y, piece.color, ghost, size))
+        self.display.blits(squares, doreturn = False)
+
+    def draw_board(self, view, engine, clip):
+        ''' draws the squares of the board reaching into clip'''
+        board = engine.board
+        squares = []
+        size, reach = view.sq_size, view.sq_reach
+        # squares reaching into clip
+        first_x = max((clip.left - view.left - reach) // size + 1, 0)
+        last_x = min((clip.right - view.left) // size, BOARD_W - 1)
+        first_y = max((clip.top - view.top - reach) // size + 1, 0)
+        last_y = min((clip.bottom - view.top) // size, BOARD_H - 1)
+        for i in range(first_x, last_x + 1):
+            for j in range(first_y, last_y + 1):
+                color = board.get(i, j)
+                if color is not NIL:
+                    squares.append(self.get_square(view.left + (i * size), view.top + (j * size), color, False, size))
+        self.display.blits(squares, doreturn = False)
+
+    def draw(self, engines, clip, offsets):
+        '''
+        draws every layer of the window that reaches into clip, in the order they stack
+        offsets are how many pixels below their level each engine's falling piece goes
+        '''
+        self.display.set_clip(clip)
+        self.display.fill(self.theme.background, clip)
+
+        # only the views reaching into clip
+        layers = [(view, engine, offset) for view, engine, offset in zip(self.views, engines, offsets)
+                  if view.bounds is None or view.bounds.colliderect(clip)]
+
+        # draws the board borders and background
+        for view, engine, offset in layers:
+            width, height = BOARD_W * view.sq_size, BOARD_H * view.sq_size
+            pygame.draw.rect(self.display, self.theme.border, (view.left - 3, view.top - 7, width + 8, height + 8), 5)
+            pygame.draw.rect(self.display, self.theme.border_shade, (view.left + 1, view.top - 3, width + 8, height + 8), 5)
+        for view, engine, offset in layers:
+            pygame.draw.rect(self.display, self.theme.background,
+                             (view.left, view.top, BOARD_W * view.sq_size, BOARD_H * view.sq_size))
+
+        for view, engine, offset in layers:
+            self.draw_board(view, engine, clip)
+
+        # where the falling pieces would land, beneath everything that moves
+        if self.ghost:
+            for view, engine, offset in layers:
+                if engine.curr_piece is not None:
+                    disp_x, disp_y = view.get_display_coords(engine.curr_piece.x, engine.ghost())
+                    self.draw_piece(engine.curr_piece, disp_x, disp_y, clip, True, view.sq_size)
+
+        # score and difficulty, then the next pieces
+        for view, engine, offset in layers:
+            self.draw_text("Score: %s" %engine.score, view.score_pos, clip)
+            self.draw_text("Difficulty: %s" %engine.difficulty, view.difficulty_pos, clip)
+        for view, engine, offset in layers:
+            self.draw_text("Next Piece:", view.next_label_pos, clip)
+            self.draw_piece(engine.next_piece, view.next_pos[0], view.next_pos[1], clip, False, view.sq_size)
+
+        # falling pieces go on top
+        for view, engine, offset in layers:
+            if engine.curr_piece is not None:
+                disp_x, disp_y = view.get_display_coords(engine.curr_piece.x, engine.curr_piece.y)
+                self.draw_piece(engine.curr_piece, disp_x, disp_y + offset, clip, False, view.sq_size)
+        self.display.set_clip(None)
+
+    def render(self, engines):
+        ''' draws a frame of the engines and pushes the changed parts to the screen'''
+        if self.full:
+            for view in self.views:
+                view.forget()
+        if self.smooth:
+            offsets = [int(engine.fall_progress() * view.sq_size) for view, engine in zip(self.views, engines)]
+        else:
+            offsets = [0] * len(engines)
+        rects = []
+        for view, engine, offset in zip(self.views, engines, offsets):
+            rects += view.get_changes(engine, self.font, offset, self.ghost)
+
+        if self.full:
+            self.full = False
+            self.draw(engines, self.display.get_rect(), offsets)
+            pygame.display.update()
+            return
+
+        for rect in rects:
+            self.draw(engines, rect, offsets)
+        pygame.display.update(rects)
@@ -0,0 +1,213 @@
+# Recording and fast headless playback of Tetris games
+# (c) 2018 Tingda Wang
+#
+# usage: python3 replay.py game.ttr [--seek TICK]
+#
+# A replay file is a header followed by a stream of records:
+#   header    'TTRP', version, number of players, piece generator mode,
+#             ticks between snapshots, ticks per second, attack routing,
+#             then every player's seed
+#   event     varint ticks since the last record, then player << 4 | action
+#   snapshot  varint ticks since the last record, SNAPSHOT, varint length,
+#             then every player's Engine.snapshot() taken before that tick
+#   end       varint ticks since the last record, END, then the ticks played
+# Records are written out as they are made and flushed with every snapshot, so a game that
+# is quit or crashes still leaves a replay, which ends at its last whole record if it has no
+# end record.
+# Pieces and garbage only depend on the seeds, so replaying the events
+# through the engines rebuilds the whole game.
+
+import time, atexit, struct, argparse
+
+from rules import RANDOM, BAG
+from engine import TICK_RATE, ATTACKS, Engine, Match
+
+MAGIC = b'TTRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBIHB')
+SEED = struct.Struct('<Q')
+MODES = (RANDOM, BAG)
+ATTACK_MODES = tuple(ATTACKS) # engine.ATTACKS names, stored by index
+
+# record kinds that aren't player actions
+SNAPSHOT = 0xFE
+END = 0xFF
+
+# snapshot every 10 seconds of a game
+SNAPSHOT_EVERY = 10 * TICK_RATE
+
+def write_varint(out, value):
+    ''' appends an unsigned int to out, 7 bits a byte'''
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos):
+    ''' reads an unsigned int at pos, returns it and the position after it'''
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+class Recorder:
+    '''
+    records the actions fed to one or more engines into a replay file
+    call record() with every player's actions right before stepping the engines,
+    then close() once the game is over, which also happens on exit if it hasn't
+    '''
+
+    def __init__(self, path, engines, snapshot_every = SNAPSHOT_EVERY, attack = 'all'):
+        '''
+        starts a replay of the given engines, which must not have been stepped yet,
+        attack being the routing of the Match they play
+        '''
+        self.path = path
+        self.engines = engines
+        self.snapshot_every = snapshot_every
+        self.tick = 0
+        self.last = 0 # tick of the last record written
+        self.data = bytearray(HEADER.pack(MAGIC, VERSION, len(engines), MODES.index(engines[0].mode),
+                                          snapshot_every, engines[0].tick_rate, ATTACK_MODES.index(attack)))
+        for engine in engines:
+            self.data += SEED.pack(engine.seed)
+        self.file = open(path, 'wb')
+        self.write_out(flush = True)
+        atexit.register(self.close)
+
+    def write_out(self, flush = False):
+        ''' writes the records made so far to the file, and the file out to disk given flush'''
+        if self.data:
+            self.file.write(self.data)
+            self.data.clear()
+        if flush:
+            self.file.flush()
+
+    def write_record(self, kind):
+        ''' writes the ticks since the last record and its kind'''
+        write_varint(self.data, self.tick - self.last)
+        self.data.append(kind)
+        self.last = self.tick
+
+    def record(self, actions):
+        ''' records the list of actions each player makes this tick'''
+        snapshot = self.tick and self.tick % self.snapshot_every == 0
+        if snapshot:
+            state = b''.join(engine.snapshot() for engine in self.engines)
+            self.write_record(SNAPSHOT)
+            write_varint(self.data, len(state))
+            self.data += state
+
+        for player, player_actions in enumerate(actions):
+            for action in player_actions:
+                self.write_record(player << 4 | action)
+        self.tick += 1
+        self.write_out(flush = snapshot)
+
+    def close(self):
+        ''' ends the replay, does nothing once it has'''
+        if self.file is None:
+            return
+        self.write_record(END)
+        write_varint(self.data, self.tick)
+        self.write_out()
+        self.file.close()
+        self.file = None
+        atexit.unregister(self.close)
+
+class Replay:
+    ''' a replay file loaded for headless playback'''
+
+    def __init__(self, path):
+        ''' reads and indexes a replay file'''
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC or data[len(MAGIC)] != VERSION:
+            raise ValueError('%s is not a version %d Tetris replay' % (path, VERSION))
+        magic, version, players, mode, self.snapshot_every, self.tick_rate, attack = HEADER.unpack_from(data)
+        pos = HEADER.size
+        if len(data) < pos + players * SEED.size:
+            raise ValueError('%s is cut short before the end of its seeds' % path)
+        self.mode = MODES[mode]
+        self.attack = ATTACK_MODES[attack]
+        self.seeds = []
+        for i in range(players):
+            self.seeds.append(SEED.unpack_from(data, pos)[0])
+            pos += SEED.size
+
+        # actions[tick] lists every player's actions on that tick
+        self.actions = {}
+        self.snapshots = {} # tick: state of every engine before that tick
+        tick = self.length = 0 # a replay without an end record ends at its last whole record
+        try:
+            while True:
+                delta, pos = read_varint(data, pos)
+                kind = data[pos]
+                pos += 1
+                if kind == END:
+                    self.length = read_varint(data, pos)[0]
+                    break
+                if kind == SNAPSHOT:
+                    size, pos = read_varint(data, pos)
+                    if pos + size > len(data):
+                        break
+                    state = data[pos:pos + size]
+                    pos += size
+                tick += delta
+                self.length = tick
+                if kind == SNAPSHOT:
+                    self.snapshots[tick] = state
+                else:
+                    if tick not in self.actions:
+                        self.actions[tick] = [[] for i in range(players)]
+                    self.actions[tick][kind >> 4].append(kind & 0xF)
+        except IndexError: # cut short by the game quitting or crashing
+            pass
+
+    def get_engines(self, backend = 'bits'):
+        ''' new engines at the start of the replayed game'''
+        return [Engine(seed, backend, self.mode, tick_rate = self.tick_rate) for seed in self.seeds]
+
+    def play(self, engines, start, end):
+        ''' re-simulates the engines from tick start up to (not including) tick end'''
+        match = Match(engines, self.attack)
+        nothing = [[] for engine in engines]
+        for tick in range(start, end):
+            match.step(self.actions.get(tick, nothing))
+
+    def seek(self, tick, backend = 'bits'):
+        ''' engines as they were right before the given tick, starting from the closest snapshot'''
+        tick = min(tick, self.length)
+        engines = self.get_engines(backend)
+        start = max([t for t in self.snapshots if t <= tick], default = 0)
+        if start:
+            state = self.snapshots[start]
+            size = len(state) // len(engines)
+            for i, engine in enumerate(engines):
+                engine.restore(state[i * size:(i + 1) * size])
+        self.play(engines, start, tick)
+        return engines
+
+def main(argv = None):
+    ''' command line entry point, prints the state of a replay at its end or a given tick'''
+    parser = argparse.ArgumentParser(description = 'Replays a recorded Tetris game without a window')
+    parser.add_argument('path', help = 'replay file')
+    parser.add_argument('--seek', type = int, default = None, help = 'stop before this tick')
+    args = parser.parse_args(argv)
+
+    replay = Replay(args.path)
+    tick = replay.length if args.seek is None else min(args.seek, replay.length)
+    start = time.perf_counter()
+    engines = replay.seek(tick)
+    elapsed = time.perf_counter() - start
+    for player, engine in enumerate(engines):
+        print('player %d: tick %d, score %d, pieces %d%s' % (player + 1, engine.tick, engine.score,
+              engine.pieces, ', game over' if engine.game_over else ''))
+    print('%d of %d ticks replayed in %.3fs' % (tick, replay.length, elapsed))
+
+if __name__ == "__main__":
+    main()
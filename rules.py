@@ -0,0 +1,284 @@
+# Tetris rules shared by the single player, 2-player and headless games
+# (c) 2018 Tingda Wang
+
+import random
+
+BOARD_W = 10 # in squares
+BOARD_H = 20 # in squares
+NIL = '.' # nothin'
+
+''' Difficulty constants'''
+# how fast piece moves in seconds (fall speed not constant, will change based on difficulty)
+SIDEWAY_FREQ = 0.15
+DOWN_FREQ = 0.1
+# inverse of rate in which blocks speed up (the lower the faster)
+ACCELERATION = 5 
+
+# number of piece colors, renderers map these onto their own palettes
+NUM_COLORS = 11
+
+# Templates for each shape
+TEMPLATE_W = 5
+TEMPLATE_H = 5
+
+# board coordinates of a template's top left corner when a piece spawns
+SPAWN_X = int(BOARD_W / 2) - int(TEMPLATE_W / 2)
+SPAWN_Y = -2
+
+S_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '..OO.',
+                     '.OO..',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..OO.',
+                     '...O.',
+                     '.....']]
+
+Z_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '.OO..',
+                     '..OO.',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '.OO..',
+                     '.O...',
+                     '.....']]
+
+I_SHAPE_TEMPLATE = [['..O..',
+                     '..O..',
+                     '..O..',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     'OOOO.',
+                     '.....',
+                     '.....']]
+
+O_SHAPE_TEMPLATE = [['.....',
+                     '.....',
+                     '.OO..',
+                     '.OO..',
+                     '.....']]
+
+J_SHAPE_TEMPLATE = [['.....',
+                     '.O...',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..OO.',
+                     '..O..',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '...O.',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..O..',
+                     '.OO..',
+                     '.....']]
+
+L_SHAPE_TEMPLATE = [['.....',
+                     '...O.',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..O..',
+                     '..OO.',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '.O...',
+                     '.....'],
+                    ['.....',
+                     '.OO..',
+                     '..O..',
+                     '..O..',
+                     '.....']]
+
+T_SHAPE_TEMPLATE = [['.....',
+                     '..O..',
+                     '.OOO.',
+                     '.....',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '..OO.',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '.....',
+                     '.OOO.',
+                     '..O..',
+                     '.....'],
+                    ['.....',
+                     '..O..',
+                     '.OO..',
+                     '..O..',
+                     '.....']]
+
+# dictionary to get corresponding piece template
+PIECES = {
+    'S': S_SHAPE_TEMPLATE,
+    'Z': Z_SHAPE_TEMPLATE,
+    'J': J_SHAPE_TEMPLATE,
+    'L': L_SHAPE_TEMPLATE,
+    'I': I_SHAPE_TEMPLATE,
+    'O': O_SHAPE_TEMPLATE,
+    'T': T_SHAPE_TEMPLATE
+    }
+
+class Mask:
+    '''
+    one rotation of a piece template compiled into the squares it occupies
+    cells are (x, y) offsets within the template, rows are (y, bitmask) pairs
+    with bit x set for every occupied square of template row y
+    '''
+
+    def __init__(self, template):
+        ''' compiles a TEMPLATE_H list of TEMPLATE_W strings'''
+        self.cells = tuple((x, y) for x in range(TEMPLATE_W) for y in range(TEMPLATE_H)
+                           if template[y][x] != NIL)
+        self.rows = tuple((y, sum(1 << x for x in range(TEMPLATE_W) if template[y][x] != NIL))
+                          for y in range(TEMPLATE_H) if template[y].strip(NIL))
+
+        # bounding box within the template
+        self.left = min(x for x, y in self.cells)
+        self.right = max(x for x, y in self.cells)
+        self.top = min(y for x, y in self.cells)
+        self.bottom = max(y for x, y in self.cells)
+
+        # bottom profile, the lowest square of every column the piece covers as (x, y) pairs
+        self.bottoms = tuple((x, max(cell_y for cell_x, cell_y in self.cells if cell_x == x))
+                             for x in range(self.left, self.right + 1))
+
+        # rows already shifted into place for every board x some square of the piece is on the board at,
+        # as (y, bitmask, squares) with bitmask None for a row with a square off either side
+        self.shifted = {x: tuple((y, get_shifted(bits, x), bin(bits).count('1')) for y, bits in self.rows)
+                        for x in range(1 - TEMPLATE_W, BOARD_W)}
+
+def get_shifted(bits, x):
+    ''' a template row bitmask moved x squares right on the board, None if any square falls off'''
+    shifted = bits << x if x >= 0 else bits >> -x
+    if shifted >> BOARD_W or shifted << max(-x, 0) != bits << max(x, 0):
+        return None
+    return shifted
+
+# compiled once, indexed like PIECES[shape][rotation]
+MASKS = {shape: tuple(Mask(template) for template in templates) for shape, templates in PIECES.items()}
+
+class Piece:
+    ''' Piece class that stores shape, rotation, color and coordinate of piece'''
+
+    def __init__(self): 
+        ''' initializes empty piece starting in the middle top of board'''
+        self.shape = None
+        self.rotation = 0
+        self.x = SPAWN_X
+        self.y = SPAWN_Y
+        self.color = None
+
+''' Piece generation'''
+# modes of PieceGenerator
+RANDOM = 'random' # every piece picked independently
+BAG = 'bag' # every run of 7 pieces holds each shape once
+
+SHAPES = list(PIECES.keys())
+MASK_64 = (1 << 64) - 1
+BAG_SALT = 0x5851F42D4C957F2D
+# splitmix64 constants, the step between counters and the two multipliers
+MIX_GAMMA = 0x9E3779B97F4A7C15
+MIX_1 = 0xBF58476D1CE4E5B9
+MIX_2 = 0x94D049BB133111EB
+
+def mix(seed, counter):
+    ''' counter based random number, 64 random bits that only depend on seed and counter (splitmix64)'''
+    z = (seed + (counter + 1) * MIX_GAMMA) & MASK_64
+    z = ((z ^ (z >> 30)) * MIX_1) & MASK_64
+    z = ((z ^ (z >> 27)) * MIX_2) & MASK_64
+    return z ^ (z >> 31)
+
+class PieceGenerator:
+    '''
+    deterministic stream of random pieces for one game
+    piece k only depends on the seed, the mode and k, so any piece can be looked up
+    directly and the same seed gives the same pieces in every process
+    the next preview pieces are kept in a ring buffer
+    '''
+
+    def __init__(self, seed = None, mode = RANDOM, preview = 1):
+        ''' seed is an int, None picks one at random'''
+        if seed is None:
+            seed = random.getrandbits(64)
+        if mode not in (RANDOM, BAG):
+            raise ValueError('unknown piece generator mode %r' % mode)
+        if preview < 1:
+            raise ValueError('preview must be at least 1, got %r' % preview)
+        self.seed = seed & MASK_64
+        self.mode = mode
+        self.preview = preview
+        self.bag = None # (bag number, shapes) of the last bag shuffled
+        self.seek(0)
+
+    def get_shapes(self, bag):
+        ''' shuffles the given bag of 7 shapes'''
+        if self.bag is None or self.bag[0] != bag:
+            shapes = SHAPES[:]
+            for i in range(len(shapes) - 1, 0, -1):
+                j = mix(self.seed ^ BAG_SALT, bag * len(shapes) + i) % (i + 1)
+                shapes[i], shapes[j] = shapes[j], shapes[i]
+            self.bag = (bag, shapes)
+        return self.bag[1]
+
+    def get_spec(self, k):
+        ''' (shape, rotation, color) of piece k'''
+        bits = mix(self.seed, k)
+        if self.mode == BAG:
+            shape = self.get_shapes(k // len(SHAPES))[k % len(SHAPES)]
+        else:
+            shape = SHAPES[bits % len(SHAPES)]
+        bits >>= 8
+        rotation = bits % len(PIECES[shape])
+        bits >>= 8
+        return shape, rotation, bits % NUM_COLORS
+
+    def piece_at(self, k):
+        ''' returns a new piece k of the stream, spawning in the middle top of board'''
+        piece = Piece()
+        piece.shape, piece.rotation, piece.color = self.get_spec(k)
+        return piece
+
+    def seek(self, k):
+        ''' jumps to piece k, it is the one next() returns'''
+        self.index = k
+        self.head = 0
+        self.queue = [self.get_spec(k + i) for i in range(self.preview)]
+
+    def next(self):
+        ''' returns the next piece and moves the stream on by one'''
+        spec = self.queue[self.head]
+        self.queue[self.head] = self.get_spec(self.index + self.preview)
+        self.head = (self.head + 1) % self.preview
+        self.index += 1
+
+        piece = Piece()
+        piece.shape, piece.rotation, piece.color = spec
+        return piece
+
+    def peek(self, i = 0):
+        ''' returns a new copy of the upcoming piece i places ahead, 0 being the next one'''
+        if i >= self.preview:
+            return self.piece_at(self.index + i)
+        piece = Piece()
+        piece.shape, piece.rotation, piece.color = self.queue[(self.head + i) % self.preview]
+        return piece
@@ -0,0 +1,95 @@
+# Plays many headless Tetris games across processes and streams the results
+# (c) 2018 Tingda Wang
+#
+# usage: python3 selfplay.py --games 100000 --workers 8 --policy selfplay:random_policy > results.jsonl
+
+import sys, time, json, random, argparse, importlib, os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from rules import BOARD_W, PIECES, MASKS, RANDOM
+from engine import Engine
+
+def random_policy(seed):
+    '''
+    a policy takes the seed of a game and returns a function that picks where
+    the engine's current piece goes as a (rotation, x) pair
+    this one drops each piece with a random rotation in a random column
+    '''
+    rng = random.Random(seed)
+    def choose(engine):
+        piece = engine.curr_piece
+        rotation = rng.randrange(len(PIECES[piece.shape]))
+        mask = MASKS[piece.shape][rotation]
+        return rotation, rng.randint(-mask.left, BOARD_W - 1 - mask.right)
+    return choose
+
+def load_policy(spec):
+    ''' finds a policy from its 'module:function' name'''
+    module, name = spec.split(':')
+    return getattr(importlib.import_module(module), name)
+
+def play_game(policy, seed, max_pieces, backend, mode):
+    ''' plays one game until it is over or max_pieces are placed, returns its result'''
+    start = time.perf_counter()
+    engine = Engine(seed, backend, mode)
+    choose = policy(seed)
+    while not engine.game_over and engine.pieces < max_pieces:
+        if engine.curr_piece is None:
+            engine.spawn()
+            continue
+        engine.place(*choose(engine))
+    return {'seed': seed, 'score': engine.score, 'lines': engine.score, 'pieces': engine.pieces,
+            'duration': time.perf_counter() - start}
+
+def play_shard(spec, seeds, max_pieces, backend, mode):
+    ''' worker process entry point, plays every game of a shard of seeds'''
+    policy = load_policy(spec)
+    return [play_game(policy, seed, max_pieces, backend, mode) for seed in seeds]
+
+def run(games, workers, seed, spec, max_pieces, backend, mode, shard_size, out = sys.stdout):
+    '''
+    plays games numbered 0 to games - 1, game i uses seed + i whatever the number of workers
+    writes one JSON line per game as shards finish, so results come back out of order
+    '''
+    shards = (range(start, min(start + shard_size, games)) for start in range(0, games, shard_size))
+    with ProcessPoolExecutor(workers) as executor:
+        # keep a few shards queued per worker instead of submitting millions of games at once
+        pending = {}
+        for shard in shards:
+            seeds = [seed + i for i in shard]
+            pending[executor.submit(play_shard, spec, seeds, max_pieces, backend, mode)] = shard
+            if len(pending) >= workers * 4:
+                done, _ = wait(pending, return_when = FIRST_COMPLETED)
+                write_results(done, pending, out)
+        while pending:
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            write_results(done, pending, out)
+
+def write_results(done, pending, out):
+    ''' streams the results of finished shards as JSON lines'''
+    for future in done:
+        shard = pending.pop(future)
+        for game, result in zip(shard, future.result()):
+            out.write(json.dumps(dict(game = game, **result)) + '\n')
+    out.flush()
+
+def main(argv = None):
+    ''' command line entry point'''
+    parser = argparse.ArgumentParser(description = 'Plays headless Tetris games in parallel, one JSON line per game')
+    parser.add_argument('--games', type = int, default = 1000, help = 'number of games to play')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'worker processes')
+    parser.add_argument('--seed', type = int, default = 1998, help = 'game i is played with seed + i')
+    parser.add_argument('--policy', default = 'selfplay:random_policy', help = 'module:function picking placements')
+    parser.add_argument('--max-pieces', type = int, default = 10000, help = 'stops games that last longer')
+    parser.add_argument('--backend', default = 'bits', help = 'board backend, list or bits')
+    parser.add_argument('--mode', default = RANDOM, help = 'piece generator mode, random or bag')
+    parser.add_argument('--shard-size', type = int, default = 100, help = 'games sent to a worker at a time')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    run(args.games, args.workers, args.seed, args.policy, args.max_pieces, args.backend, args.mode, args.shard_size)
+    elapsed = time.perf_counter() - start
+    sys.stderr.write('%d games in %.2fs (%.0f games/s)\n' % (args.games, elapsed, args.games / elapsed))
+
+if __name__ == "__main__":
+    main()
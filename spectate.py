@@ -0,0 +1,416 @@
+# Streams matches to spectators as board changes, with keyframes to join or catch up on
+# (c) 2018 Tingda Wang
+#
+# usage: python3 ctetris.py --broadcast 7779
+#        python3 spectate.py watch localhost:7779
+#        python3 spectate.py loopback --spectators 100 --seconds 20 > spectate.jsonl
+#
+# A spectator doesn't play the match, it only shows it, so instead of the players' actions
+# the feed sends what changed: the squares of every piece added to a board, the levels
+# deleted, the garbage levels pushed in and where the current pieces are. Messages are
+# framed like netplay.py, a 2 byte length then a kind:
+#   keyframe  tick, players, piece generator mode, every player's seed, then every
+#             player's Engine.snapshot(); sent every few seconds, and first to every spectator
+#   delta     tick, then records of player << 4 | kind:
+#               add      shape << 2 | rotation, x, y and color of a piece added to the board
+#               delete   number of levels, then each level deleted, top to bottom
+#               push     the garbage level pushed in, a square every 4 bits as in Board.dump()
+#               spawn    the piece generator index after the next piece came in
+#               move     rotation, x and y of the current piece
+#               nothing  the current piece is gone
+#               over     the player is out
+# The next pieces follow from the seed, so a spawn doesn't say what came in. Every frame is
+# encoded once and the same bytes go to every spectator.
+
+import sys, time, json, random, struct, asyncio, argparse, threading
+
+from rules import BOARD_W, NIL, MASKS, SHAPES, SPAWN_X, SPAWN_Y
+from engine import TICK_RATE, ADDED, DELETED, REPLACED, Engine, Match
+from replay import MODES
+from netplay import LENGTH, SEED, Link
+from ai import Bot, think_all
+
+PORT = 7779
+
+# message framing, after netplay's length
+KEYFRAME, DELTA = range(2)
+KEYFRAME_HEADER = struct.Struct('<BIBB')
+DELTA_HEADER = struct.Struct('<BI')
+# records of a delta
+ADD, DELETE, PUSH, SPAWN, MOVE, NOTHING, OVER = range(7)
+ADD_RECORD = struct.Struct('<Bbbb')
+SPAWN_RECORD = struct.Struct('<I')
+MOVE_RECORD = struct.Struct('<Bbb')
+
+# ticks between keyframes, how long a spectator that fell behind waits to catch up
+KEYFRAME_EVERY = 4 * TICK_RATE
+# bytes waiting to go out to a spectator before it is skipped until the next keyframe
+MAX_BACKLOG = 64 * 1024
+
+def pack_row(row):
+    ''' a garbage level as bytes, 2 squares a byte, 0 for empty and color + 1 otherwise'''
+    squares = [0 if square == NIL else square + 1 for square in row]
+    return bytes(squares[x] | squares[x + 1] << 4 for x in range(0, BOARD_W, 2))
+
+def unpack_row(data, pos):
+    ''' the level pack_row() wrote at pos'''
+    row = []
+    for byte in data[pos:pos + BOARD_W // 2]:
+        row += [NIL if square == 0 else square - 1 for square in (byte & 0xF, byte >> 4)]
+    return row
+
+def get_pose(engine):
+    ''' (rotation, x, y) of the current piece, None without one'''
+    piece = engine.curr_piece
+    return None if piece is None else (piece.rotation, piece.x, piece.y)
+
+class Encoder:
+    '''
+    turns the changes to a match's engines into frames, following them through Engine.journal
+    call encode() whenever the engines have been stepped, once a frame is plenty
+    '''
+
+    def __init__(self, engines, keyframe_every = KEYFRAME_EVERY):
+        ''' starts following the engines, which can't be followed by another encoder at the same time'''
+        self.engines = engines
+        self.keyframe_every = keyframe_every
+        self.keyframe_tick = None # tick of the last keyframe
+        self.shown = [None] * len(engines) # (generator index, pose, game over) spectators have
+        self.frames = self.keyframes = self.bytes = 0
+        for engine in engines:
+            engine.journal = []
+
+    def close(self):
+        ''' stops following the engines'''
+        for engine in self.engines:
+            engine.journal = None
+
+    def get_frame(self, payload):
+        ''' payload framed to be sent as it is, counted'''
+        self.frames += 1
+        self.bytes += LENGTH.size + len(payload)
+        return LENGTH.pack(len(payload)) + payload
+
+    def get_keyframe(self, tick):
+        ''' the whole state of the match as a frame'''
+        engines = self.engines
+        self.keyframe_tick = tick
+        self.keyframes += 1
+        for player, engine in enumerate(engines):
+            engine.journal.clear()
+            self.shown[player] = (engine.generator.index, get_pose(engine), engine.game_over)
+        return self.get_frame(KEYFRAME_HEADER.pack(KEYFRAME, tick, len(engines), MODES.index(engines[0].mode)) +
+                              b''.join(SEED.pack(engine.seed) for engine in engines) +
+                              b''.join(engine.snapshot() for engine in engines))
+
+    def encode(self, tick):
+        '''
+        what changed since the last call, tick being the match's
+        returns (frame, whether it is a keyframe), or None if nothing changed
+        '''
+        engines = self.engines
+        if (self.keyframe_tick is None or tick - self.keyframe_tick >= self.keyframe_every or
+                any((REPLACED,) in engine.journal for engine in engines)):
+            return self.get_keyframe(tick), True
+
+        data = bytearray(DELTA_HEADER.pack(DELTA, tick))
+        for player, engine in enumerate(engines):
+            tag = player << 4
+            for record in engine.journal:
+                if record[0] == ADDED:
+                    kind, shape, rotation, x, y, color = record
+                    data.append(tag | ADD)
+                    data += ADD_RECORD.pack(SHAPES.index(shape) << 2 | rotation, x, y, color)
+                elif record[0] == DELETED:
+                    data.append(tag | DELETE)
+                    data.append(len(record[1]))
+                    data += bytes(record[1])
+                else:
+                    data.append(tag | PUSH)
+                    data += pack_row(record[1])
+            engine.journal.clear()
+
+            index, pose, game_over = self.shown[player]
+            if engine.generator.index != index:
+                index = engine.generator.index
+                data.append(tag | SPAWN)
+                data += SPAWN_RECORD.pack(index)
+                pose = (engine.generator.get_spec(index - 1)[1], SPAWN_X, SPAWN_Y)
+            if get_pose(engine) != pose:
+                pose = get_pose(engine)
+                if pose is None:
+                    data.append(tag | NOTHING)
+                else:
+                    data.append(tag | MOVE)
+                    data += MOVE_RECORD.pack(*pose)
+            if engine.game_over and not game_over:
+                game_over = True
+                data.append(tag | OVER)
+            self.shown[player] = (index, pose, game_over)
+
+        if len(data) == DELTA_HEADER.size:
+            return None
+        return self.get_frame(bytes(data)), False
+
+class Decoder:
+    ''' rebuilds a match from the frames of an Encoder, into engines that can be drawn'''
+
+    def __init__(self, backend = 'list'):
+        ''' backend is the engines' board backend'''
+        self.backend = backend
+        self.engines = [] # none until the first keyframe
+        self.tick = None
+
+    def decode(self, payload):
+        ''' applies a message, deltas before the first keyframe are skipped'''
+        if payload[0] == KEYFRAME:
+            kind, self.tick, players, mode = KEYFRAME_HEADER.unpack_from(payload)
+            pos = KEYFRAME_HEADER.size
+            seeds = [SEED.unpack_from(payload, pos + i * SEED.size)[0] for i in range(players)]
+            pos += players * SEED.size
+            if [engine.seed for engine in self.engines] != seeds: # a new match
+                self.engines = [Engine(seed, self.backend, MODES[mode]) for seed in seeds]
+            size = (len(payload) - pos) // players
+            for i, engine in enumerate(self.engines):
+                engine.restore(payload[pos + i * size:pos + (i + 1) * size])
+        elif payload[0] == DELTA and self.engines:
+            self.tick = DELTA_HEADER.unpack_from(payload)[1]
+            self.apply(payload, DELTA_HEADER.size)
+
+    def apply(self, data, pos):
+        ''' applies the records of a delta from pos on'''
+        while pos < len(data):
+            engine = self.engines[data[pos] >> 4]
+            kind = data[pos] & 0xF
+            pos += 1
+            board = engine.board
+            if kind == ADD:
+                shape_rotation, x, y, color = ADD_RECORD.unpack_from(data, pos)
+                pos += ADD_RECORD.size
+                board.add(MASKS[SHAPES[shape_rotation >> 2]][shape_rotation & 3], x, y, color)
+                engine.pieces += 1
+            elif kind == DELETE:
+                rows = list(data[pos + 1:pos + 1 + data[pos]])
+                pos += 1 + len(rows)
+                board.delete_full_level(rows)
+                engine.score += len(rows)
+                engine.set_difficulty()
+            elif kind == PUSH:
+                board.add_full_level(unpack_row(data, pos))
+                pos += BOARD_W // 2
+            elif kind == SPAWN:
+                engine.generator.seek(SPAWN_RECORD.unpack_from(data, pos)[0] - 1)
+                pos += SPAWN_RECORD.size
+                engine.curr_piece = engine.generator.next()
+                engine.next_piece = engine.generator.peek()
+            elif kind == MOVE:
+                engine.curr_piece.rotation, engine.curr_piece.x, engine.curr_piece.y = MOVE_RECORD.unpack_from(data, pos)
+                pos += MOVE_RECORD.size
+            elif kind == NOTHING:
+                engine.curr_piece = None
+            else:
+                engine.game_over = True
+            if kind in (ADD, DELETE, PUSH):
+                engine.board_changes += 1
+
+class Broadcast:
+    '''
+    sends every frame of an Encoder to the spectators connected, runs on an asyncio loop
+    a spectator joining gets the last keyframe and the deltas since, and one whose
+    connection can't keep up misses the deltas until the next keyframe
+    '''
+
+    def __init__(self, max_backlog = MAX_BACKLOG):
+        ''' max_backlog is the bytes waiting to go out to a spectator before it is skipped'''
+        self.max_backlog = max_backlog
+        self.spectators = {} # writer: whether it has had every frame since the last keyframe
+        self.keyframe = None
+        self.since = [] # delta frames since the keyframe
+        self.skipped = 0 # frames not sent to spectators that fell behind
+
+    async def serve(self, host = '', port = PORT):
+        ''' starts listening, returns the asyncio server'''
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader, writer):
+        ''' serves one spectator until it disconnects, spectators send nothing'''
+        if self.keyframe is not None:
+            writer.writelines([self.keyframe] + self.since)
+        self.spectators[writer] = True
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        del self.spectators[writer]
+        writer.close()
+
+    def publish(self, frame, keyframe):
+        ''' sends a frame from Encoder.encode() to every spectator'''
+        if keyframe:
+            self.keyframe = frame
+            self.since = []
+        else:
+            self.since.append(frame)
+        for writer, caught_up in self.spectators.items():
+            if writer.transport.get_write_buffer_size() > self.max_backlog:
+                self.spectators[writer] = caught_up = False
+            if not caught_up and keyframe:
+                self.spectators[writer] = caught_up = True
+            if caught_up:
+                writer.write(frame)
+            else:
+                self.skipped += 1
+
+class Feed:
+    '''
+    a Broadcast of a game loop that doesn't run asyncio, which runs its own loop on a thread
+    call watch() with the engines of every match, then update() whenever they have been stepped
+    '''
+
+    def __init__(self, host = '', port = PORT):
+        ''' starts listening for spectators'''
+        self.broadcast = Broadcast()
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(self.broadcast.serve(host, port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.encoder = None
+        threading.Thread(target = self.loop.run_forever, daemon = True).start()
+
+    def watch(self, engines):
+        ''' switches to the engines of a new match'''
+        if self.encoder is not None:
+            self.encoder.close()
+        self.encoder = Encoder(engines)
+
+    def update(self, tick):
+        ''' sends what changed, tick being the match's'''
+        encoded = self.encoder.encode(tick)
+        if encoded is not None:
+            self.loop.call_soon_threadsafe(self.broadcast.publish, *encoded)
+
+    def close(self):
+        ''' stops the encoder and the loop'''
+        if self.encoder is not None:
+            self.encoder.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def get_view(engine):
+    ''' what a spectator sees of an engine, to compare'''
+    return (engine.board.dump(), engine.score, engine.pieces, engine.game_over,
+            engine.generator.index, get_pose(engine))
+
+async def watch(host, port, until = None, decoder = None):
+    '''
+    follows a feed until it ends or perf_counter() reaches until
+    returns the Decoder and the Link, whose received counts the bytes
+    '''
+    if decoder is None:
+        decoder = Decoder()
+    reader, writer = await asyncio.open_connection(host, port)
+    link = Link(reader, writer)
+    while True:
+        timeout = None if until is None else until - time.perf_counter()
+        if timeout is not None and timeout <= 0:
+            break
+        try:
+            payload = await asyncio.wait_for(link.recv(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if payload is None:
+            break
+        decoder.decode(payload)
+    await link.close()
+    return decoder, link
+
+def loopback(players, spectators, seconds, out = sys.stdout, frame_rate = 60):
+    '''
+    plays a match between Bots in real time, starting over whenever it ends, and feeds it
+    through a Broadcast on a free local port to spectators joining at random times over the
+    first half, then checks that all of them ended up seeing the engines as they are
+    writes a JSON line with the bytes a second the spectators received, returns whether they all match
+    '''
+    feed = Feed('127.0.0.1', 0)
+    engines = [Engine(random.getrandbits(64)) for player in range(players)]
+    match = Match(engines)
+    bots = [Bot() for engine in engines]
+    feed.watch(engines)
+
+    # the spectators run on a loop of their own, as if on other machines
+    loop = asyncio.new_event_loop()
+    threading.Thread(target = loop.run_forever, daemon = True).start()
+    start = time.perf_counter()
+    until = start + seconds + 0.5 # time for the last frames to come in
+    async def join(delay):
+        await asyncio.sleep(delay)
+        joined = time.perf_counter()
+        decoder, link = await watch('127.0.0.1', feed.port, until)
+        return decoder, link.received / (time.perf_counter() - joined)
+    watching = [asyncio.run_coroutine_threadsafe(join(random.uniform(0, seconds / 2)), loop)
+                for spectator in range(spectators)]
+
+    ticks = int(seconds * TICK_RATE)
+    while match.tick < ticks:
+        if match.is_over():
+            for engine in engines:
+                engine.reset()
+            match = Match(engines)
+            bots = [Bot() for engine in engines]
+        think_all([(bot, engine) for bot, engine in zip(bots, engines) if not engine.game_over])
+        last = min(int((time.perf_counter() - start) * TICK_RATE), ticks - 1)
+        while match.tick <= last and not match.is_over():
+            match.step([bot.get_actions(engine) for bot, engine in zip(bots, engines)])
+        feed.update(match.tick)
+        time.sleep(1 / frame_rate)
+
+    results = [future.result() for future in watching]
+    time.sleep(0.1) # lets the feed see everyone leave
+    feed.close()
+    loop.call_soon_threadsafe(loop.stop)
+    views = [get_view(engine) for engine in engines]
+    same = all([get_view(engine) for engine in decoder.engines] == views for decoder, rate in results)
+    rates = [rate for decoder, rate in results]
+    encoder = feed.encoder
+    out.write(json.dumps({'players': players, 'spectators': spectators, 'seconds': seconds,
+                          'frames': encoder.frames, 'keyframes': encoder.keyframes,
+                          'encoded_bytes_per_second': round(encoder.bytes / seconds, 1),
+                          'bytes_per_second': round(sum(rates) / len(rates), 1),
+                          'max_bytes_per_second': round(max(rates), 1),
+                          'skipped': feed.broadcast.skipped, 'same': same}) + '\n')
+    return same
+
+def main(argv = None):
+    ''' command line entry point, follows a feed or runs a loopback test'''
+    parser = argparse.ArgumentParser(description = 'Streams Tetris matches to spectators')
+    parser.add_argument('command', choices = ['watch', 'loopback'],
+                        help = 'follow a feed, or measure one of a match between bots on this machine')
+    parser.add_argument('address', nargs = '?', default = 'localhost', help = 'HOST[:PORT] of the feed to watch')
+    parser.add_argument('--players', type = int, default = 2, help = 'loopback players in the match')
+    parser.add_argument('--spectators', type = int, default = 100, help = 'loopback spectators')
+    parser.add_argument('--seconds', type = float, default = 20, help = 'loopback match length')
+    args = parser.parse_args(argv)
+
+    if args.command == 'loopback':
+        same = loopback(args.players, args.spectators, args.seconds)
+        sys.exit(0 if same else 1)
+
+    # prints what the spectator sees every second
+    host, colon, port = args.address.partition(':')
+    decoder = Decoder()
+    async def follow():
+        watching = asyncio.ensure_future(watch(host, int(port or PORT), decoder = decoder))
+        while not watching.done():
+            await asyncio.sleep(1)
+            if decoder.engines:
+                print('tick %d: %s' % (decoder.tick, ', '.join(
+                    'player %d score %d pieces %d%s' % (player + 1, engine.score, engine.pieces,
+                                                        ' out' if engine.game_over else '')
+                    for player, engine in enumerate(decoder.engines))))
+        await watching
+    try:
+        asyncio.run(follow())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# Hosts many headless two player matches between bots over the network, with Elo ratings
+# (c) 2018 Tingda Wang
+#
+# usage: python3 tournament.py server --workers 4 > matches.jsonl
+#        python3 tournament.py load --clients 400 --seconds 30
+#
+# Bots connect over TCP and the server plays their matches on headless engines, a piece
+# at a time like selfplay.py, with the lines each player clears pushed under the other's
+# board as in ctetris.py. Every worker process runs its own asyncio loop on the same port
+# and pairs up the bots the kernel hands it by rating. The parent updates the ratings
+# from each result and writes a JSON line per match. Messages are framed like netplay.py:
+#   join    the bot's name, to be paired for a match, again after each match ends
+#   start   player, players, then every player's seed
+#   turn    turn number, then the move every player made last turn
+#   place   turn number, then where the bot's piece goes as a move
+#   end     the player who won, or NO_WINNER
+# A move is (rotation, x, y) as Engine.place() takes it, y being NO_Y to drop the piece
+# straight down and rotation NO_ROTATION for a player that didn't move and is out.
+# Bots keep their own copy of the match from the seeds and the moves, so only moves are sent.
+
+import os, sys, time, json, queue, random, struct, asyncio, argparse, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import Engine, Match
+from netplay import Link
+from selfplay import load_policy
+
+PORT = 7778
+
+# message framing, after netplay's length
+JOIN, START, TURN, PLACE, END = range(5)
+START_HEADER = struct.Struct('<BBB')
+SEED = struct.Struct('<Q')
+TURN_HEADER = struct.Struct('<BI')
+MOVE = struct.Struct('<bbb')
+PLACE_HEADER = struct.Struct('<BI')
+END_HEADER = struct.Struct('<BB')
+NO_Y = -128
+NO_ROTATION = -1
+NO_MOVE = (NO_ROTATION, 0, NO_Y)
+NO_WINNER = 0xFF
+
+PLAYERS = 2
+# seconds a bot has to answer a turn before it loses the match
+TURN_TIMEOUT = 5.0
+# turns before a match is called a draw
+MAX_TURNS = 2000
+# seconds between pairing up the bots waiting in a worker
+MATCHMAKING_INTERVAL = 0.05
+# seconds between throughput reports
+REPORT_EVERY = 5.0
+
+# Elo ratings
+START_RATING = 1500
+ELO_K = 32
+
+def update_ratings(ratings, players, winner, k = ELO_K):
+    '''
+    Elo update of ratings, a dict by name, after a match between the two named players
+    winner is the index of the player who won or None for a draw
+    returns each player's change
+    '''
+    first, second = (ratings.get(name, START_RATING) for name in players)
+    expected = 1 / (1 + 10 ** ((second - first) / 400))
+    score = 0.5 if winner is None else 1 - winner # the first player's
+    change = k * (score - expected)
+    ratings[players[0]] = first + change
+    ratings[players[1]] = second - change
+    return [change, -change]
+
+def to_placement(move):
+    ''' the Engine.place() arguments of a move'''
+    rotation, x, y = move
+    return rotation, x, None if y == NO_Y else y
+
+class Shard:
+    '''
+    the matches of one worker process, between the bots that connect to it
+    results of finished matches go on the results queue, and the parent's rating
+    updates come in on the updates queue, as lists of (name, rating)
+    '''
+
+    def __init__(self, number, results, updates, backend = 'bits', max_turns = MAX_TURNS):
+        ''' number tells the workers apart, backend is the engines' board backend'''
+        self.number = number
+        self.results = results
+        self.updates = updates
+        self.backend = backend
+        self.max_turns = max_turns
+        self.lobby = [] # (name, link, future set to whether the connection is still good after the match)
+        self.reads = {} # link to the read started while it waited, for whoever reads from it next
+        self.ratings = {} # as last heard from the parent
+        self.matches = 0
+
+    async def serve(self, host, port):
+        ''' serves bots until cancelled, sharing the port with the other workers'''
+        server = await asyncio.start_server(self.handle, host, port, reuse_port = True)
+        matchmaker = asyncio.ensure_future(self.matchmake())
+        try:
+            await server.serve_forever()
+        finally:
+            matchmaker.cancel()
+
+    async def handle(self, reader, writer):
+        ''' serves one bot, putting it in the lobby every time it joins'''
+        link = Link(reader, writer)
+        while True:
+            payload = await (self.reads.pop(link, None) or link.recv())
+            if payload is None or payload[0] != JOIN:
+                break
+            done = asyncio.get_running_loop().create_future()
+            waiting = (payload[1:].decode(errors = 'replace'), link, done)
+            self.lobby.append(waiting)
+            # reads on while waiting, so a bot leaving the lobby isn't paired, the match takes over the read
+            received = self.reads[link] = asyncio.ensure_future(link.recv())
+            await asyncio.wait([received, done], return_when = asyncio.FIRST_COMPLETED)
+            if waiting in self.lobby: # gone, bots send nothing before their match starts
+                self.lobby.remove(waiting)
+                break
+            if not await done:
+                break
+        read = self.reads.pop(link, None)
+        if read is not None:
+            read.cancel()
+        await link.close()
+
+    def read_updates(self):
+        ''' takes in the ratings the parent sent'''
+        while True:
+            try:
+                changed = self.updates.get_nowait()
+            except queue.Empty:
+                return
+            self.ratings.update(changed)
+
+    async def matchmake(self):
+        ''' pairs up the bots in the lobby every MATCHMAKING_INTERVAL, each with the closest rated one'''
+        while True:
+            await asyncio.sleep(MATCHMAKING_INTERVAL)
+            self.read_updates()
+            lobby, self.lobby = self.lobby, []
+            if len(lobby) % PLAYERS:
+                self.lobby = lobby[-(len(lobby) % PLAYERS):] # the latest wait for the next round
+                lobby = lobby[:-(len(lobby) % PLAYERS)]
+            lobby.sort(key = lambda waiting: self.ratings.get(waiting[0], START_RATING))
+            for i in range(0, len(lobby), PLAYERS):
+                asyncio.ensure_future(self.play(lobby[i:i + PLAYERS]))
+
+    async def get_move(self, link, turn):
+        ''' the bot's move on turn, None if it doesn't answer in time or with anything else'''
+        try:
+            payload = await asyncio.wait_for(self.reads.pop(link, None) or link.recv(), TURN_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        if payload is None or len(payload) != PLACE_HEADER.size + MOVE.size or payload[0] != PLACE:
+            return None
+        if PLACE_HEADER.unpack_from(payload)[1] != turn:
+            return None
+        return MOVE.unpack_from(payload, PLACE_HEADER.size)
+
+    async def play(self, players):
+        ''' plays a match between the (name, link, future) of the players and reports the result'''
+        self.matches += 1
+        number = self.matches
+        start = time.perf_counter()
+        seeds = [random.getrandbits(64) for player in players]
+        match = Match([Engine(seed, self.backend) for seed in seeds])
+        links = [link for name, link, done in players]
+        connected = [True] * len(players)
+        for player, link in enumerate(links):
+            link.send(START_HEADER.pack(START, player, len(players)) + b''.join(SEED.pack(seed) for seed in seeds))
+
+        moves = [NO_MOVE] * len(players)
+        turn = 0
+        while not match.is_over() and turn < self.max_turns:
+            payload = TURN_HEADER.pack(TURN, turn) + b''.join(MOVE.pack(*move) for move in moves)
+            playing = match.playing
+            for player in playing:
+                links[player].send(payload)
+            replies = await asyncio.gather(*(self.get_move(links[player], turn) for player in playing))
+
+            moves = [NO_MOVE] * len(players)
+            for player, move in zip(playing, replies):
+                if move is None: # too slow or gone, its connection can't be trusted either
+                    connected[player] = False
+                    match.engines[player].game_over = True
+                else:
+                    moves[player] = move
+            match.place([to_placement(move) for move in moves])
+            turn += 1
+
+        winner = match.get_winner()
+        for link, good in zip(links, connected):
+            if good:
+                link.send(END_HEADER.pack(END, NO_WINNER if winner is None else winner))
+        for (name, link, done), good in zip(players, connected):
+            done.set_result(good)
+        self.results.put({'shard': self.number, 'match': number, 'players': [name for name, link, done in players],
+                          'winner': winner, 'turns': turn, 'lines': [engine.score for engine in match.engines],
+                          'seconds': round(time.perf_counter() - start, 4)})
+
+def run_shard(number, host, port, results, updates, backend, max_turns):
+    ''' worker process entry point'''
+    try:
+        asyncio.run(Shard(number, results, updates, backend, max_turns).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+def serve(host = '', port = PORT, workers = os.cpu_count(), backend = 'bits', max_turns = MAX_TURNS,
+          seconds = None, out = sys.stdout, log = sys.stderr):
+    '''
+    runs the server on workers processes for seconds, or until interrupted, writing every match
+    as a JSON line with the players' new ratings, and the matches a second per core to log
+    returns the ratings by name
+    '''
+    results = multiprocessing.Queue()
+    updates = [multiprocessing.Queue() for i in range(workers)]
+    processes = [multiprocessing.Process(target = run_shard, daemon = True,
+                                         args = (i, host, port, results, updates[i], backend, max_turns))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    ratings = {}
+    matches = reported = 0
+    start = last_report = time.perf_counter()
+    try:
+        while seconds is None or time.perf_counter() - start < seconds:
+            try:
+                result = results.get(timeout = 0.5)
+            except queue.Empty:
+                result = None
+            if result is not None:
+                players = result['players']
+                changes = update_ratings(ratings, players, result['winner'])
+                changed = [(name, ratings[name]) for name in players]
+                for shard_updates in updates:
+                    shard_updates.put(changed)
+                result['ratings'] = [round(ratings[name], 1) for name in players]
+                result['changes'] = [round(change, 1) for change in changes]
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                matches += 1
+
+            now = time.perf_counter()
+            if now - last_report >= REPORT_EVERY:
+                rate = (matches - reported) / (now - last_report)
+                log.write('%d matches, %.1f matches/s, %.1f matches/s per core\n' % (matches, rate, rate / workers))
+                reported, last_report = matches, now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+    elapsed = time.perf_counter() - start
+    log.write('%d matches in %.1fs on %d workers (%.1f matches/s, %.1f per core)\n' %
+              (matches, elapsed, workers, matches / elapsed, matches / elapsed / workers))
+    for name in sorted(ratings, key = ratings.get, reverse = True)[:10]:
+        log.write('%8.1f %s\n' % (ratings[name], name))
+    return ratings
+
+async def play_bot(host, port, name, policy, until):
+    '''
+    a scripted bot joining match after match until perf_counter() reaches until,
+    placing its pieces where policy, a selfplay policy, says
+    returns the number of matches it played
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    link = Link(reader, writer)
+    played = 0
+    while time.perf_counter() < until:
+        link.send(bytes([JOIN]) + name.encode())
+        try: # nobody may be left to play once the time is up
+            payload = await asyncio.wait_for(link.recv(), max(until - time.perf_counter(), 0) + 1)
+        except asyncio.TimeoutError:
+            break
+        if payload is None:
+            break
+        kind, player, players = START_HEADER.unpack_from(payload)
+        seeds = [SEED.unpack_from(payload, START_HEADER.size + i * SEED.size)[0] for i in range(players)]
+        match = Match([Engine(seed, 'bits') for seed in seeds])
+        engine = match.engines[player]
+        choose = policy(seeds[player])
+
+        while True:
+            payload = await link.recv()
+            if payload is None or payload[0] == END:
+                break
+            turn = TURN_HEADER.unpack_from(payload)[1]
+            if turn: # the moves of the last turn, played on the bot's own copy of the match
+                moves = [MOVE.unpack_from(payload, TURN_HEADER.size + i * MOVE.size) for i in range(players)]
+                for other, move in enumerate(moves):
+                    if move[0] == NO_ROTATION:
+                        match.engines[other].game_over = True
+                match.place([to_placement(move) for move in moves])
+            rotation, x, *y = choose(engine)
+            link.send(PLACE_HEADER.pack(PLACE, turn) + MOVE.pack(rotation, x, y[0] if y else NO_Y))
+        if payload is None:
+            break
+        played += 1
+    await link.close()
+    return played
+
+def run_load(host, port, clients, spec, seconds, first):
+    ''' load generator process entry point, plays clients bots at once, returns their matches'''
+    policy = load_policy(spec)
+    until = time.perf_counter() + seconds
+    async def play_all():
+        return await asyncio.gather(*(play_bot(host, port, 'bot%d' % (first + i), policy, until)
+                                      for i in range(clients)))
+    return sum(asyncio.run(play_all()))
+
+def load(host = 'localhost', port = PORT, clients = 100, processes = os.cpu_count(),
+         spec = 'selfplay:random_policy', seconds = 10, log = sys.stderr):
+    ''' plays clients scripted bots against a server for seconds, spread over processes, returns their matches'''
+    start = time.perf_counter()
+    shares = [clients // processes + (i < clients % processes) for i in range(processes)]
+    firsts = [sum(shares[:i]) for i in range(processes)]
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(run_load, host, port, share, spec, seconds, first)
+                   for share, first in zip(shares, firsts) if share]
+        matches = sum(future.result() for future in futures) // PLAYERS
+    elapsed = time.perf_counter() - start
+    log.write('%d bots played %d matches in %.1fs (%.1f matches/s)\n' % (clients, matches, elapsed, matches / elapsed))
+    return matches
+
+def main(argv = None):
+    ''' command line entry point, runs the server or the load generator'''
+    parser = argparse.ArgumentParser(description = 'Headless Tetris matches between bots over the network')
+    parser.add_argument('command', choices = ['server', 'load'], help = 'host matches, or play bots against a server')
+    parser.add_argument('--host', default = None, help = 'address to listen on, or of the server')
+    parser.add_argument('--port', type = int, default = PORT, help = 'port to listen on, or of the server')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'server worker processes')
+    parser.add_argument('--backend', default = 'bits', help = 'board backend, list or bits')
+    parser.add_argument('--max-turns', type = int, default = MAX_TURNS, help = 'turns before a match is a draw')
+    parser.add_argument('--clients', type = int, default = 100, help = 'bots the load generator plays')
+    parser.add_argument('--processes', type = int, default = os.cpu_count(), help = 'load generator processes')
+    parser.add_argument('--policy', default = 'selfplay:random_policy', help = 'module:function the bots play with')
+    parser.add_argument('--seconds', type = float, default = None, help = 'how long to run, forever by default for the server')
+    args = parser.parse_args(argv)
+
+    if args.command == 'server':
+        serve(args.host or '', args.port, args.workers, args.backend, args.max_turns, args.seconds)
+    else:
+        load(args.host or 'localhost', args.port, args.clients, args.processes, args.policy, args.seconds or 10)
+
+if __name__ == "__main__":
+    main()